@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Create inspire_records_links table."""
+
+from __future__ import absolute_import, division, print_function
+
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3ba57d8a2ac7'
+down_revision = 'b646d3592dd5'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        'inspire_records_links',
+        sa.Column(
+            'source_id',
+            sqlalchemy_utils.types.UUIDType,
+            primary_key=True,
+            nullable=False,
+        ),
+        sa.Column('path', sa.String(255), primary_key=True, nullable=False),
+        sa.Column('target_pid_type', sa.String(6), primary_key=True, nullable=False),
+        sa.Column('target_pid_value', sa.String(255), primary_key=True, nullable=False),
+    )
+    op.create_index(
+        'ix_inspire_records_links_target',
+        'inspire_records_links',
+        ['target_pid_type', 'target_pid_value'],
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_index(
+        'ix_inspire_records_links_target',
+        table_name='inspire_records_links',
+    )
+    op.drop_table('inspire_records_links')
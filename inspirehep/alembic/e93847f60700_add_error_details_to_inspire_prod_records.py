@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Add error details to inspire_prod_records."""
+
+from __future__ import absolute_import, division, print_function
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e93847f60700'
+down_revision = '76c1559b272b'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.add_column(
+        'inspire_prod_records',
+        sa.Column('collection', sa.String(32), nullable=True),
+    )
+    op.add_column(
+        'inspire_prod_records',
+        sa.Column('error_stage', sa.String(32), nullable=True),
+    )
+    op.add_column(
+        'inspire_prod_records',
+        sa.Column('error_validator', sa.String(64), nullable=True),
+    )
+    op.add_column(
+        'inspire_prod_records',
+        sa.Column('error_schema_path', sa.Text(), nullable=True),
+    )
+    op.add_column(
+        'inspire_prod_records',
+        sa.Column('error_fingerprint', sa.String(40), nullable=True),
+    )
+    op.create_index(
+        'ix_inspire_prod_records_error_fingerprint',
+        'inspire_prod_records',
+        ['error_fingerprint'],
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_index(
+        'ix_inspire_prod_records_error_fingerprint',
+        table_name='inspire_prod_records',
+    )
+    op.drop_column('inspire_prod_records', 'error_fingerprint')
+    op.drop_column('inspire_prod_records', 'error_schema_path')
+    op.drop_column('inspire_prod_records', 'error_validator')
+    op.drop_column('inspire_prod_records', 'error_stage')
+    op.drop_column('inspire_prod_records', 'collection')
@@ -76,7 +76,11 @@ CELERYBEAT_SCHEDULE = {
     'journal_kb_builder': {
         'task': 'inspirehep.modules.refextract.tasks.create_journal_kb_file',
         'schedule': crontab(minute='0', hour='*/1'),
-    }
+    },
+    'index_queue': {
+        'task': 'inspirehep.modules.records.tasks.process_index_queue',
+        'schedule': crontab(minute='*'),
+    },
 }
 # Cache
 # =====
@@ -342,6 +346,10 @@ RECORDS_REST_ENDPOINTS = dict(
         search_serializers={
             'application/json': ('invenio_records_rest.serializers'
                                  ':json_v1_search'),
+            'application/vnd+inspire.full+json': (
+                'inspirehep.modules.records.serializers'
+                ':json_literature_full_v1_search'
+            ),
             'application/vnd+inspire.brief+json': (
                 'inspirehep.modules.records.serializers'
                 ':json_literature_brief_v1_search'
@@ -391,7 +399,11 @@ RECORDS_REST_ENDPOINTS = dict(
         record_class='inspirehep.modules.records.api:InspireRecord',
         search_serializers={
             'application/json': ('invenio_records_rest.serializers'
-                                 ':json_v1_search')
+                                 ':json_v1_search'),
+            'application/vnd+inspire.full+json': (
+                'inspirehep.modules.records.serializers'
+                ':json_literature_full_v1_search'
+            ),
         },
         list_route='/literature/db',
         item_route='/literature/<pid(lit,record_class="inspirehep.modules.records.api:InspireRecord"):pid_value>/db',
@@ -1147,6 +1159,23 @@ INDEXER_DEFAULT_INDEX = "records-hep"
 INDEXER_DEFAULT_DOC_TYPE = "hep"
 INDEXER_REPLACE_REFS = False
 INDEXER_BULK_REQUEST_TIMEOUT = float(120)
+INDEXER_BULK_MIN_BYTES = 2 ** 20
+"""Size of the first bulk requests, and smallest size they can shrink to."""
+INDEXER_BULK_MAX_BYTES = 50 * 2 ** 20
+"""Largest size bulk requests can grow to."""
+INDEXER_BULK_TARGET_LATENCY = float(2)
+"""Seconds that bulk requests should take, their size being adapted to it."""
+INDEXER_BULK_LOAD_INDICES = 'records-*'
+"""Indices tuned for loading many documents by ``bulk_load_mode``."""
+INDEXER_ASYNC = True
+"""Whether committed records are queued to be indexed in bulk by a Celery task,
+instead of being indexed before the commit returns."""
+INDEXER_QUEUE_DELAY = float(2)
+"""Seconds to wait for more records to be committed before indexing the queue."""
+INDEXER_QUEUE_BATCH_SIZE = 500
+"""Number of records popped from the queue to be indexed at once."""
+INDEXER_QUEUE_MAX_ATTEMPTS = 5
+"""Number of failures in a row after which a record is no longer queued."""
 
 # OAuthclient
 # ===========
@@ -1386,6 +1415,62 @@ CRAWLER_SETTINGS = {
 # ===================
 LEGACY_PID_PROVIDER = None  # e.g. "http://example.org/batchuploader/allocaterecord"
 
+# Recid index
+# ===========
+INSPIRE_PID_INDEX_MAX_AGE = 60 * 60
+"""Seconds after which the in-memory index from recids to record UUIDs of a
+process is rebuilt from the DB, to drop the identifiers deleted by others."""
+INSPIRE_PID_INDEX_MAX_CHANGES = 1000
+"""Number of committed changes kept on top of the index before merging them."""
+INSPIRE_PID_INDEX_CHECK_INTERVAL = 0.5
+"""Seconds during which the index trusts its entries without fetching the
+recids changed by other processes from Redis."""
+INSPIRE_PID_INDEX_MAX_SHARED_CHANGES = 100000
+"""Number of changed recids kept in Redis for the indexes of other processes.
+An index that missed more of them than this is rebuilt."""
+
+# Author names cache
+# ==================
+INSPIRE_NAME_CACHE_SIZE = 100000
+"""Number of full names whose name variations and phonetic blocks are kept in
+the memory of each process."""
+INSPIRE_NAME_CACHE_REDIS = False
+"""Whether to share the name variations and phonetic blocks among processes by
+also storing them in Redis."""
+INSPIRE_NAME_CACHE_REDIS_EXPIRE = 30 * 24 * 60 * 60
+"""Seconds after which the values stored in Redis expire."""
+
+# Author lists
+# ============
+INSPIRE_AUTHORS_PREVIEW_SIZE = 10
+"""Number of authors of a Literature record kept in its ``authors_preview``."""
+INSPIRE_SEARCH_SOURCE_EXCLUDES = {
+    'records-hep': ['authors'],
+}
+"""Fields left out of the search results of the REST API, by index.
+
+Literature hits carry ``authors_preview`` and ``number_of_authors`` instead
+of the full list of authors. The list is fetched back with
+``restore_authors`` only by the export serializers and by the
+``application/vnd+inspire.full+json`` one.
+"""
+
+# Documents and figures
+# =====================
+INSPIRE_FILES_DOWNLOAD_WORKERS = 8
+"""Number of documents and figures of a record downloaded at the same time."""
+INSPIRE_FILES_DOWNLOAD_MAX_PER_HOST = 4
+"""Number of documents and figures downloaded at the same time from a host."""
+INSPIRE_FILES_DOWNLOAD_TIMEOUT = 60
+"""Seconds to wait for a host to connect or to send data."""
+INSPIRE_FILES_DOWNLOAD_RETRIES = 3
+"""Times a download is retried on connection errors and 5xx responses."""
+INSPIRE_FILES_DEDUPLICATION = True
+"""Whether files with the same contents are stored only once.
+
+See :func:`inspirehep.modules.records.files.put_file`.
+"""
+
 # Inspire subject translation
 # ===========================
 ARXIV_TO_INSPIRE_CATEGORY_MAPPING = {
@@ -1553,6 +1638,30 @@ ARXIV_TO_INSPIRE_CATEGORY_MAPPING = {
 }
 
 
+# Migrator
+# ========
+MIGRATOR_CONTINUOUS_BATCH_SIZE = 100
+"""Number of records migrated per transaction by ``continuous_migration``."""
+MIGRATOR_CONTINUOUS_PARTITIONS = 4
+"""Number of queues, each with its own lock, in which the records pushed by
+Legacy are partitioned by recid to be migrated in parallel.
+
+.. note::
+
+   Make sure all the ``legacy_records:*`` queues are empty before changing
+   it, otherwise the updates of a record might be migrated out of order.
+"""
+MIGRATOR_MARCXML_CODEC = 'zlib'
+"""Codec compressing the MARCXML stored in ``InspireProdRecords``, either
+``zlib`` or ``zstd``. The latter needs the ``zstandard`` package and a
+dictionary trained with ``inspirehep migrator recompress --train``, otherwise
+``zlib`` is used."""
+MIGRATOR_ZSTD_LEVEL = 9
+"""Compression level of the ``zstd`` codec."""
+MIGRATOR_ZSTD_DICTIONARY_SIZE = 110 * 2 ** 10
+"""Size in bytes of the dictionaries trained for the ``zstd`` codec."""
+
+
 # Configuration for the $ref updater
 # ==================================
 INSPIRE_REF_UPDATER_WHITELISTS = {
@@ -1593,3 +1702,11 @@ INSPIRE_REF_UPDATER_WHITELISTS = {
     ],
 }
 """Controls which fields are updated when the referred record is updated."""
+INSPIRE_REF_UPDATER_BATCH_SIZE = 500
+"""Number of records updated in each transaction by the $ref updater."""
+
+INSPIRE_REF_UPDATER_USE_LINKS = False
+"""Find the records to update in the table of links instead of searching.
+
+Enable it only after filling the table with ``inspirehep links backfill``.
+"""
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Manage the authors."""
+
+from __future__ import absolute_import, division, print_function
+
+import click
+from flask import current_app
+
+from flask_cli import with_appcontext
+
+from .cache import get_name_caches_stats, measure_name_caches
+
+
+@click.group()
+def authors():
+    """Commands related to the authors."""
+
+
+@authors.command()
+@with_appcontext
+def name_cache_stats():
+    """Show the hit rates of the caches of the names of authors."""
+    if not current_app.config.get('INSPIRE_NAME_CACHE_REDIS', False):
+        click.echo('INSPIRE_NAME_CACHE_REDIS is not set, the statistics of '
+                   'the workers are not shared with this process.')
+
+    click.echo('{:<16} {:>12} {:>12} {:>12} {:>10}'.format(
+        'cache', 'hits', 'redis hits', 'misses', 'hit rate'))
+    for name, stats in sorted(get_name_caches_stats().items()):
+        click.echo('{:<16} {:>12} {:>12} {:>12} {:>10.2%}'.format(
+            name, stats['hits'], stats['redis_hits'], stats['misses'],
+            stats['hit_rate']))
+
+
+@authors.command()
+@click.option('--records', type=int, default=100,
+              help='Number of synthetic records.')
+@click.option('--authors', 'authors_count', type=int, default=3000,
+              help='Number of authors of each record.')
+@click.option('--names', type=int, default=5000,
+              help='Number of distinct full names among all the records.')
+@with_appcontext
+def benchmark_name_caches(records, authors_count, names):
+    """Compare the computation of the names of authors with the caches."""
+    click.echo('{:<10} {:>14}'.format('names', 'ms per record'))
+    for name, elapsed in measure_name_caches(records, authors_count, names):
+        click.echo('{:<10} {:>14.1f}'.format(name, elapsed))
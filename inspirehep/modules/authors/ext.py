@@ -24,6 +24,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+from .cli import authors
 from .views import blueprint
 
 
@@ -33,5 +34,6 @@ class InspireAuthors(object):
             self.init_app(app)
 
     def init_app(self, app):
+        app.cli.add_command(authors)
         app.register_blueprint(blueprint)
         app.extensions['inspire-authors'] = self
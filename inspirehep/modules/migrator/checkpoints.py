@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Checkpoints of the migration of a dump, to resume it if interrupted."""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import time
+
+from flask import current_app
+from redis import StrictRedis
+from six import iteritems
+
+
+CHECKPOINT_KEY = 'migrator:checkpoint:{source}'
+CHECKPOINT_CHUNKS_KEY = 'migrator:checkpoint:{source}:chunks'
+CHECKPOINT_DONE_KEY = 'migrator:checkpoint:{source}:done'
+
+
+def _get_redis():
+    return StrictRedis.from_url(current_app.config['CACHE_REDIS_URL'])
+
+
+def complete_chunk(source, chunk_id):
+    """Record that a dispatched chunk was committed."""
+    _get_redis().sadd(CHECKPOINT_DONE_KEY.format(source=source), chunk_id)
+
+
+class MigrationCheckpoint(object):
+    """Progress of the migration of a dump, stored in Redis.
+
+    A position in the dump is the number of records read so far, and the
+    offset in the decompressed stream right after the last one of them,
+    which is ``None`` when the dump is split by ``expat``. The checkpoint
+    holds the position right after the last dispatched chunk and, for each
+    dispatched chunk, the positions it started from and ended at, so that
+    the chunks that never completed can be found again. Chunks are marked
+    as completed by ``migrate_chunk`` with :func:`complete_chunk`.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.key = CHECKPOINT_KEY.format(source=source)
+        self.chunks_key = CHECKPOINT_CHUNKS_KEY.format(source=source)
+        self.done_key = CHECKPOINT_DONE_KEY.format(source=source)
+        self.started = None
+        self.chunk_id = -1
+        self.position = (0, 0)
+
+    def start(self):
+        """Start from the beginning of the dump, dropping any checkpoint."""
+        self.started = time.time()
+        self.chunk_id = -1
+        self.position = (0, 0)
+
+        pipeline = _get_redis().pipeline()
+        pipeline.delete(self.key, self.chunks_key, self.done_key)
+        pipeline.hmset(self.key, self._get_state())
+        pipeline.execute()
+
+    def load(self):
+        """Load the checkpoint, returning whether there was one."""
+        state = _get_redis().hgetall(self.key)
+        if not state:
+            return False
+
+        state = dict((key.decode('utf8'), value) for key, value in iteritems(state))
+        self.started = float(state['started'])
+        self.chunk_id = int(state['chunk'])
+        self.position = (
+            int(state['records']),
+            int(state['offset']) if state['offset'] != b'' else None,
+        )
+        return True
+
+    def save(self, start, end):
+        """Record that a chunk is being dispatched.
+
+        Args:
+            start(tuple): the position the chunk started from.
+            end(tuple): the position right after its last record.
+
+        Returns:
+            int: the identifier of the chunk, to pass to :func:`complete_chunk`.
+        """
+        self.chunk_id += 1
+        self.position = end
+
+        pipeline = _get_redis().pipeline()
+        pipeline.hset(self.chunks_key, self.chunk_id, json.dumps({
+            'records': start[0],
+            'offset': start[1],
+            'end': end[0],
+        }))
+        pipeline.hmset(self.key, self._get_state())
+        pipeline.execute()
+
+        return self.chunk_id
+
+    def reconcile(self):
+        """Find the records to migrate again after an interruption.
+
+        The position of the checkpoint is moved back to the start of the
+        earliest chunk that did not complete, and the dispatched chunks are
+        forgotten, as they are read again from there.
+
+        Returns:
+            list: the sorted ranges of the numbers of the records read from
+            the dump by the chunks that completed, which are skipped, as
+            ``(first, last)`` pairs counting from 1.
+        """
+        redis = _get_redis()
+
+        done = set(int(chunk_id) for chunk_id in redis.smembers(self.done_key))
+        completed = []
+        for chunk_id, chunk in iteritems(redis.hgetall(self.chunks_key)):
+            chunk = json.loads(chunk)
+            if int(chunk_id) in done:
+                completed.append((chunk['records'] + 1, chunk['end']))
+            else:
+                self.position = min(
+                    self.position, (chunk['records'], chunk['offset']))
+
+        pipeline = redis.pipeline()
+        pipeline.delete(self.chunks_key, self.done_key)
+        pipeline.hmset(self.key, self._get_state())
+        pipeline.execute()
+
+        return sorted(completed)
+
+    def clear(self):
+        """Drop the checkpoint, e.g. once the migration completed."""
+        _get_redis().delete(self.key, self.chunks_key, self.done_key)
+
+    def _get_state(self):
+        records, offset = self.position
+        return {
+            'started': repr(self.started),
+            'chunk': self.chunk_id,
+            'records': records,
+            'offset': offset if offset is not None else '',
+        }
@@ -26,41 +26,38 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import csv
-import traceback
-import sys
+import json
+import time
 
-from itertools import dropwhile
 import click
 import requests
-import jsonschema
+from six import text_type
+from sqlalchemy import func, or_
 
 from flask_cli import with_appcontext
+from invenio_db import db
 
-from inspire_schemas.api import validate
-from inspire_utils.helpers import force_list
+from inspirehep.modules.records.indexer import bulk_load_mode
 
 from .tasks import (
     add_citation_counts,
+    fetch_records,
+    measure_citations_counting,
     migrate,
     remigrate_records,
     migrate_chunk,
+    reindex_records,
     split_blob,
-    create_record,
-    marc_create_record,
 )
-from .models import InspireProdRecords
-
-REAL_COLLECTIONS = (
-    'INSTITUTION',
-    'EXPERIMENT',
-    'JOURNALS',
-    'JOURNALSNEW',
-    'HEPNAMES',
-    'JOB',
-    'JOBHIDDEN',
-    'CONFERENCES',
-    'DATA',
+from .codecs import (
+    get_default_codec,
+    get_latest_zstd_codec,
+    measure_codecs,
+    recompress_records,
+    train_dictionary,
 )
+from .models import InspireProdRecords
+from .stats import STAGES, get_stats
 
 
 @click.group()
@@ -77,10 +74,27 @@ def migrator():
               default=False, help='Remigrate all records')
 @click.option('--wait', '-w', type=bool, default=False,
               help='Wait for migrator to complete.')
+@click.option('--processes', '-p', type=int, default=None,
+              help='Stream the file and convert records on this many local processes.')
+@click.option('--bulk', is_flag=True, default=False,
+              help='Insert new records in bulk, e.g. for an initial load.')
+@click.option('--delta', '-d', is_flag=True, default=False,
+              help='Skip records that did not change since last migrated.')
+@click.option('--resume', is_flag=True, default=False,
+              help='Resume an interrupted migration of the same file.')
+@click.option('--bulk-load', is_flag=True, default=False,
+              help='Disable refreshes and replicas of the indices until all '
+                   'records are migrated. Implies --wait.')
+@with_appcontext
 def populate(file_input=None,
              remigrate_broken=False,
              remigrate_all=False,
-             wait=False):
+             wait=False,
+             processes=None,
+             bulk=False,
+             delta=False,
+             resume=False,
+             bulk_load=False):
     """Populates the system with records from migrator files.
 
     Usage: inveniomanage migrator populate -f prodsync20151117173222.xml.gz
@@ -96,7 +110,24 @@ def populate(file_input=None,
     elif file_input:
         click.echo("Migrating records from file: {0}".format(file_input))
 
-        migrate(os.path.abspath(file_input), wait_for_results=wait)
+        def _migrate():
+            migrate(
+                os.path.abspath(file_input),
+                wait_for_results=wait or bulk_load,
+                processes=processes,
+                bulk=bulk,
+                delta=delta,
+                resume=resume,
+            )
+
+        if bulk_load:
+            start = time.time()
+            with bulk_load_mode():
+                _migrate()
+            click.echo('Migrated and indexed in {:.1f}s, see `migrator stats` '
+                       'for the throughput of each stage.'.format(time.time() - start))
+        else:
+            _migrate()
 
 
 @migrator.command()
@@ -108,89 +139,234 @@ def one(recid):
     migrate_chunk(split_blob(response.content))
 
 
+@migrator.command()
+@click.option('--file-input', '-f', type=click.File('r'),
+              help='File with the recids to fetch, one per line.')
+@click.option('--range', '-r', 'recid_range', nargs=2, type=int, default=None,
+              help='First and last recid to fetch.')
+@click.option('--workers', '-w', type=int, default=8,
+              help='Maximum number of requests to legacy in flight.')
+@with_appcontext
+def fetch(file_input, recid_range, workers):
+    """Fetch many records from INSPIRE legacy concurrently and migrate them."""
+    recids = []
+    if file_input:
+        recids.extend(int(line) for line in file_input if line.strip())
+    if recid_range:
+        recids.extend(range(recid_range[0], recid_range[1] + 1))
+    if not recids:
+        click.echo('No recids to fetch!', err=True)
+        return
+
+    click.echo('Fetching {} records from INSPIRE legacy'.format(len(recids)))
+    failed = fetch_records(recids, workers=workers)
+    if failed:
+        click.echo('Could not fetch {} records: {}'.format(
+            len(failed), ', '.join(str(recid) for recid in sorted(failed))), err=True)
+
+
+@migrator.command()
+@click.option('--pid-type', '-t', multiple=True,
+              help='Only reindex the records of this type, e.g. lit.')
+@click.option('--bulk-load/--no-bulk-load', default=True,
+              help='Disable refreshes and replicas of the indices meanwhile.')
+@with_appcontext
+def reindex(pid_type, bulk_load):
+    """Reindex all records from the DB in bulk."""
+    click.echo('Reindexing records...')
+    if bulk_load:
+        with bulk_load_mode():
+            indexer = reindex_records(pid_type)
+    else:
+        indexer = reindex_records(pid_type)
+    click.echo('... DONE: {}.'.format(indexer.format_throughput()))
+
+
+@migrator.command()
+@click.option('--train', is_flag=True, default=False,
+              help='Train a new dictionary and recompress with it.')
+@click.option('--sample-size', type=int, default=10000,
+              help='Number of records to train the dictionary on.')
+@click.option('--batch-size', '-b', type=int, default=1000,
+              help='Number of records recompressed per transaction.')
+@with_appcontext
+def recompress(train, sample_size, batch_size):
+    """Recompress the stored MARCXML of the records.
+
+    Records are recompressed with a new dictionary when training one, or with
+    the codec used for new records otherwise, see ``MIGRATOR_MARCXML_CODEC``.
+    """
+    if train:
+        click.echo('Training dictionary on {} records...'.format(sample_size))
+        codec_name = train_dictionary(sample_size)
+        click.echo('... DONE: codec {}.'.format(codec_name))
+    else:
+        codec_name = get_default_codec().name
+
+    count, before, after = 0, 0, 0
+    for batch_count, batch_before, batch_after in recompress_records(codec_name, batch_size):
+        count += batch_count
+        before += batch_before
+        after += batch_after
+        click.echo('Recompressed {} records: {:.1f} MB -> {:.1f} MB'.format(
+            count, before / 2 ** 20, after / 2 ** 20))
+
+
+@migrator.command()
+@click.option('--sample-size', type=int, default=1000,
+              help='Number of records to benchmark the codecs on.')
+@with_appcontext
+def benchmark_codecs(sample_size):
+    """Compare the compression ratio and speed of the codecs."""
+    codec_names = ['zlib']
+    zstd_codec = get_latest_zstd_codec()
+    if zstd_codec:
+        codec_names.append(zstd_codec.name)
+
+    click.echo('{:<12} {:>8} {:>16} {:>18}'.format(
+        'codec', 'ratio', 'compress MB/s', 'decompress MB/s'))
+    for name, ratio, compression, decompression in measure_codecs(
+            codec_names, sample_size):
+        click.echo('{:<12} {:>8.2f} {:>16.1f} {:>18.1f}'.format(
+            name, ratio, compression, decompression))
+
+
+@migrator.command()
+@click.option('--records', type=int, default=100000,
+              help='Number of synthetic records citing each other.')
+@click.option('--references', type=int, default=30,
+              help='Average number of references of each record.')
+def benchmark_citations(records, references):
+    """Compare the recount of citations with numpy and with a Counter."""
+    click.echo('{:<8} {:>12} {:>10} {:>12}'.format(
+        'counts', 'counting s', 'join s', 'memory MB'))
+    for name, counting_time, join_time, memory in measure_citations_counting(
+            records, references):
+        click.echo('{:<8} {:>12.2f} {:>10.2f} {:>12.1f}'.format(
+            name, counting_time, join_time, memory))
+
+
 @migrator.command()
 def count_citations():
-    """Adds field citation_count to every record in 'HEP' and calculates its proper value."""
+    """Recomputes the citation_count of every record in 'HEP', e.g. to repair it."""
     click.echo("Adding citation_count to all records")
     add_citation_counts()
 
 
+@migrator.command()
+@click.option('--window', '-w', type=int, default=5,
+              help='Number of minutes to average the statistics over.')
+@click.option('--follow', '-f', is_flag=True, default=False,
+              help='Keep refreshing the statistics every few seconds.')
+@with_appcontext
+def stats(window, follow):
+    """Show the throughput of each stage of the running migrations."""
+    while True:
+        current = get_stats(window)
+        click.echo('{:<8} {:>10} {:>10} {:>10} {:>8}'.format(
+            'stage', 'rec/s', 'p50 (ms)', 'p99 (ms)', 'errors'))
+        for stage in STAGES:
+            if stage not in current:
+                continue
+            click.echo('{:<8} {:>10.1f} {:>10.1f} {:>10.1f} {:>7.2%}'.format(
+                stage,
+                current[stage]['rate'],
+                current[stage]['p50'] * 1000,
+                current[stage]['p99'] * 1000,
+                current[stage]['error_rate'],
+            ))
+        if not current:
+            click.echo('No migration in the last {} minutes.'.format(window))
+
+        if not follow:
+            break
+        time.sleep(5)
+        click.echo()
+
+
 @migrator.command()
 @click.option('--output', '-o', default="/tmp/broken-records.csv",
               help='Specifiy where to report errors.')
+@click.option('--summary', '-s', default=None,
+              help='Specify where to write a JSON summary of the errors.')
 @with_appcontext
-def reporterrors(output):
-    """Reports in a friendly way all failed records and corresponding motivation."""
-    def get_collection(marc_record):
-        collections = set()
-        for field in force_list(marc_record.get('980__')):
-            for v in field.values():
-                for e in force_list(v):
-                    collections.add(e.upper().strip())
-        if 'DELETED' in collections:
-            return 'DELETED'
-        for collection in collections:
-            if collection in REAL_COLLECTIONS:
-                return collection
-        return 'HEP'
+def reporterrors(output, summary):
+    """Reports in a friendly way all failed records and corresponding motivation.
 
-    click.echo("Reporting broken records into {0}".format(output))
-    errors = {}
-    results = InspireProdRecords.query.filter(InspireProdRecords.valid == False) # noqa: ignore=F712
-    results_length = results.count()
-    with click.progressbar(results.yield_per(100), length=results_length) as bar:
-        for obj in bar:
-            marc_record = marc_create_record(obj.marcxml, keep_singletons=False)
-            collection = get_collection(marc_record)
-            if 'DELETED' in collection:
-                continue
-            recid = int(marc_record['001'])
-            try:
-                json_record = create_record(marc_record)
-            except Exception as err:
-                tb = u''.join(traceback.format_tb(sys.exc_info()[2]))
-                errors.setdefault((collection, 'dojson', tb), []).append(recid)
-                continue
+    Records that failed with the same error, as identified by its stage and
+    fingerprint, are grouped together.
+    """
+    def _get_description(stage, validator, schema_path, sample):
+        if stage == 'validation':
+            return u'Failed validating {!r} in {}'.format(validator, schema_path)
+        return sample
 
-            try:
-                validate(json_record)
-            except jsonschema.exceptions.ValidationError as err:
-                exc = [
-                    row
-                    for row in str(err).splitlines()
-                    if row.startswith('Failed validating')
-                ][0]
-                details = u'\n'.join(
-                    dropwhile(
-                        lambda x: not x.startswith('On instance'),
-                        str(err).splitlines()
-                    )
-                )
-                errors.setdefault(
-                    (collection, 'validation', exc), []
-                ).append((recid, details))
-                continue
+    click.echo("Reporting broken records into {0}".format(output))
+    groups = []
+    for row in get_errors_summary():
+        (collection, stage, fingerprint, validator, schema_path, sample,
+         count, recids) = row
+        groups.append({
+            'collection': collection,
+            'stage': stage,
+            'fingerprint': fingerprint,
+            'validator': validator,
+            'schema_path': schema_path,
+            'description': _get_description(stage, validator, schema_path, sample),
+            'count': count,
+            'recids': sorted(recids),
+        })
 
     with open(output, "w") as out:
         csv_writer = csv.writer(out)
-        for (collection, stage, error), elements in errors.iteritems():
-            if stage == 'dojson':
-                csv_writer.writerow((
-                    collection,
-                    stage,
-                    error,
+        for group in groups:
+            csv_writer.writerow([
+                field.encode('utf8') if isinstance(field, text_type) else field
+                for field in (
+                    group['collection'],
+                    group['stage'],
+                    group['description'],
+                    group['count'],
                     '\n'.join(
                         'http://inspirehep.net/record/{}'.format(recid)
-                        for recid in elements
-                    )
-                ))
-            else:
-                for recid, details in elements:
-                    csv_writer.writerow((
-                        collection,
-                        stage,
-                        error,
-                        'http://inspirehep.net/record/{}'.format(recid),
-                        details
-                    ))
+                        for recid in group['recids']
+                    ),
+                )
+            ])
     click.echo("Dumped errors into {}".format(output))
+
+    if summary:
+        with open(summary, "w") as out:
+            json.dump(groups, out, indent=2)
+        click.echo("Dumped errors summary into {}".format(summary))
+
+
+def get_errors_summary():
+    """Group the broken records by collection, stage and error fingerprint.
+
+    Records that were migrated before the details of the errors were stored
+    have no stage nor fingerprint, so they all end up in the same group until
+    they are remigrated.
+    """
+    return db.session.query(
+        InspireProdRecords.collection,
+        InspireProdRecords.error_stage,
+        InspireProdRecords.error_fingerprint,
+        func.min(InspireProdRecords.error_validator),
+        func.min(InspireProdRecords.error_schema_path),
+        func.min(InspireProdRecords.errors),
+        func.count(InspireProdRecords.recid),
+        func.array_agg(InspireProdRecords.recid),
+    ).filter(
+        InspireProdRecords.valid == False,  # noqa: ignore=F712
+        or_(
+            InspireProdRecords.collection.is_(None),
+            InspireProdRecords.collection != 'DELETED',
+        ),
+    ).group_by(
+        InspireProdRecords.collection,
+        InspireProdRecords.error_stage,
+        InspireProdRecords.error_fingerprint,
+    ).order_by(
+        func.count(InspireProdRecords.recid).desc(),
+    )
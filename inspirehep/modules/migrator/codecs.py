@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Codecs compressing the MARCXML of the legacy records."""
+
+from __future__ import absolute_import, division, print_function
+
+import time
+import zlib
+
+from flask import current_app
+from sqlalchemy import bindparam, func, or_
+
+from invenio_db import db
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class LegacyCodec(object):
+    """Codec of the rows stored before the codec was recorded."""
+
+    name = None
+
+    def compress(self, value):
+        return zlib.compress(value)
+
+    def decompress(self, value):
+        try:
+            return zlib.decompress(value)
+        except zlib.error:
+            # Legacy uncompress data?
+            return value
+
+
+class ZlibCodec(object):
+    """Codec compressing each row on its own with zlib."""
+
+    name = 'zlib'
+
+    def compress(self, value):
+        return zlib.compress(value)
+
+    def decompress(self, value):
+        return zlib.decompress(value)
+
+
+class ZstdCodec(object):
+    """Codec compressing with Zstandard and a trained dictionary.
+
+    MARCXML records are small and share most of their markup, which a
+    codec compressing each row on its own cannot take advantage of, while
+    a dictionary trained on a sample of them provides it upfront.
+    """
+
+    def __init__(self, dictionary_id, data):
+        self.name = 'zstd:{}'.format(dictionary_id)
+        dictionary = zstandard.ZstdCompressionDict(data)
+        self._compressor = zstandard.ZstdCompressor(
+            level=current_app.config['MIGRATOR_ZSTD_LEVEL'],
+            dict_data=dictionary,
+            write_content_size=True,
+        )
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+
+    def compress(self, value):
+        return self._compressor.compress(value)
+
+    def decompress(self, value):
+        return self._decompressor.decompress(value)
+
+
+_codecs = {
+    None: LegacyCodec(),
+    'zlib': ZlibCodec(),
+}
+_default_codec = None
+
+
+def get_codec(name):
+    """Get the codec with a name, as stored in ``marcxml_codec``."""
+    if name not in _codecs:
+        _codecs[name] = _load_zstd_codec(int(name.split(':')[1]))
+
+    return _codecs[name]
+
+
+def get_default_codec():
+    """Get the codec compressing new rows, according to ``MIGRATOR_MARCXML_CODEC``.
+
+    Falls back to zlib if Zstandard is not installed or no dictionary was
+    trained yet.
+    """
+    global _default_codec
+    if _default_codec is None:
+        if current_app.config['MIGRATOR_MARCXML_CODEC'] == 'zstd':
+            _default_codec = get_latest_zstd_codec()
+        _default_codec = _default_codec or _codecs['zlib']
+
+    return _default_codec
+
+
+def get_latest_zstd_codec():
+    """Get the Zstandard codec with the latest dictionary, if any."""
+    from .models import InspireProdRecordsDictionary
+    if zstandard is None:
+        return None
+
+    dictionary_id = db.session.query(
+        func.max(InspireProdRecordsDictionary.id)).scalar()
+    if dictionary_id is not None:
+        return get_codec('zstd:{}'.format(dictionary_id))
+
+
+def clear_codecs_cache():
+    """Forget the dictionaries loaded by this process, e.g. after training."""
+    global _default_codec
+    _default_codec = None
+    for name in list(_codecs):
+        if name not in (None, 'zlib'):
+            del _codecs[name]
+
+
+def _load_zstd_codec(dictionary_id):
+    from .models import InspireProdRecordsDictionary
+    dictionary = InspireProdRecordsDictionary.query.get(dictionary_id)
+
+    return ZstdCodec(dictionary.id, dictionary.data)
+
+
+def _get_sample(size):
+    from .models import InspireProdRecords
+    table = InspireProdRecords.__table__
+    rows = db.session.execute(
+        table.select().with_only_columns([
+            table.c.marcxml,
+            table.c.marcxml_codec,
+        ]).order_by(func.random()).limit(size))
+
+    return [
+        InspireProdRecords.decompress_marcxml(row.marcxml, row.marcxml_codec)
+        for row in rows
+    ]
+
+
+def train_dictionary(sample_size=10000):
+    """Train a dictionary on a random sample of the records and store it.
+
+    Returns:
+        str: the name of the codec using the new dictionary.
+    """
+    from .models import InspireProdRecordsDictionary
+    if zstandard is None:
+        raise ImportError('The zstandard package is needed to train dictionaries.')
+
+    dictionary = zstandard.train_dictionary(
+        current_app.config['MIGRATOR_ZSTD_DICTIONARY_SIZE'],
+        _get_sample(sample_size),
+    )
+    stored = InspireProdRecordsDictionary(data=dictionary.as_bytes())
+    db.session.add(stored)
+    db.session.commit()
+
+    clear_codecs_cache()
+    return 'zstd:{}'.format(stored.id)
+
+
+def recompress_records(codec_name, batch_size=1000):
+    """Recompress with a codec all the rows that use another one.
+
+    Rows are read and updated in batches of increasing recid, each in its
+    own transaction, so that it can be interrupted and run again.
+
+    Yields:
+        tuple: the number of rows recompressed in each batch, with their size
+        before and after.
+    """
+    from .models import InspireProdRecords
+    table = InspireProdRecords.__table__
+    codec = get_codec(codec_name)
+
+    update = table.update().where(
+        table.c.recid == bindparam('_recid'),
+    ).values(
+        marcxml=bindparam('_marcxml'),
+        marcxml_codec=bindparam('_marcxml_codec'),
+    )
+
+    last_recid = -1
+    while True:
+        rows = db.session.execute(
+            table.select().with_only_columns([
+                table.c.recid,
+                table.c.marcxml,
+                table.c.marcxml_codec,
+            ]).where(
+                table.c.recid > last_recid,
+            ).where(or_(
+                table.c.marcxml_codec.is_(None),
+                table.c.marcxml_codec != codec.name,
+            )).order_by(table.c.recid).limit(batch_size)
+        ).fetchall()
+        if not rows:
+            return
+
+        values = [
+            {
+                '_recid': row.recid,
+                '_marcxml': codec.compress(
+                    InspireProdRecords.decompress_marcxml(row.marcxml, row.marcxml_codec)),
+                '_marcxml_codec': codec.name,
+            } for row in rows
+        ]
+        db.session.execute(update, values)
+        db.session.commit()
+
+        last_recid = rows[-1].recid
+        yield (
+            len(rows),
+            sum(len(row.marcxml) for row in rows),
+            sum(len(value['_marcxml']) for value in values),
+        )
+
+
+def measure_codecs(codec_names, sample_size=1000):
+    """Measure the compression ratio and speed of codecs on a sample.
+
+    Returns:
+        list: for each codec, its name, the compression ratio and the
+        compression and decompression speeds in MB/s.
+    """
+    sample = _get_sample(sample_size)
+    size = sum(len(record) for record in sample)
+
+    results = []
+    for name in codec_names:
+        codec = get_codec(name)
+
+        start = time.time()
+        compressed = [codec.compress(record) for record in sample]
+        compression_time = time.time() - start
+
+        start = time.time()
+        for value in compressed:
+            codec.decompress(value)
+        decompression_time = time.time() - start
+
+        results.append((
+            name,
+            size / max(sum(len(value) for value in compressed), 1),
+            size / 2 ** 20 / max(compression_time, 1e-6),
+            size / 2 ** 20 / max(decompression_time, 1e-6),
+        ))
+
+    return results
@@ -24,12 +24,14 @@
 
 from __future__ import absolute_import, division, print_function
 
+import hashlib
 from datetime import datetime
-from zlib import compress, decompress, error
 
 from invenio_db import db
 from sqlalchemy.ext.hybrid import hybrid_property
 
+from .codecs import get_codec, get_default_codec
+
 
 class InspireProdRecords(db.Model):
     __tablename__ = 'inspire_prod_records'
@@ -37,18 +39,50 @@ class InspireProdRecords(db.Model):
     recid = db.Column(db.Integer, primary_key=True, index=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     _marcxml = db.Column('marcxml', db.LargeBinary, nullable=False)
+    marcxml_hash = db.Column(db.String(40), nullable=True)
+    marcxml_codec = db.Column(db.String(16), nullable=True)
     valid = db.Column(db.Boolean, default=None, nullable=True, index=True)
     errors = db.Column(db.Text(), nullable=True)
+    collection = db.Column(db.String(32), nullable=True)
+    error_stage = db.Column(db.String(32), nullable=True)
+    error_validator = db.Column(db.String(64), nullable=True)
+    error_schema_path = db.Column(db.Text(), nullable=True)
+    error_fingerprint = db.Column(db.String(40), nullable=True, index=True)
 
     @hybrid_property
     def marcxml(self):
         """marcxml column wrapper to compress/decompress on the fly."""
-        try:
-            return decompress(self._marcxml)
-        except error:
-            # Legacy uncompress data?
-            return self._marcxml
+        return self.decompress_marcxml(self._marcxml, self.marcxml_codec)
 
     @marcxml.setter
     def marcxml(self, value):
-        self._marcxml = compress(value)
+        codec = get_default_codec()
+        self._marcxml = codec.compress(value)
+        self.marcxml_codec = codec.name
+        self.marcxml_hash = self.hash_marcxml(value)
+
+    @staticmethod
+    def decompress_marcxml(value, codec=None):
+        """Decompress the value of the marcxml column, e.g. from a query.
+
+        Args:
+            value(bytes): the value of the column.
+            codec(str): the value of the ``marcxml_codec`` column, ``None``
+                for the rows compressed before it existed.
+        """
+        return get_codec(codec).decompress(value)
+
+    @staticmethod
+    def hash_marcxml(marcxml):
+        """Hash the marcxml to detect whether it changed."""
+        return hashlib.sha1(marcxml).hexdigest()
+
+
+class InspireProdRecordsDictionary(db.Model):
+    """Compression dictionaries trained on a sample of ``InspireProdRecords``."""
+
+    __tablename__ = 'inspire_prod_records_dictionaries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Throughput statistics of the migrator."""
+
+from __future__ import absolute_import, division, print_function
+
+import math
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from flask import current_app
+from redis import StrictRedis
+from six import iteritems
+
+
+STAGES = ('marc', 'dojson', 'bulk', 'insert', 'commit', 'index')
+"""Stages of the migration, in the order they happen.
+
+``insert`` includes the validation, the receivers and the SQL issued to
+insert or update each record, while ``bulk``, ``commit`` and ``index`` are
+timed for a whole chunk, but counted for each record of it.
+"""
+
+STATS_KEY = 'migrator:stats:{minute}:{stage}'
+STATS_EXPIRE = 24 * 60 * 60
+
+
+def _get_redis():
+    return StrictRedis.from_url(current_app.config['CACHE_REDIS_URL'])
+
+
+def _get_bucket(elapsed):
+    """Get the histogram bucket of a duration in seconds.
+
+    Buckets grow by a factor of ``sqrt(2)``, starting from 1 microsecond.
+    """
+    microseconds = max(elapsed * 1e6, 1)
+    return int(math.ceil(2 * math.log(microseconds, 2)))
+
+
+def _get_bucket_upper_bound(bucket):
+    """Get the largest duration in seconds falling in a histogram bucket."""
+    return 2 ** (bucket / 2) / 1e6
+
+
+class MigrationStats(object):
+    """Timings and counts of each stage of the migration of some records.
+
+    They are accumulated locally, then added with :meth:`flush` to the ones
+    of all the workers, in per-minute buckets stored in Redis.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.counts = Counter()
+        self.errors = Counter()
+        self.times = Counter()
+        self.histograms = defaultdict(Counter)
+
+    @contextmanager
+    def timer(self, stage, count=1):
+        """Time a stage, counting ``count`` records and an error if it raises."""
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            self.add_error(stage, count)
+            raise
+        finally:
+            self.add(stage, time.time() - start, count)
+
+    def add(self, stage, elapsed, count=1):
+        self.counts[stage] += count
+        self.times[stage] += elapsed
+        self.histograms[stage][_get_bucket(elapsed)] += 1
+
+    def add_error(self, stage, count=1):
+        self.errors[stage] += count
+
+    def flush(self):
+        """Add the statistics to the ones in Redis, and reset them."""
+        minute = int(time.time() // 60)
+
+        pipeline = _get_redis().pipeline(transaction=False)
+        for stage in set(self.counts) | set(self.errors):
+            key = STATS_KEY.format(minute=minute, stage=stage)
+            pipeline.hincrby(key, 'count', self.counts[stage])
+            pipeline.hincrby(key, 'errors', self.errors[stage])
+            pipeline.hincrbyfloat(key, 'time', self.times[stage])
+            for bucket, count in iteritems(self.histograms[stage]):
+                pipeline.hincrby(key, 'b{}'.format(bucket), count)
+            pipeline.expire(key, STATS_EXPIRE)
+        pipeline.execute()
+
+        self._reset()
+
+
+def get_stats(window=5):
+    """Get the statistics of each stage over the last minutes.
+
+    Args:
+        window(int): the number of minutes to consider, including the
+            current one.
+
+    Returns:
+        dict: for each stage that was run in the window, the records per
+        second, the 50th and 99th percentiles of the durations in seconds
+        and the ratio of records that failed.
+    """
+    now = time.time()
+    minutes = range(int(now // 60) - window + 1, int(now // 60) + 1)
+    elapsed = now - minutes[0] * 60
+
+    pipeline = _get_redis().pipeline(transaction=False)
+    for stage in STAGES:
+        for minute in minutes:
+            pipeline.hgetall(STATS_KEY.format(minute=minute, stage=stage))
+    results = iter(pipeline.execute())
+
+    stats = {}
+    for stage in STAGES:
+        totals = Counter()
+        for _ in minutes:
+            for field, value in iteritems(next(results)):
+                totals[field.decode('utf8')] += float(value)
+
+        if not totals['count']:
+            continue
+
+        histogram = dict(
+            (int(field[1:]), value)
+            for field, value in iteritems(totals) if field.startswith('b')
+        )
+        stats[stage] = {
+            'rate': totals['count'] / elapsed,
+            'p50': _get_percentile(histogram, 0.5),
+            'p99': _get_percentile(histogram, 0.99),
+            'error_rate': totals['errors'] / totals['count'],
+        }
+
+    return stats
+
+
+def _get_percentile(histogram, percentile):
+    total = sum(histogram.values())
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= percentile * total:
+            return _get_bucket_upper_bound(bucket)
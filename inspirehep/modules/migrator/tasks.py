@@ -25,61 +25,140 @@
 from __future__ import absolute_import, division, print_function
 
 import gzip
+import hashlib
 import re
+import sys
+import threading
+import time
+import traceback
 import zlib
-from collections import Counter
-from itertools import chain
+from bisect import bisect_right
+from collections import Counter, deque
+from datetime import datetime
+from itertools import chain, islice
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from uuid import UUID, uuid4
+from xml.parsers import expat
 
 import click
+import numpy as np
+import requests
 from celery import group, shared_task
 from celery.utils.log import get_task_logger
-from elasticsearch.helpers import bulk as es_bulk
 from elasticsearch.helpers import scan as es_scan
 from flask import current_app, url_for
 from flask_sqlalchemy import models_committed
 from jsonschema import ValidationError
 from redis import StrictRedis
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from redis_lock import Lock
-from six import text_type
+from six import iteritems, text_type
+from sqlalchemy import and_, false, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
 
 from dojson.contrib.marc21.utils import create_record as marc_create_record
 from invenio_db import db
-from invenio_indexer.api import RecordIndexer, current_record_to_index
 from invenio_pidstore.errors import PIDDoesNotExistError
-from invenio_pidstore.models import PersistentIdentifier
+from invenio_pidstore.models import (
+    PersistentIdentifier,
+    PIDStatus,
+    RecordIdentifier,
+)
+from invenio_records.models import RecordMetadata
+from invenio_records.signals import before_record_insert
 from invenio_search import current_search_client as es
 from invenio_search.utils import schema_to_index
 
 from inspire_dojson.processors import overdo_marc_dict
 from inspire_dojson.utils import get_recid_from_ref
-from inspire_utils.dedupers import dedupe_list
 from inspire_utils.helpers import force_list
 from inspire_utils.record import get_value
+from inspirehep.modules.pidstore.index import (
+    get_recid_index,
+    update_recid_indexes_with,
+)
 from inspirehep.modules.pidstore.minters import inspire_recid_minter
 from inspirehep.modules.pidstore.utils import get_pid_type_from_schema
 from inspirehep.modules.records.api import InspireRecord
-from inspirehep.modules.records.receivers import index_after_commit
+from inspirehep.modules.records.citations import (
+    CITED_RECIDS_KEY,
+    get_all_citation_counts,
+    get_uuids_of_recids,
+    replace_citation_counts,
+)
+from inspirehep.modules.records.indexer import (
+    AdaptiveBulkIndexer,
+    create_index_ops,
+    get_bulk_indexer,
+)
+from inspirehep.modules.records.links import insert_links
+from inspirehep.modules.records.receivers import (
+    index_after_commit,
+    index_or_queue_records,
+)
+from inspirehep.utils.helpers import chunker
 
+from .checkpoints import MigrationCheckpoint, complete_chunk
 from .models import InspireProdRecords
+from .stats import MigrationStats
 
 
 logger = get_task_logger(__name__)
 
 CHUNK_SIZE = 100
 LARGE_CHUNK_SIZE = 2000
+CITATIONS_BUFFER_SIZE = 2 ** 20
+LEGACY_FETCH_TIMEOUT = 30
+READ_BLOCK_SIZE = 2 ** 16
+
+REAL_COLLECTIONS = (
+    'INSTITUTION',
+    'EXPERIMENT',
+    'JOURNALS',
+    'JOURNALSNEW',
+    'HEPNAMES',
+    'JOB',
+    'JOBHIDDEN',
+    'CONFERENCES',
+    'DATA',
+)
 
 split_marc = re.compile('<record.*?>.*?</record>', re.DOTALL)
+recid_controlfield = re.compile(
+    br'<controlfield tag="001">\s*(\d+)\s*</controlfield>')
+deleted_datafield = re.compile(
+    br'<datafield tag="980"[^>]*>\s*<subfield code="c">DELETED</subfield>')
 
 
-def chunker(iterable, chunksize=CHUNK_SIZE):
-    buf = []
-    for elem in iterable:
-        buf.append(elem)
-        if len(buf) == chunksize:
-            yield buf
-            buf = []
-    if buf:
-        yield buf
+def imap_bounded(pool, func, iterable, max_pending):
+    """Like ``pool.imap_unordered``, without running ahead of the consumer.
+
+    ``pool.imap_unordered`` dispatches the whole of ``iterable`` at once and
+    buffers the results until they are consumed. Here an item is only
+    dispatched when fewer than ``max_pending`` results are running or
+    waiting to be consumed.
+    """
+    slots = threading.Semaphore(max_pending)
+    done = threading.Event()
+
+    def _throttled():
+        for item in iterable:
+            slots.acquire()
+            if done.is_set():
+                return
+            yield item
+
+    try:
+        for result in pool.imap_unordered(func, _throttled()):
+            slots.release()
+            yield result
+    finally:
+        # Wake up the task handler of the pool if it is waiting for a slot.
+        done.set()
+        slots.release()
 
 
 def split_blob(blob):
@@ -90,17 +169,188 @@ def split_blob(blob):
 
 def split_stream(stream):
     """Split the stream using <record.*?>.*?</record> as pattern."""
+    for _, blob in split_stream_with_offsets(stream):
+        yield blob
+
+
+def split_stream_with_offsets(stream, offset=0):
+    """Split the stream like :func:`split_stream`, tracking offsets.
+
+    Args:
+        stream(file): the stream to split.
+        offset(int): the offset of the stream, if it does not start from
+            the beginning of the dump.
+
+    Yields:
+        tuple: the offset in the stream right after each record, and the
+        record.
+    """
     buf = []
+    buf_offset = offset
     for row in stream:
-        row = text_type(row, 'utf8')
-        index = row.rfind('</record>')
+        decoded_row = text_type(row, 'utf8')
+        index = decoded_row.rfind('</record>')
         if index >= 0:
-            buf.append(row[:index + 9])
-            for blob in split_blob(''.join(buf)):
-                yield blob.encode('utf8')
-            buf = [row[index + 9:]]
+            buf.append(decoded_row[:index + 9])
+            blob = ''.join(buf)
+            position, end = 0, buf_offset
+            for match in split_marc.finditer(blob):
+                end += len(blob[position:match.end()].encode('utf8'))
+                position = match.end()
+                yield end, match.group().encode('utf8')
+            tail = decoded_row[index + 9:]
+            buf_offset = offset + len(row) - len(tail.encode('utf8'))
+            buf = [tail]
         else:
-            buf.append(row)
+            buf.append(decoded_row)
+        offset += len(row)
+
+
+def iter_records(stream, block_size=READ_BLOCK_SIZE):
+    """Split the stream into MARCXML records with an incremental parser.
+
+    Unlike :func:`split_stream`, the stream is never decoded nor matched
+    against a regular expression: it is fed in blocks to ``expat``, whose
+    events give the byte offsets at which each ``record`` starts and ends.
+    The records are yielded exactly as they appear in the dump, so that
+    their hash is the same as when split with :func:`split_stream`, and
+    only the bytes of the record being read are kept in memory.
+    """
+    parser = expat.ParserCreate()
+    spans = []
+    state = {'start': None}
+
+    def _is_record(name):
+        return name.rpartition(':')[2] == 'record'
+
+    def _start_element(name, attrs):
+        if state['start'] is None and _is_record(name):
+            state['start'] = parser.CurrentByteIndex
+
+    def _end_element(name):
+        if state['start'] is not None and _is_record(name):
+            spans.append((state['start'], parser.CurrentByteIndex))
+            state['start'] = None
+
+    parser.StartElementHandler = _start_element
+    parser.EndElementHandler = _end_element
+
+    buf = bytearray()
+    buf_offset = last_end = 0
+    while True:
+        block = stream.read(block_size)
+        buf.extend(block)
+        parser.Parse(block, not block)
+
+        for start, end in spans:
+            # ``end`` points to the start of the end tag, or of the whole
+            # element if it is empty.
+            end = buf.index(b'>', end - buf_offset) + 1
+            yield bytes(buf[start - buf_offset:end])
+            last_end = buf_offset + end
+        del spans[:]
+
+        if not block:
+            return
+
+        # What follows the last record might be the beginning of the start
+        # tag of the next one, not reported by the parser yet.
+        keep = last_end if state['start'] is None else state['start']
+        del buf[:keep - buf_offset]
+        buf_offset = keep
+
+
+def prepare_chunk(chunk):
+    """Convert a chunk of MARCXML records to JSON.
+
+    Meant to be run in a process pool by :func:`migrate`, it does the MARC
+    parsing and the DoJSON conversion ahead of ``migrate_chunk``. Records
+    that fail either stage are left as raw MARCXML, so that the error can
+    be recorded by :func:`migrate_and_insert_record` as usual.
+
+    Returns:
+        tuple: the prepared chunk and the time spent in each stage.
+    """
+    prepared = []
+    timings = {'marc': 0.0, 'dojson': 0.0}
+
+    for raw_record in chunk:
+        start = time.time()
+        try:
+            marc_record = marc_create_record(raw_record, keep_singletons=False)
+            timings['marc'] += time.time() - start
+            start = time.time()
+            json_record = create_record(marc_record)
+            timings['dojson'] += time.time() - start
+        except Exception:
+            prepared.append(raw_record)
+            continue
+
+        prepared.append({
+            'recid': int(marc_record['001']),
+            'marcxml': raw_record,
+            'json': json_record,
+        })
+
+    return prepared, timings
+
+
+def _prepare_chunks_in_pool(chunks, processes, timings):
+    """Run :func:`prepare_chunk` on a pool, keeping the order of chunks.
+
+    At most ``2 * processes`` chunks are in flight at any time, which keeps
+    the memory bounded even if the pool is faster than the broker. Note that
+    the pool is forked from the current process, so the workers inherit the
+    application context needed by :func:`create_record`.
+    """
+    pool = Pool(processes)
+    pending = deque()
+
+    def _collect():
+        prepared, chunk_timings = pending.popleft().get()
+        for stage, elapsed in chunk_timings.items():
+            timings[stage] += elapsed
+        return prepared
+
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(prepare_chunk, (chunk,)))
+            if len(pending) >= 2 * processes:
+                yield _collect()
+        while pending:
+            yield _collect()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _timed(iterable, timings, stage):
+    """Accumulate in ``timings[stage]`` the time spent producing items."""
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[stage] += time.time() - start
+            return
+        timings[stage] += time.time() - start
+        yield item
+
+
+def _format_throughput(count, timings, processes=1):
+    """Format the records per second of each stage of the ingestion."""
+    rates = []
+    for stage in ('split', 'marc', 'dojson', 'dispatch'):
+        elapsed = timings.get(stage)
+        if elapsed is None:
+            continue
+        rate = count / elapsed if elapsed else float('inf')
+        if stage in ('marc', 'dojson'):
+            rate *= processes
+        rates.append('{}: {:.1f} rec/s'.format(stage, rate))
+
+    return ', '.join(rates)
 
 
 @shared_task(ignore_result=True)
@@ -109,17 +359,136 @@ def remigrate_records(only_broken=True):
 
     Directly migrates the records (declared as broken), e.g. if the dojson
     conversion script have been corrected.
+
+    Only ranges of recids are sent to the workers, which then read the
+    records from the DB themselves, see :func:`remigrate_recids`.
+    """
+    query = db.session.query(InspireProdRecords.recid)
+    if only_broken:
+        query = query.filter_by(valid=False)
+    query = query.order_by(InspireProdRecords.recid).yield_per(LARGE_CHUNK_SIZE)
+
+    for i, chunk in enumerate(chunker(query, LARGE_CHUNK_SIZE)):
+        start, end = chunk[0].recid, chunk[-1].recid + 1
+        logger.info("Processed {} records".format(i * LARGE_CHUNK_SIZE))
+        remigrate_recids.delay(start, end, only_broken=only_broken)
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def remigrate_recids(start, end, only_broken=True):
+    """Remigrate the records with a recid from ``start`` to ``end`` excluded.
+
+    The records are streamed from the DB with a server-side cursor on a
+    connection of their own, and migrated in chunks of ``CHUNK_SIZE``.
+    """
+    table = InspireProdRecords.__table__
+    query = select([table.c.marcxml, table.c.marcxml_codec]).where(
+        and_(table.c.recid >= start, table.c.recid < end)
+    ).order_by(table.c.recid)
+    if only_broken:
+        query = query.where(table.c.valid == false())
+
+    with db.engine.connect() as connection:
+        rows = connection.execution_options(stream_results=True).execute(query)
+        raw_records = (
+            InspireProdRecords.decompress_marcxml(row.marcxml, row.marcxml_codec)
+            for row in rows
+        )
+        for chunk in chunker(raw_records, CHUNK_SIZE):
+            migrate_chunk(chunk)
+
+
+def fetch_records(recids, workers=8, batch_size=CHUNK_SIZE, max_pending=None):
+    """Download records from legacy and migrate them in batches.
+
+    The downloads are made by ``workers`` threads sharing the pooled
+    connections of a single session, so that at most ``workers`` requests
+    are in flight, while the records already downloaded are migrated in
+    batches of ``batch_size``. Downloads stop when ``max_pending`` of them
+    are waiting to be migrated.
+
+    Args:
+        recids(list): the recids of the records to download.
+        workers(int): the number of concurrent downloads.
+        batch_size(int): the number of records migrated per transaction.
+        max_pending(int): the number of downloads that can run or wait to
+            be migrated, by default ``batch_size``.
+
+    Returns:
+        list: the recids of the records that could not be downloaded.
     """
-    query = db.session.query(InspireProdRecords).filter_by(valid=False) if only_broken else db.session.query(InspireProdRecords)
-    for i, chunk in enumerate(chunker(query.yield_per(CHUNK_SIZE))):
-        records = [record.marcxml for record in chunk]
-        logger.info("Processed {} records".format(i * CHUNK_SIZE))
-        migrate_chunk.delay(records)
+    url = current_app.config['LEGACY_BASE_URL'] + '/record/{}/export/xme'
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=workers,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+        ),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def _fetch(recid):
+        try:
+            response = session.get(url.format(recid), timeout=LEGACY_FETCH_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException:
+            logger.exception('Migrator Fetch Error: %s', recid)
+            return recid, []
+
+        return recid, list(split_blob(response.content))
+
+    failed = []
+
+    def _get_records(results):
+        for recid, records in results:
+            if not records:
+                failed.append(recid)
+            for record in records:
+                yield record
+
+    pool = ThreadPool(workers)
+    results = imap_bounded(pool, _fetch, recids, max_pending or batch_size)
+    try:
+        count = 0
+        for chunk in chunker(_get_records(results), batch_size):
+            migrate_chunk(chunk)
+            count += len(chunk)
+            print('Migrated {} records'.format(count))
+    finally:
+        results.close()
+        pool.terminate()
+        session.close()
+
+    return failed
 
 
 @shared_task(ignore_result=True)
-def migrate(source, wait_for_results=False):
-    """Main migration function."""
+def migrate(source, wait_for_results=False, processes=None, bulk=False,
+            delta=False, resume=False):
+    """Main migration function.
+
+    Args:
+        source(str): path to the MARCXML dump, optionally gzipped.
+        wait_for_results(bool): if ``True``, waits for all the dispatched
+            ``migrate_chunk`` tasks to complete.
+        processes(int): if passed, the dump is split with an incremental
+            XML parser and the records are converted to JSON on a local pool
+            of this many processes before being dispatched.
+        bulk(bool): if ``True``, new records are inserted in bulk, see
+            :func:`bulk_insert_records`.
+        delta(bool): if ``True``, records whose MARCXML did not change since
+            they were last migrated are skipped, see
+            :func:`filter_unchanged_records`.
+        resume(bool): if ``True``, resumes an interrupted migration of the
+            same dump from its checkpoint, see :class:`MigrationCheckpoint`.
+            Chunks that were dispatched but never completed are read again,
+            skipping the records of the chunks that completed anyway.
+    """
     if source.endswith('.gz'):
         fd = gzip.open(source)
     else:
@@ -132,147 +501,746 @@ def migrate(source, wait_for_results=False):
         tasks = []
         migrate_chunk.ignore_result = False
 
-    for i, chunk in enumerate(chunker(split_stream(fd), CHUNK_SIZE)):
+    checkpoint = MigrationCheckpoint(source)
+    completed = []
+    if resume and checkpoint.load():
+        completed = checkpoint.reconcile()
+        print('Resuming after {} records, skipping the {} of the chunks that completed'.format(
+            checkpoint.position[0],
+            sum(last - first + 1 for first, last in completed if first > checkpoint.position[0])))
+    else:
+        if resume:
+            print('No checkpoint found, starting from the beginning')
+        checkpoint.start()
+
+    records_read, offset = checkpoint.position
+    if processes:
+        timings = Counter(split=0.0, marc=0.0, dojson=0.0, dispatch=0.0)
+        records = (
+            (None, record)
+            for record in islice(iter_records(fd), records_read, None)
+        )
+    else:
+        timings = Counter(split=0.0, dispatch=0.0)
+        if offset is None:
+            records = (
+                (None, record)
+                for record in islice(split_stream(fd), records_read, None)
+            )
+        else:
+            # Gzipped dumps are decompressed up to the offset, but without
+            # splitting nor converting the records on the way.
+            fd.seek(offset)
+            records = split_stream_with_offsets(fd, offset)
+
+    positions = deque()
+    records = _timed(
+        _track_positions(records, records_read, completed, positions),
+        timings,
+        'split',
+    )
+
+    if delta:
+        delta_stats = Counter(new=0, changed=0, unchanged=0, deleted=0)
+        records = filter_unchanged_records(records, delta_stats)
+
+    chunk_ends = deque()
+    chunks = _track_chunk_ends(chunker(records, CHUNK_SIZE), positions, chunk_ends)
+    if processes:
+        chunks = _prepare_chunks_in_pool(chunks, processes, timings)
+
+    count = 0
+    for i, chunk in enumerate(chunks):
         print("Processed {} records".format(i * CHUNK_SIZE))
+        chunk_id = checkpoint.save(checkpoint.position, chunk_ends.popleft())
+
+        start = time.time()
         if wait_for_results:
-            tasks.append(migrate_chunk.s(chunk))
+            tasks.append(migrate_chunk.s(chunk, bulk=bulk, checkpoint=(source, chunk_id)))
         else:
-            migrate_chunk.delay(chunk)
+            migrate_chunk.delay(chunk, bulk=bulk, checkpoint=(source, chunk_id))
+        timings['dispatch'] += time.time() - start
+        count += len(chunk)
+
+    print('Dispatched {} records ({})'.format(
+        count, _format_throughput(count, timings, processes or 1)))
+    if delta:
+        print('New: {new}, changed: {changed}, unchanged: {unchanged}, '
+              'deleted: {deleted}'.format(**delta_stats))
 
     if wait_for_results:
         job = group(tasks)
         result = job.apply_async()
         result.join()
         migrate_chunk.ignore_result = True
+        checkpoint.clear()
         print('All migration tasks have been completed.')
 
 
+def _track_positions(records, records_read, completed, positions):
+    """Track the position in the dump of the records being migrated.
+
+    Args:
+        records(iterable): the records read from the dump, with the offset
+            right after each of them, or ``None`` if unknown.
+        records_read(int): the number of records read before ``records``.
+        completed(list): the sorted ranges of the numbers of the records
+            that were migrated by completed chunks, which are skipped.
+        positions(deque): where to append each record that is yielded,
+            with the position right after it.
+    """
+    starts = [first for first, _ in completed]
+    for offset, raw_record in records:
+        records_read += 1
+        i = bisect_right(starts, records_read) - 1
+        if i >= 0 and records_read <= completed[i][1]:
+            continue
+
+        positions.append((raw_record, (records_read, offset)))
+        yield raw_record
+
+
+def _pop_position(positions, raw_record, default):
+    """Get the position after a record, forgetting the older ones.
+
+    As records are chunked in the same order they were read, this is the
+    position after the last record of a chunk, if passed that record. The
+    record is matched by identity, as the same record might appear more
+    than once in the dump.
+    """
+    position = default
+    while positions:
+        popped_record, position = positions.popleft()
+        if popped_record is raw_record:
+            break
+
+    return position
+
+
+def _track_chunk_ends(chunks, positions, chunk_ends):
+    """Append to ``chunk_ends`` the position right after each chunk."""
+    for chunk in chunks:
+        chunk_ends.append(_pop_position(positions, chunk[-1], None))
+        yield chunk
+
+
+def filter_unchanged_records(raw_records, stats):
+    """Skip the records whose MARCXML did not change since last migrated.
+
+    The hash of each record is compared to the one stored in
+    ``InspireProdRecords``, looking them up in batches. Records that were
+    migrated with errors are skipped as well if unchanged, as they are
+    retried by ``remigrate_records``.
+
+    Args:
+        raw_records(iterable): the MARCXML of the records.
+        stats(Counter): where to count how many records are ``new``,
+            ``changed``, ``unchanged`` or ``deleted``.
+    """
+    for batch in chunker(raw_records, LARGE_CHUNK_SIZE):
+        recids = [_get_recid_from_item(raw_record) for raw_record in batch]
+        hashes = dict(db.session.query(
+            InspireProdRecords.recid,
+            InspireProdRecords.marcxml_hash,
+        ).filter(InspireProdRecords.recid.in_(
+            [recid for recid in recids if recid is not None])))
+
+        for recid, raw_record in zip(recids, batch):
+            if hashes.get(recid) == InspireProdRecords.hash_marcxml(raw_record):
+                stats['unchanged'] += 1
+                continue
+
+            if deleted_datafield.search(raw_record):
+                stats['deleted'] += 1
+            elif recid in hashes:
+                stats['changed'] += 1
+            else:
+                stats['new'] += 1
+
+            yield raw_record
+
+
 @shared_task(ignore_result=True)
-def continuous_migration():
-    """Task to continuously migrate what is pushed up by Legacy."""
+def continuous_migration(batch_size=None):
+    """Task to continuously migrate what is pushed up by Legacy.
+
+    Records are moved from the ``legacy_records`` queue to one of
+    ``MIGRATOR_CONTINUOUS_PARTITIONS`` sub-queues according to their recid,
+    then a :func:`continuous_migration_partition` task is sent for each of
+    them. This way all the updates of a record are migrated in order, while
+    different partitions are drained in parallel by different workers.
+    """
+    if batch_size is None:
+        batch_size = current_app.config['MIGRATOR_CONTINUOUS_BATCH_SIZE']
+    partitions = current_app.config['MIGRATOR_CONTINUOUS_PARTITIONS']
+
     redis_url = current_app.config.get('CACHE_REDIS_URL')
     r = StrictRedis.from_url(redis_url)
     lock = Lock(r, 'continuous_migration', expire=120, auto_renewal=True)
     if lock.acquire(blocking=False):
         try:
-            while r.llen('legacy_records'):
-                raw_record = r.lrange('legacy_records', 0, 0)
-                if raw_record:
-                    migrate_and_insert_record(zlib.decompress(raw_record[0]))
-                    db.session.commit()
-                r.lpop('legacy_records')
+            while True:
+                raw_records = r.lrange('legacy_records', 0, batch_size - 1)
+                if not raw_records:
+                    break
+                pipeline = r.pipeline()
+                for raw_record in raw_records:
+                    partition = get_partition(raw_record, partitions)
+                    pipeline.rpush(get_partition_queue(partition), raw_record)
+                # Only this task pops from the queue, while Legacy only
+                # pushes at its tail, so these are the records just moved.
+                pipeline.ltrim('legacy_records', len(raw_records), -1)
+                pipeline.execute()
         finally:
             lock.release()
     else:
         logger.info("Continuous_migration already executed. Skipping.")
 
+    for partition in range(partitions):
+        continuous_migration_partition.delay(partition, batch_size=batch_size)
 
-def create_index_op(record):
-    index, doc_type = current_record_to_index(record)
 
-    return {
-        '_op_type': 'index',
-        '_index': index,
-        '_type': doc_type,
-        '_id': str(record.id),
-        '_version': record.revision_id,
-        '_version_type': 'external_gte',
-        '_source': RecordIndexer._prepare_record(record, index, doc_type),
-    }
+@shared_task(ignore_result=True)
+def continuous_migration_partition(partition, batch_size=None):
+    """Task to migrate the records of a partition of the Legacy queue.
+
+    Records are read in batches of ``batch_size`` (by default
+    ``MIGRATOR_CONTINUOUS_BATCH_SIZE``), which are migrated in a single
+    transaction through :func:`migrate_chunk`. A batch is removed from the
+    queue only once it has been committed, so that nothing is lost if the
+    worker dies in the middle of it.
+    """
+    if batch_size is None:
+        batch_size = current_app.config['MIGRATOR_CONTINUOUS_BATCH_SIZE']
+
+    queue = get_partition_queue(partition)
+
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    r = StrictRedis.from_url(redis_url)
+    lock = Lock(r, queue, expire=120, auto_renewal=True)
+    if lock.acquire(blocking=False):
+        try:
+            while True:
+                raw_records = r.lrange(queue, 0, batch_size - 1)
+                if not raw_records:
+                    break
+                migrate_chunk(
+                    [zlib.decompress(raw_record) for raw_record in raw_records]
+                )
+                r.ltrim(queue, len(raw_records), -1)
+        finally:
+            lock.release()
+    else:
+        logger.info("Partition %d already being migrated. Skipping.", partition)
+
+
+def get_partition(raw_record, partitions):
+    """Get the partition of the Legacy queue a compressed record belongs to.
+
+    Records are assigned by recid, so that all the versions of a record
+    end up in the same partition. Records whose recid can't be found all go
+    to the first partition, where they will fail to be migrated anyway.
+    """
+    match = recid_controlfield.search(zlib.decompress(raw_record))
+    if not match:
+        return 0
+
+    return int(match.group(1)) % partitions
+
+
+def get_partition_queue(partition):
+    return 'legacy_records:{}'.format(partition)
 
 
 @shared_task(ignore_result=False, compress='zlib', acks_late=True)
-def migrate_chunk(chunk):
+def migrate_chunk(chunk, bulk=False, checkpoint=None):
+    """Migrate a chunk of records in a single transaction.
+
+    Args:
+        chunk(list): the MARCXML of the records, or the records prepared by
+            :func:`prepare_chunk`.
+        bulk(bool): if ``True``, the new records of the chunk are first
+            inserted with :func:`bulk_insert_records`, and only the others
+            go through :func:`migrate_and_insert_record`.
+        checkpoint(tuple): the source and the identifier of the chunk in
+            its :class:`MigrationCheckpoint`, to mark it as completed.
+    """
     models_committed.disconnect(index_after_commit)
 
     index_queue = []
+    bulk_pids = []
+    stats = MigrationStats()
 
     try:
+        if bulk:
+            start = time.time()
+            records, chunk = bulk_insert_records(chunk)
+            stats.add('bulk', time.time() - start, len(records))
+            index_queue.extend(create_index_ops(records))
+            bulk_pids.extend(
+                (get_pid_type_from_schema(record['$schema']),
+                 record['control_number'],
+                 record.id)
+                for record in records
+            )
+
+        migrated = []
         for raw_record in chunk:
             with db.session.begin_nested():
-                record = migrate_and_insert_record(raw_record)
+                if isinstance(raw_record, dict):
+                    record = migrate_and_insert_record(
+                        raw_record['marcxml'],
+                        recid=raw_record['recid'],
+                        json_record=raw_record['json'],
+                        stats=stats,
+                    )
+                else:
+                    record = migrate_and_insert_record(raw_record, stats=stats)
                 if record:
-                    index_queue.append(create_index_op(record))
-        db.session.commit()
+                    migrated.append(record)
+        index_queue.extend(create_index_ops(migrated))
+
+        with stats.timer('commit', len(index_queue)):
+            db.session.commit()
+        cited_recids = db.session.info.pop(CITED_RECIDS_KEY, ())
+
+        # The persistent identifiers inserted in bulk are not seen by the
+        # ``models_committed`` receivers.
+        if bulk_pids:
+            update_recid_indexes_with(bulk_pids)
+
+        if checkpoint:
+            complete_chunk(*checkpoint)
     finally:
+        db.session.info.pop(CITED_RECIDS_KEY, None)
         db.session.close()
+        models_committed.connect(index_after_commit)
+        _flush_stats(stats)
+
+    try:
+        with stats.timer('index', len(index_queue)):
+            get_bulk_indexer().bulk(index_queue)
+
+        # The documents of the chunk were built before the whole chunk was
+        # flushed, so all the cited records are indexed again, including
+        # the ones of the chunk.
+        index_or_queue_records({}, get_uuids_of_recids(cited_recids))
+    finally:
+        _flush_stats(stats)
+
+
+def _flush_stats(stats):
+    try:
+        stats.flush()
+    except Exception:
+        # Statistics are not worth failing a chunk that was committed.
+        logger.exception('Migrator Stats Error')
+
+
+def reindex_records(pid_types=None):
+    """Reindex all records from the DB, sizing the requests adaptively.
+
+    Args:
+        pid_types(list): if passed, only the records with these types of
+            persistent identifier are reindexed.
+
+    Returns:
+        AdaptiveBulkIndexer: the indexer, with the statistics of the run.
+    """
+    query = db.session.query(PersistentIdentifier.object_uuid).filter(
+        PersistentIdentifier.object_type == 'rec',
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+    )
+    if pid_types:
+        query = query.filter(PersistentIdentifier.pid_type.in_(pid_types))
+
+    def _get_index_ops():
+        for i, chunk in enumerate(chunker(query.yield_per(LARGE_CHUNK_SIZE), CHUNK_SIZE)):
+            if i % 100 == 0:
+                print('Reindexed {} records'.format(i * CHUNK_SIZE))
+            records = InspireRecord.get_records([uuid for (uuid,) in chunk])
+            for action in create_index_ops(records):
+                yield action
+            db.session.expunge_all()
+
+    indexer = AdaptiveBulkIndexer()
+    indexer.bulk(_get_index_ops(), raise_on_error=False)
+
+    return indexer
+
+
+def bulk_insert_records(chunk):
+    """Insert the new records of a chunk with a few multi-row statements.
+
+    The records are converted and validated in memory, then the rows of
+    ``records_metadata``, ``pidstore_recid``, ``pidstore_pid`` and
+    ``inspire_prod_records`` are written with one statement per table.
+
+    The records that can't be inserted this way are returned, to be migrated
+    by :func:`migrate_and_insert_record`: records that fail the conversion
+    or the validation (so that the error is stored), records that already
+    exist, are deleted or have documents or figures to download, as well as
+    any other version of their recids in the chunk. If writing the rows
+    fails, the whole chunk is returned.
+
+    Returns:
+        tuple: the inserted records, and the items of the chunk that have
+        to be migrated one by one.
+    """
+    remaining = set()
+    candidates = []
+    for i, item in enumerate(chunk):
+        prepared = _convert_for_bulk_insert(item)
+        if prepared:
+            candidates.append((i, prepared))
+        else:
+            remaining.add(i)
 
-    req_timeout = current_app.config['INDEXER_BULK_REQUEST_TIMEOUT']
-    es_bulk(
-        es,
-        index_queue,
-        stats_only=True,
-        request_timeout=req_timeout,
+    existing_pids = _get_existing_pids(
+        (pid_type, recid) for _, (recid, pid_type, _, _) in candidates)
+    skipped_recids = set(_get_recid_from_item(chunk[i]) for i in remaining)
+
+    to_insert = []
+    for i, (recid, pid_type, raw_record, json_record) in candidates:
+        if recid in skipped_recids or (pid_type, recid) in existing_pids:
+            remaining.add(i)
+            skipped_recids.add(recid)
+            continue
+
+        record = InspireRecord(json_record)
+        try:
+            before_record_insert.send(
+                current_app._get_current_object(), record=record)
+            record.validate()
+        except Exception:
+            remaining.add(i)
+            skipped_recids.add(recid)
+            continue
+
+        to_insert.append((recid, pid_type, raw_record, record))
+        skipped_recids.add(recid)
+
+    if not to_insert:
+        return [], chunk
+
+    try:
+        with db.session.begin_nested():
+            _write_records(to_insert)
+    except SQLAlchemyError:
+        logger.exception('Migrator Bulk Insert Error')
+        return [], chunk
+
+    # Keep the order of the chunk, so that versions of the same record are
+    # still migrated in the right order.
+    records = [inserted for _, _, _, inserted in to_insert]
+    return records, [item for i, item in enumerate(chunk) if i in remaining]
+
+
+def _get_recid_from_item(item):
+    if isinstance(item, dict):
+        return item['recid']
+
+    match = recid_controlfield.search(item)
+    if match:
+        return int(match.group(1))
+
+
+def _convert_for_bulk_insert(item):
+    if isinstance(item, dict):
+        recid, raw_record, json_record = item['recid'], item['marcxml'], item['json']
+    else:
+        raw_record = item
+        try:
+            marc_record = marc_create_record(raw_record, keep_singletons=False)
+            recid = int(marc_record['001'])
+            json_record = create_record(marc_record)
+        except Exception:
+            return None
+
+    if (
+        '$schema' not in json_record or
+        'control_number' not in json_record or
+        json_record.get('deleted') or
+        json_record.get('documents') or
+        json_record.get('figures')
+    ):
+        return None
+
+    pid_type = get_pid_type_from_schema(json_record['$schema'])
+    return recid, pid_type, raw_record, json_record
+
+
+def _get_existing_pids(pids):
+    recids_by_pid_type = {}
+    for pid_type, recid in pids:
+        recids_by_pid_type.setdefault(pid_type, []).append(str(recid))
+
+    existing_pids = set()
+    for pid_type, pid_values in recids_by_pid_type.items():
+        query = db.session.query(PersistentIdentifier.pid_value).filter(
+            PersistentIdentifier.pid_type == pid_type,
+            PersistentIdentifier.pid_value.in_(pid_values),
+        )
+        existing_pids.update((pid_type, int(pid_value)) for pid_value, in query)
+
+    return existing_pids
+
+
+def _write_records(to_insert):
+    now = datetime.utcnow()
+
+    # The records metadata go through the ORM, so that their versions are
+    # still recorded, but are flushed together in a single batch.
+    for _, _, _, record in to_insert:
+        record.model = RecordMetadata(id=uuid4(), json=record)
+        db.session.add(record.model)
+    db.session.flush()
+    insert_links([(record.id, record) for _, _, _, record in to_insert])
+
+    db.session.execute(
+        pg_insert(RecordIdentifier.__table__).values([
+            {'recid': recid} for recid, _, _, _ in to_insert
+        ]).on_conflict_do_nothing()
+    )
+    db.session.execute(
+        "SELECT setval(pg_get_serial_sequence('pidstore_recid', 'recid'), "
+        "(SELECT max(recid) FROM pidstore_recid))"
     )
 
-    models_committed.connect(index_after_commit)
+    db.session.execute(
+        pg_insert(PersistentIdentifier.__table__).values([
+            {
+                'pid_type': pid_type,
+                'pid_value': str(recid),
+                'status': PIDStatus.REGISTERED,
+                'object_type': 'rec',
+                'object_uuid': record.id,
+                'created': now,
+                'updated': now,
+            } for recid, pid_type, _, record in to_insert
+        ])
+    )
+
+    prod_records = []
+    for recid, _, raw_record, _ in to_insert:
+        prod_record = InspireProdRecords(recid=recid)
+        prod_record.marcxml = raw_record
+        prod_records.append({
+            'recid': recid,
+            'marcxml': prod_record._marcxml,
+            'marcxml_codec': prod_record.marcxml_codec,
+            'marcxml_hash': prod_record.marcxml_hash,
+            'valid': True,
+            'errors': None,
+            'last_updated': now,
+        })
+
+    statement = pg_insert(InspireProdRecords.__table__).values(prod_records)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['recid'],
+        set_={
+            'marcxml': statement.excluded.marcxml,
+            'marcxml_codec': statement.excluded.marcxml_codec,
+            'marcxml_hash': statement.excluded.marcxml_hash,
+            'valid': statement.excluded.valid,
+            'errors': statement.excluded.errors,
+            'last_updated': statement.excluded.last_updated,
+        },
+    ))
+
+
+def count_citations(references, buffer_size=CITATIONS_BUFFER_SIZE):
+    """Count how many records cite each recid.
+
+    The recids are copied to a preallocated buffer, which is added to the
+    counts with a single ``bincount`` every time it fills up.
+
+    Args:
+        references(iterable): for each citing record, an iterable of the
+            recids it cites, possibly with duplicates.
+        buffer_size(int): the number of recids buffered before counting.
+
+    Returns:
+        numpy.ndarray: the number of citations of each recid, indexed by it.
+    """
+    def _add_to_counts(counts, recids):
+        partial = np.bincount(recids).astype(np.int32)
+        if len(partial) > len(counts):
+            partial[:len(counts)] += counts
+            return partial
+        counts[:len(partial)] += partial
+        return counts
+
+    counts = np.zeros(0, dtype=np.int32)
+    buf = np.empty(buffer_size, dtype=np.int64)
+    size = 0
+
+    for recids in references:
+        recids = list(set(recids))
+        if size + len(recids) > buffer_size:
+            counts = _add_to_counts(counts, buf[:size])
+            size = 0
+        if len(recids) > buffer_size:
+            counts = _add_to_counts(counts, np.array(recids, dtype=np.int64))
+            continue
+        buf[size:size + len(recids)] = recids
+        size += len(recids)
+
+    return _add_to_counts(counts, buf[:size])
+
+
+def get_counts_at(counts, recids):
+    """Get the counts of some recids, which might be past the last counted one."""
+    result = np.zeros(len(recids), dtype=np.int32)
+    counted = recids < len(counts)
+    result[counted] = counts[recids[counted]]
+    return result
+
+
+def _count_citations_with_counter(references):
+    counts = Counter()
+    for recids in references:
+        counts.update(set(recids))
+    return counts
+
+
+def _get_dict_size(mapping):
+    return sys.getsizeof(mapping) + sum(
+        sys.getsizeof(key) + sys.getsizeof(value) for key, value in iteritems(mapping))
+
+
+def measure_citations_counting(records=100000, references=30, seed=0):
+    """Compare the recount of citations with ``numpy`` and with a ``Counter``.
+
+    Both ways are run on the same synthetic references, where each record
+    cites on average ``references`` records drawn with Pareto distributed
+    weights, so that a few records get most of the citations, as in INSPIRE. The
+    ``Counter`` is the way ``add_citation_counts`` used to count them, and
+    then join them to the UUIDs of the records with a dict.
+
+    Returns:
+        list: for each way, its name, the seconds spent counting, the
+        seconds spent joining the counts to the UUIDs, and the MB used
+        by the counts and the mapping to the UUIDs.
+    """
+    random = np.random.RandomState(seed)
+    recids = np.sort(random.choice(2 * records, records, replace=False)).astype(np.int64)
+    uuids = np.frombuffer(random.bytes(16 * records), dtype=np.uint8).reshape(records, 16)
+
+    popularity = random.pareto(1.5, records)
+    cited = random.choice(recids, records * references, p=popularity / popularity.sum())
+    lengths = random.poisson(references, records)
+    references = [
+        chunk.tolist() for chunk in np.split(cited, np.cumsum(lengths)[:-1])
+    ]
+    pids = [(int(recid), str(UUID(bytes=uuid.tobytes()))) for recid, uuid in zip(recids, uuids)]
+
+    results = []
+
+    start = time.time()
+    counter = _count_citations_with_counter(references)
+    counting_time = time.time() - start
+    start = time.time()
+    citations_lookup = {
+        uuid: counter[recid] for recid, uuid in pids if recid in counter
+    }
+    join_time = time.time() - start
+    memory = _get_dict_size(counter) + _get_dict_size(citations_lookup)
+    results.append(('Counter', counting_time, join_time, memory / 2 ** 20))
+
+    start = time.time()
+    counts = count_citations(references)
+    counting_time = time.time() - start
+    start = time.time()
+    citation_counts = get_counts_at(counts, recids)
+    join_time = time.time() - start
+    memory = sum(array.nbytes for array in (counts, recids, uuids, citation_counts))
+    results.append(('numpy', counting_time, join_time, memory / 2 ** 20))
+
+    return results
+
+
+def load_recids_and_uuids():
+    """Load the recid and UUID of all Literature records in compact arrays.
+
+    Only Literature records are considered, as they are the only ones
+    that can be cited, and whose documents are updated in ES.
+
+    Returns:
+        tuple: an array of recids and an array with the 16 bytes of the
+        UUID of each of them.
+    """
+    index = get_recid_index('lit')
+    index.build()
+    return index.get_arrays()
 
 
 @shared_task()
-def add_citation_counts(chunk_size=500, request_timeout=120):
-    def _build_recid_to_uuid_map(citations_lookup):
-        pids = PersistentIdentifier.query.filter(
-            PersistentIdentifier.object_type == 'rec').yield_per(1000)
-
-        with click.progressbar(pids) as bar:
-            return {
-                pid.object_uuid: citations_lookup[int(pid.pid_value)]
-                for pid in bar if int(pid.pid_value) in citations_lookup
-            }
-
-    def _get_records_to_update_generator(citations_lookup):
-        with click.progressbar(citations_lookup.iteritems()) as bar:
-            for uuid, citation_count in bar:
-                yield {
-                    '_op_type': 'update',
-                    '_index': index,
-                    '_type': doc_type,
-                    '_id': str(uuid),
-                    'doc': {'citation_count': citation_count}
-                }
+def add_citation_counts(chunk_size=500):
+    """Recompute from scratch the citation counts of all records.
+
+    Citation counts are kept up to date when records are committed, so this
+    is only needed to seed them or to repair them. Only the records whose
+    count changed are indexed again. To keep the memory low, the counts and
+    the mapping from recids to UUIDs are kept in ``numpy`` arrays, whose
+    size is reported at the end.
+    """
+    def _get_references():
+        for record in es_scan(
+                es,
+                query={
+                    '_source': 'references.recid',
+                    'filter': {
+                        'exists': {
+                            'field': 'references.recid'
+                        }
+                    },
+                    'size': LARGE_CHUNK_SIZE
+                },
+                scroll=u'2m',
+                index=index,
+                doc_type=doc_type):
+            yield chain.from_iterable(map(
+                force_list, get_value(record, '_source.references.recid')))
 
     index, doc_type = schema_to_index('records/hep.json')
-    citations_lookup = Counter()
 
     click.echo('Extracting all citations...')
-    with click.progressbar(es_scan(
-            es,
-            query={
-                '_source': 'references.recid',
-                'filter': {
-                    'exists': {
-                        'field': 'references.recid'
-                    }
-                },
-                'size': LARGE_CHUNK_SIZE
-            },
-            scroll=u'2m',
-            index=index,
-            doc_type=doc_type)) as records:
-        for record in records:
-            unique_refs_ids = dedupe_list(list(chain.from_iterable(map(
-                force_list, get_value(record, '_source.references.recid')))))
-
-            for unique_refs_id in unique_refs_ids:
-                citations_lookup[unique_refs_id] += 1
-    click.echo('... DONE.')
+    start = time.time()
+    counts = count_citations(_get_references())
+    click.echo('... DONE in {:.1f}s.'.format(time.time() - start))
+
+    click.echo('Storing citation counts...')
+    start = time.time()
+    stored = np.array(list(get_all_citation_counts()), dtype=np.int64).reshape(-1, 2)
+    old_counts = np.zeros(stored[:, 0].max() + 1 if len(stored) else 0, dtype=np.int32)
+    old_counts[stored[:, 0]] = stored[:, 1]
+    del stored
+    replace_citation_counts(
+        (int(recid), int(counts[recid])) for recid in np.flatnonzero(counts))
+    db.session.commit()
+    click.echo('... DONE in {:.1f}s.'.format(time.time() - start))
 
     click.echo('Mapping recids to UUIDs...')
-    citations_lookup = _build_recid_to_uuid_map(citations_lookup)
-    click.echo('... DONE.')
-
-    click.echo('Adding citation numbers...')
-    success, failed = es_bulk(
-        es,
-        _get_records_to_update_generator(citations_lookup),
-        chunk_size=chunk_size,
-        raise_on_exception=False,
-        raise_on_error=False,
-        request_timeout=request_timeout,
-        stats_only=True,
-    )
-    click.echo('... DONE: {} records updated with success. {} failures.'.format(
-        success, failed))
+    start = time.time()
+    recids, uuids = load_recids_and_uuids()
+    changed = np.flatnonzero(
+        get_counts_at(counts, recids) != get_counts_at(old_counts, recids))
+    click.echo('... DONE in {:.1f}s.'.format(time.time() - start))
+
+    click.echo('Indexing the {} records whose citation count changed...'.format(len(changed)))
+    start = time.time()
+    failed = 0
+    batches = chunker(changed, chunk_size)
+    with click.progressbar(batches, length=-(-len(changed) // chunk_size)) as bar:
+        for chunk in bar:
+            failed += len(index_or_queue_records({}, [
+                str(UUID(bytes=uuids[i].tobytes())) for i in chunk
+            ]))
+    click.echo('... DONE in {:.1f}s: {} failures.'.format(time.time() - start, failed))
+
+    memory = sum(array.nbytes for array in (counts, old_counts, recids, uuids, changed))
+    click.echo('Citation counts arrays used {:.1f} MB.'.format(memory / 2 ** 20))
 
 
 def create_record(record):
@@ -312,47 +1280,144 @@ def record_insert_or_replace(json):
         return record
 
 
-def migrate_and_insert_record(raw_record):
-    """Convert a marc21 record to JSON and insert it into the DB."""
-    try:
-        record = marc_create_record(raw_record, keep_singletons=False)
-    except Exception as e:
-        logger.exception('Migrator MARC 21 read Error')
-        return None
+def migrate_and_insert_record(raw_record, recid=None, json_record=None,
+                              stats=None):
+    """Convert a marc21 record to JSON and insert it into the DB.
 
-    recid = int(record['001'])
-    prod_record = InspireProdRecords(recid=recid)
-    prod_record.marcxml = raw_record
-    error = None
+    If any stage fails, the record is stored as invalid along with the
+    details of the error, see :func:`get_error_details`.
 
-    try:
-        json_record = create_record(record)
-    except Exception as e:
-        logger.exception('Migrator DoJSON Error')
-        error = e
+    Args:
+        raw_record(str): the MARCXML of the record.
+        recid(int): the recid of the record, required if ``json_record``
+            is passed.
+        json_record(dict): if passed, the result of an earlier conversion of
+            ``raw_record``, which is then not converted again.
+        stats(MigrationStats): where to record the timings of each stage.
+    """
+    if stats is None:
+        stats = MigrationStats()
+
+    error_details = None
+    marc_record = None
 
+    if json_record is None:
+        start = time.time()
+        try:
+            marc_record = marc_create_record(raw_record, keep_singletons=False)
+            recid = int(marc_record['001'])
+        except Exception:
+            logger.exception('Migrator MARC 21 read Error')
+            stats.add_error('marc')
+            recid = _get_recid_from_item(raw_record)
+            if recid is None:
+                return None
+            error_details = get_error_details('marc', recid)
+        stats.add('marc', time.time() - start)
+
+        if not error_details:
+            start = time.time()
+            try:
+                json_record = create_record(marc_record)
+            except Exception:
+                logger.exception('Migrator DoJSON Error')
+                stats.add_error('dojson')
+                error_details = get_error_details('dojson', recid)
+            stats.add('dojson', time.time() - start)
+
+    prod_record = InspireProdRecords(recid=recid, last_updated=datetime.utcnow())
+    prod_record.marcxml = raw_record
+
+    start = time.time()
     try:
-        if not error:
+        if not error_details:
             record = record_insert_or_replace(json_record)
     except ValidationError as e:
         # Aggregate logs by part of schema being validated.
         pattern = u'Migrator Validator Error: {}, Value: %r, Record: %r'
         logger.error(pattern.format('.'.join(e.schema_path)), e.instance, recid)
-        error = e
-    except Exception as e:
+        stats.add_error('insert')
+        error_details = get_error_details('validation', recid)
+    except Exception:
         # Receivers can always cause exceptions and we could dump the entire
         # chunk because of a single broken record.
         logger.exception('Migrator Record Insert Error')
-        error = e
+        stats.add_error('insert')
+        error_details = get_error_details('insert', recid)
+    if not error_details or error_details['error_stage'] in ('validation', 'insert'):
+        stats.add('insert', time.time() - start)
 
-    if error:
+    if error_details:
         # Invalid record, will not get indexed.
-        error_str = u'{0}: Record {1}: {2}'.format(type(error), recid, e)
+        if marc_record is None:
+            try:
+                marc_record = marc_create_record(raw_record, keep_singletons=False)
+            except Exception:
+                pass
         prod_record.valid = False
-        prod_record.errors = error_str
+        prod_record.collection = get_collection(marc_record) if marc_record else None
+        for key, value in iteritems(error_details):
+            setattr(prod_record, key, value)
         db.session.merge(prod_record)
         return None
     else:
         prod_record.valid = True
         db.session.merge(prod_record)
         return record
+
+
+def get_error_details(stage, recid):
+    """Get the details of the error being handled, to store them.
+
+    Validation errors are identified by the validator and the path in the
+    schema that failed, other errors by the frames of their traceback, so
+    that records broken for the same reason share the same fingerprint.
+
+    Note:
+        It must be called from an ``except`` block.
+
+    Returns:
+        dict: the values of the error columns of ``InspireProdRecords``.
+    """
+    exc_type, exc, tb = sys.exc_info()
+
+    if isinstance(exc, ValidationError):
+        schema_path = '.'.join(text_type(el) for el in exc.schema_path)
+        return {
+            'errors': u'{0}: Record {1}: {2}'.format(exc_type, recid, exc),
+            'error_stage': stage,
+            'error_validator': exc.validator,
+            'error_schema_path': schema_path,
+            'error_fingerprint': _get_fingerprint(stage, exc.validator, schema_path),
+        }
+
+    frames = [
+        u'{}:{}'.format(filename, name)
+        for filename, _, name, _ in traceback.extract_tb(tb)
+    ]
+    return {
+        'errors': u''.join(traceback.format_exception(exc_type, exc, tb)),
+        'error_stage': stage,
+        'error_validator': None,
+        'error_schema_path': None,
+        'error_fingerprint': _get_fingerprint(stage, exc_type.__name__, *frames),
+    }
+
+
+def _get_fingerprint(*parts):
+    return hashlib.sha1(u'\n'.join(parts).encode('utf8')).hexdigest()
+
+
+def get_collection(marc_record):
+    """Get the collection of a MARC record from its 980 fields."""
+    collections = set()
+    for field in force_list(marc_record.get('980__')):
+        for v in field.values():
+            for e in force_list(v):
+                collections.add(e.upper().strip())
+    if 'DELETED' in collections:
+        return 'DELETED'
+    for collection in collections:
+        if collection in REAL_COLLECTIONS:
+            return collection
+    return 'HEP'
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Compact in-memory index from recids to the UUIDs of the records."""
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+from collections import defaultdict
+from uuid import UUID
+
+import numpy as np
+from flask import current_app
+from redis import StrictRedis
+from six import iteritems
+
+from invenio_db import db
+from invenio_pidstore.errors import PIDDoesNotExistError
+from invenio_pidstore.models import PersistentIdentifier
+
+
+PID_CHANGES_GENERATION_KEY = 'inspire_pid_index:{pid_type}:generation'
+"""Number of commits that changed the identifiers of a ``pid_type``."""
+
+PID_CHANGES_KEY = 'inspire_pid_index:{pid_type}:changes'
+"""Sorted set of the changed recids of a ``pid_type``, scored by the
+generation of their last change."""
+
+PID_CHANGES_TRIMMED_KEY = 'inspire_pid_index:{pid_type}:trimmed'
+"""Latest generation whose changes were dropped from the sorted set."""
+
+PUBLISH_SCRIPT = """
+local generation = redis.call('INCR', KEYS[1])
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[2], generation, ARGV[i])
+end
+local kept = tonumber(ARGV[1])
+local trimmed = redis.call('ZRANGE', KEYS[2], -kept - 1, -kept - 1, 'WITHSCORES')
+if #trimmed > 0 then
+    redis.call('SET', KEYS[3], trimmed[2])
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -kept - 1)
+end
+return generation
+"""
+"""Record the recids changed by a commit under a new generation, keeping
+only the latest changes."""
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _get_redis():
+    return StrictRedis.from_url(current_app.config['CACHE_REDIS_URL'])
+
+
+def _get_keys(pid_type):
+    return [
+        PID_CHANGES_GENERATION_KEY.format(pid_type=pid_type),
+        PID_CHANGES_KEY.format(pid_type=pid_type),
+        PID_CHANGES_TRIMMED_KEY.format(pid_type=pid_type),
+    ]
+
+
+def get_generation(pid_type):
+    """Get the number of commits that changed the identifiers of a ``pid_type``."""
+    generation_key, _, _ = _get_keys(pid_type)
+    return int(_get_redis().get(generation_key) or 0)
+
+
+def get_changes_since(pid_type, generation):
+    """Get the recids of a ``pid_type`` changed by any process.
+
+    Args:
+        pid_type(str): the type of the persistent identifiers.
+        generation(int): the generation the changes are wanted after.
+
+    Returns:
+        tuple: the current generation, and the list of recids changed after
+        ``generation``, or ``None`` if some of them were already dropped.
+    """
+    generation_key, changes_key, trimmed_key = _get_keys(pid_type)
+    redis = _get_redis()
+    current, trimmed = redis.mget([generation_key, trimmed_key])
+    current, trimmed = int(current or 0), int(trimmed or 0)
+
+    if current <= generation:
+        return current, []
+    if trimmed > generation:
+        return current, None
+
+    changed = redis.zrangebyscore(changes_key, generation + 1, current)
+    return current, [int(recid) for recid in changed]
+
+
+def publish_changes(pid_type, recids):
+    """Let the indexes of all processes know that some recids changed.
+
+    Returns:
+        int: the generation of the changes.
+    """
+    script = _get_redis().register_script(PUBLISH_SCRIPT)
+    max_changes = current_app.config['INSPIRE_PID_INDEX_MAX_SHARED_CHANGES']
+    return script(keys=_get_keys(pid_type), args=[max_changes] + list(recids))
+
+
+class RecidIndex(object):
+    """Sorted recids of a ``pid_type``, with the packed UUID of each record.
+
+    The index is built from Postgres by a background thread, and the recids
+    are looked up in Postgres until it is ready. Then changes to the
+    persistent identifiers committed in this process are kept in a dict on
+    top of it, until there are ``INSPIRE_PID_INDEX_MAX_CHANGES`` of them and
+    they are merged into the arrays. Recids that are not found are looked up
+    in Postgres, so that records committed by other processes are found too,
+    and the whole index is rebuilt in the background every
+    ``INSPIRE_PID_INDEX_MAX_AGE`` seconds.
+
+    Every commit that changes identifiers bumps a generation shared through
+    Redis. At most every ``INSPIRE_PID_INDEX_CHECK_INTERVAL`` seconds, the
+    index fetches the recids changed since the last generation it saw, and
+    checks them in Postgres instead of trusting its own entries. If some of
+    those changes were already dropped from Redis, the recids are looked up
+    in Postgres again until the index is rebuilt.
+    """
+
+    def __init__(self, pid_type):
+        self.pid_type = pid_type
+        self.built = None
+        self.building = False
+        self.checked = 0
+        self.generation = 0
+        self.recids = np.empty(0, dtype=np.int64)
+        self.uuids = np.empty((0, 16), dtype=np.uint8)
+        self.changes = {}
+        self.stale = set()
+        self.lock = threading.RLock()
+        self.build_lock = threading.RLock()
+
+    def build(self):
+        """Build the index from the persistent identifiers in Postgres."""
+        with self.build_lock:
+            self._build()
+
+    def update(self, recid, uuid, generation=None):
+        """Record the UUID of a recid, or ``None`` if its PID was deleted.
+
+        Args:
+            recid(int): the recid.
+            uuid(UUID): the UUID of its record, or ``None``.
+            generation(int): the generation of the change, if it was
+                published by this process.
+        """
+        with self.lock:
+            self.changes[recid] = uuid
+            self.stale.discard(recid)
+            if generation == self.generation + 1:
+                self.generation = generation
+            if len(self.changes) >= current_app.config['INSPIRE_PID_INDEX_MAX_CHANGES']:
+                self._merge_changes()
+
+    def get_arrays(self):
+        """Get the sorted recids and the 16 bytes of the UUID of each of them.
+
+        Meant for batch jobs, so the index is built first if needed.
+        """
+        if self.built is None or self._is_expired():
+            with self.build_lock:
+                if self.built is None or self._is_expired():
+                    self._build()
+        if not self._check_stale(force=True):
+            self.build()
+        with self.lock:
+            self._merge_changes()
+            return self.recids, self.uuids
+
+    def get_many(self, recids, fallback=True):
+        """Get the UUIDs of the records with some recids.
+
+        Args:
+            recids(iterable): the recids to look up.
+            fallback(bool): whether to look up in Postgres the recids that
+                are not in the index.
+
+        Returns:
+            dict: the UUID of each recid that was found.
+        """
+        recids = [int(recid) for recid in recids]
+
+        if self.built is None or self._is_expired():
+            self._start_build()
+        if self.built is not None and not self._check_stale(recids):
+            self._start_build()
+        if self.built is None:
+            return self._query(recids, keep=False) if fallback else {}
+
+        result = {}
+        with self.lock:
+            changes = self.changes
+            indexed_recids, uuids = self.recids, self.uuids
+            to_search = []
+            for recid in recids:
+                if recid not in changes:
+                    to_search.append(recid)
+                elif changes[recid] is not None:
+                    result[recid] = changes[recid]
+
+        to_search = np.array(to_search, dtype=np.int64)
+        if len(indexed_recids):
+            positions = np.searchsorted(indexed_recids, to_search)
+            positions = np.minimum(positions, len(indexed_recids) - 1)
+            found = indexed_recids[positions] == to_search
+        else:
+            positions = np.zeros(len(to_search), dtype=np.int64)
+            found = np.zeros(len(to_search), dtype=bool)
+        for recid, position in zip(to_search[found], positions[found]):
+            result[int(recid)] = UUID(bytes=uuids[position].tobytes())
+
+        missing = [int(recid) for recid in to_search[~found]]
+        if fallback and missing:
+            result.update(self._query(missing))
+
+        return result
+
+    def get(self, recid, fallback=True):
+        """Get the UUID of the record with a recid, or ``None``."""
+        return self.get_many([recid], fallback=fallback).get(int(recid))
+
+    def _build(self):
+        with self.lock:
+            changes = dict(self.changes)
+        # Changes committed while querying are fetched again after the build.
+        generation = get_generation(self.pid_type)
+
+        query = db.session.query(
+            PersistentIdentifier.pid_value,
+            PersistentIdentifier.object_uuid,
+        ).filter(
+            PersistentIdentifier.pid_type == self.pid_type,
+            PersistentIdentifier.object_type == 'rec',
+            PersistentIdentifier.object_uuid.isnot(None),
+        )
+
+        length = query.count()
+        recids = np.empty(length, dtype=np.int64)
+        uuids = np.empty((length, 16), dtype=np.uint8)
+
+        i = 0
+        for pid_value, object_uuid in query.yield_per(2000):
+            if i == length:
+                # Identifiers created after counting them are looked up in
+                # Postgres until the next build.
+                break
+            if not pid_value.isdigit():
+                continue
+            recids[i] = int(pid_value)
+            uuids[i] = np.frombuffer(object_uuid.bytes, dtype=np.uint8)
+            i += 1
+
+        order = np.argsort(recids[:i], kind='mergesort')
+        with self.lock:
+            self.recids = recids[order]
+            self.uuids = uuids[order]
+            for recid, uuid in iteritems(changes):
+                if self.changes.get(recid, False) == uuid:
+                    del self.changes[recid]
+            self.stale = set()
+            self.generation = generation
+            self.checked = 0
+            self.built = time.time()
+
+    def _start_build(self):
+        """Build the index in a thread, unless it is already being built."""
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+
+        thread = threading.Thread(
+            target=self._build_in_background,
+            args=(current_app._get_current_object(),),
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _build_in_background(self, app):
+        try:
+            with app.app_context():
+                self.build()
+        except Exception:
+            app.logger.exception('Cannot build the index of the %s recids.', self.pid_type)
+        finally:
+            with self.lock:
+                self.building = False
+
+    def _check_stale(self, recids=None, force=False):
+        """Look up in Postgres the recids changed by other processes.
+
+        Args:
+            recids(list): the recids about to be looked up, or ``None`` to
+                check all the changed ones.
+            force(bool): whether to fetch the changed recids from Redis even
+                if they were fetched less than
+                ``INSPIRE_PID_INDEX_CHECK_INTERVAL`` seconds ago.
+
+        Returns:
+            bool: whether the index can be trusted, which is not the case
+            when it missed some changes.
+        """
+        now = time.time()
+        interval = current_app.config['INSPIRE_PID_INDEX_CHECK_INTERVAL']
+        if force or now - self.checked >= interval:
+            generation, changed = get_changes_since(self.pid_type, self.generation)
+            with self.lock:
+                if changed is None and self.generation < generation:
+                    self.built = None
+                elif changed and self.generation < generation:
+                    for recid in changed:
+                        self.changes.pop(recid, None)
+                    self.stale.update(changed)
+                    self.generation = generation
+                self.checked = now
+            if self.built is None:
+                return False
+
+        with self.lock:
+            if recids is None:
+                stale = list(self.stale)
+            else:
+                stale = [recid for recid in recids if recid in self.stale]
+        if stale:
+            found = self._query(stale)
+            for recid in stale:
+                if recid not in found:
+                    self.update(recid, None)
+
+        return True
+
+    def _query(self, recids, keep=True):
+        found = dict(
+            (int(pid_value), object_uuid)
+            for pid_value, object_uuid in db.session.query(
+                PersistentIdentifier.pid_value,
+                PersistentIdentifier.object_uuid,
+            ).filter(
+                PersistentIdentifier.pid_type == self.pid_type,
+                PersistentIdentifier.pid_value.in_([str(recid) for recid in recids]),
+                PersistentIdentifier.object_type == 'rec',
+                PersistentIdentifier.object_uuid.isnot(None),
+            )
+        )
+        if keep:
+            for recid, uuid in iteritems(found):
+                self.update(recid, uuid)
+
+        return found
+
+    def _is_expired(self):
+        max_age = current_app.config['INSPIRE_PID_INDEX_MAX_AGE']
+        return self.built is not None and time.time() - self.built > max_age
+
+    def _merge_changes(self):
+        if not self.changes:
+            return
+
+        changed = np.sort(np.array(list(self.changes), dtype=np.int64))
+        positions = np.minimum(
+            np.searchsorted(changed, self.recids), len(changed) - 1)
+        kept = changed[positions] != self.recids
+        added = [
+            (recid, uuid) for recid, uuid in iteritems(self.changes)
+            if uuid is not None
+        ]
+        added_recids = np.array([recid for recid, _ in added], dtype=np.int64)
+        added_uuids = np.array(
+            [np.frombuffer(uuid.bytes, dtype=np.uint8) for _, uuid in added],
+            dtype=np.uint8,
+        ).reshape(-1, 16)
+
+        recids = np.concatenate([self.recids[kept], added_recids])
+        uuids = np.concatenate([self.uuids[kept], added_uuids])
+        order = np.argsort(recids, kind='mergesort')
+        self.recids, self.uuids = recids[order], uuids[order]
+        self.changes = {}
+
+
+def get_recid_index(pid_type):
+    """Get the index of a ``pid_type`` shared by this process."""
+    with _indexes_lock:
+        if pid_type not in _indexes:
+            _indexes[pid_type] = RecidIndex(pid_type)
+        return _indexes[pid_type]
+
+
+def get_record_uuid(pid_type, recid):
+    """Get the UUID of the record with a recid.
+
+    Raises:
+        PIDDoesNotExistError: if there is no such record.
+    """
+    uuid = get_recid_index(pid_type).get(recid)
+    if uuid is None:
+        raise PIDDoesNotExistError(pid_type, recid)
+
+    return uuid
+
+
+def get_record_uuids(pid_type, recids):
+    """Get the UUIDs of the records with some recids, in the same order.
+
+    Recids of records that do not exist are skipped.
+    """
+    uuids = get_recid_index(pid_type).get_many(recids)
+    return [
+        uuids[int(recid)] for recid in recids
+        if int(recid) in uuids
+    ]
+
+
+def update_recid_indexes_with(pid_changes):
+    """Publish committed changes of recids and apply them to this process.
+
+    Meant as well for identifiers written without the ORM, whose changes are
+    not seen by :func:`update_recid_indexes`.
+
+    Args:
+        pid_changes(iterable): ``(pid_type, recid, uuid)`` tuples, where
+            ``uuid`` is ``None`` if the PID was deleted.
+    """
+    changes_by_pid_type = defaultdict(list)
+    for pid_type, recid, uuid in pid_changes:
+        changes_by_pid_type[pid_type].append((int(recid), uuid))
+
+    for pid_type, changes in iteritems(changes_by_pid_type):
+        generation = publish_changes(pid_type, [recid for recid, _ in changes])
+        index = _indexes.get(pid_type)
+        if index is not None:
+            for recid, uuid in changes:
+                index.update(recid, uuid, generation=generation)
+
+
+def update_recid_indexes(changes):
+    """Update the indexes of all processes with committed changes."""
+    pid_changes = []
+    for model_instance, change in changes:
+        if not isinstance(model_instance, PersistentIdentifier):
+            continue
+        if not model_instance.pid_value.isdigit():
+            continue
+
+        if change == 'delete' or model_instance.object_type != 'rec':
+            uuid = None
+        else:
+            uuid = model_instance.object_uuid
+        pid_changes.append((model_instance.pid_type, model_instance.pid_value, uuid))
+
+    if pid_changes:
+        update_recid_indexes_with(pid_changes)
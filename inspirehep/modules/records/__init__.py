@@ -24,4 +24,5 @@
 
 from __future__ import absolute_import, division, print_function
 
+from .ext import InspireRecords  # noqa: F401
 from .receivers import *  # noqa: F401,F403
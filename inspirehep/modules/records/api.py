@@ -25,7 +25,9 @@
 from __future__ import absolute_import, division, print_function
 
 import copy
+from collections import OrderedDict
 from datetime import datetime
+from itertools import chain
 
 import arrow
 from elasticsearch.exceptions import NotFoundError
@@ -39,7 +41,12 @@ from invenio_pidstore.models import PersistentIdentifier
 from invenio_records_files.api import Record
 from invenio_db import db
 
-from inspirehep.modules.records.utils import open_url_or_path
+from inspirehep.modules.records.files import link_file, put_file
+from inspirehep.modules.records.utils import (
+    download_urls,
+    is_url,
+    open_url_or_path,
+)
 from inspirehep.utils.record_getter import (
     RecordGetterError,
     get_es_record_by_uuid
@@ -49,6 +56,62 @@ from inspirehep.utils.record_getter import (
 MAX_UNIQUE_KEY_COUNT = 50000
 
 
+class FilesKeyAllocator(object):
+
+    """Unique keys for the files of a record.
+
+    Gives the same keys as trying ``key``, ``key_1``, ``key_2`` and so on
+    until a free one is found, but remembers for each key the suffixes that
+    are already taken, so that allocating many files with the same name
+    takes constant time for each of them instead of trying all the
+    previous suffixes again.
+
+    Keys are never freed, so it must not outlive the changes made to the
+    files of the record.
+    """
+
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+        self.next_suffixes = {}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def allocate(self, key):
+        """Return the first free key among ``key``, ``key_1``, ``key_2``...
+
+        The returned key is marked as taken.
+
+        Raises:
+
+            Exception: if no free key is found in the first
+                ``MAX_UNIQUE_KEY_COUNT`` suffixes.
+        """
+        new_key = key
+        count = self.next_suffixes.get(key, 1)
+        if new_key in self.keys:
+            new_key = '%s_%s' % (key, count)
+        while new_key in self.keys:
+            count += 1
+            # This should never happen, but just in case to abort infinite
+            # loops we add this safeguard.
+            if count >= MAX_UNIQUE_KEY_COUNT:
+                raise Exception(
+                    'Unable to find a unique key in the first %s, aborting.'
+                    % MAX_UNIQUE_KEY_COUNT
+                )
+            new_key = '%s_%s' % (key, count)
+
+        if new_key != key:
+            self.next_suffixes[key] = count + 1
+
+        self.keys.add(new_key)
+        return new_key
+
+
 class InspireRecord(Record):
 
     """Record class that fetches records from DataBase."""
@@ -196,7 +259,7 @@ class InspireRecord(Record):
             key = self._get_unique_files_key(base_file_name=file_name)
 
         if stream is not None:
-            self.files[key] = stream
+            put_file(self.files, key, stream)
 
         builder = LiteratureBuilder(record=self.dumps())
         metadata['key'] = key
@@ -307,42 +370,50 @@ class InspireRecord(Record):
             doc_or_fig_obj,
         )
 
-    def _download_to_docs_or_figs(
+    def _prepare_doc_or_fig(
         self,
-        document=None,
-        figure=None,
+        doc_or_fig_obj,
+        files_keys,
         src_record=None,
         only_new=False,
     ):
-        if not document and not figure:
-            raise TypeError(
-                'No document nor figure passed, at least one is needed.'
-            )
+        """Resolve the url and the files key of a document or figure.
+
+        Args:
 
-        is_document = bool(document)
+            doc_or_fig_obj(dict): metadata of the document or figure.
+            files_keys(FilesKeyAllocator): keys of the files of the record,
+                including the ones about to be attached, updated with the
+                key of this one.
+
+        Returns:
+
+            tuple: the resolved metadata, the key to store it under, and the
+                stored file of ``src_record`` it refers to, if any.
+        """
+        url = doc_or_fig_obj['url']
         doc_or_fig_obj = self._resolve_doc_or_fig_url(
-            doc_or_fig_obj=document or figure,
+            doc_or_fig_obj=doc_or_fig_obj,
             src_record=src_record,
             only_new=only_new,
         )
+        key = doc_or_fig_obj['key']
         if doc_or_fig_obj['url'].startswith('/api/files/'):
-            return self.add_document_or_figure(
-                metadata=doc_or_fig_obj,
-                key=doc_or_fig_obj['key'],
-                is_document=is_document,
-            )
+            return doc_or_fig_obj, key, None
 
-        key = doc_or_fig_obj['key']
-        if key not in self.files:
-            key = self._get_unique_files_key(base_file_name=key)
+        src_file = None
+        if url.startswith('/api/files/'):
+            src_file = src_record.files[key].file
 
-        stream = open_url_or_path(doc_or_fig_obj['url'])
-        return self.add_document_or_figure(
-            metadata=doc_or_fig_obj,
-            key=key,
-            stream=stream,
-            is_document=is_document,
-        )
+        if key not in files_keys:
+            key = self._get_unique_files_key(
+                base_file_name=key,
+                files_keys=files_keys,
+            )
+        else:
+            files_keys.add(key)
+
+        return doc_or_fig_obj, key, src_file
 
     def download_documents_and_figures(self, only_new=False, src_record=None):
         """Gets all the documents and figures of the record, and downloads them
@@ -372,9 +443,9 @@ class InspireRecord(Record):
 
             * and there's a `src_record`:
               * and `only_new` is `False`:
-                  * if `key` exists in the src_record files: it will download
-                    the file from the local path derived from the src_record
-                    files.
+                  * if `key` exists in the src_record files: it will link
+                    the file stored for the src_record, without copying its
+                    contents.
 
                   * if `key` does not exist in the src_record files: An
                     exception will be thrown, as the file can't be retrieved.
@@ -384,9 +455,9 @@ class InspireRecord(Record):
                     nothing, as the file is already there.
 
                   * if `key` does not exist in the current record files:
-                    * if `key` exists in the src_record files: it will download
-                      the file from the local path derived from the src_record
-                      files.
+                    * if `key` exists in the src_record files: it will link
+                      the file stored for the src_record, without copying its
+                      contents.
 
                     * if `key` does not exist in the src_record files: An
                       exception will be thrown, as the file can't be retrieved.
@@ -394,6 +465,12 @@ class InspireRecord(Record):
         * if `url` field does not point to the files api: it will try to
           download the new file.
 
+        All the new files are downloaded concurrently before any of them is
+        attached, see :func:`inspirehep.modules.records.utils.download_urls`,
+        and then they are attached in order, first the documents and then the
+        figures, so that the keys they get do not depend on which transfer
+        finished first.
+
         Args:
             only_new(bool): If True, will not re-download any files if the
                 document['key'] matches an existing downloaded file.
@@ -407,21 +484,54 @@ class InspireRecord(Record):
         documents_to_download = self.pop('documents', [])
         figures_to_download = self.pop('figures', [])
 
-        for document in documents_to_download:
-            self._download_to_docs_or_figs(
-                document=document,
-                src_record=src_record,
-                only_new=only_new,
-            )
+        if not documents_to_download and not figures_to_download:
+            return
 
-        for figure in figures_to_download:
-            self._download_to_docs_or_figs(
-                figure=figure,
+        files_keys = FilesKeyAllocator(self.files.keys)
+        to_attach = [
+            self._prepare_doc_or_fig(
+                doc_or_fig_obj=doc_or_fig_obj,
+                files_keys=files_keys,
                 src_record=src_record,
                 only_new=only_new,
+            ) + (is_document,)
+            for doc_or_fig_obj, is_document in chain(
+                ((document, True) for document in documents_to_download),
+                ((figure, False) for figure in figures_to_download),
             )
+        ]
 
-    def _get_unique_files_key(self, base_file_name):
+        urls = list(OrderedDict.fromkeys(
+            doc_or_fig_obj['url'] for doc_or_fig_obj, _, _, _ in to_attach
+            if is_url(doc_or_fig_obj['url'])
+        ))
+        downloaded = dict(zip(urls, download_urls(urls)))
+
+        try:
+            for doc_or_fig_obj, key, src_file, is_document in to_attach:
+                url = doc_or_fig_obj['url']
+                if url.startswith('/api/files/'):
+                    stream = None
+                elif src_file is not None:
+                    link_file(self.files, key, src_file)
+                    stream = None
+                elif url in downloaded:
+                    stream = downloaded[url]
+                    stream.seek(0)
+                else:
+                    stream = open_url_or_path(url)
+
+                self.add_document_or_figure(
+                    metadata=doc_or_fig_obj,
+                    key=key,
+                    stream=stream,
+                    is_document=is_document,
+                )
+        finally:
+            for stream in downloaded.values():
+                stream.close()
+
+    def _get_unique_files_key(self, base_file_name, files_keys=None):
         def _strip_old_control_number(base_name):
             base_name = base_name.split('_', 1)[-1]
             return base_name
@@ -441,20 +551,10 @@ class InspireRecord(Record):
             base_file_name,
         )
 
-        new_key = prepended_key
-        count = 1
-        while new_key in self.files:
-            new_key = '%s_%s' % (prepended_key, count)
-            count += 1
-            # This should never happen, but just in case to abort infinite
-            # loops we add this safeguard.
-            if count > MAX_UNIQUE_KEY_COUNT:
-                raise Exception(
-                    'Unable to find a unique key in the first %s, aborting.'
-                    % MAX_UNIQUE_KEY_COUNT
-                )
+        if files_keys is None:
+            files_keys = FilesKeyAllocator(self.files.keys)
 
-        return new_key
+        return files_keys.allocate(prepended_key)
 
 
 class ESRecord(InspireRecord):
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Records citations.
+
+The citation count of every Literature record is stored in
+``inspire_citation_counts``. Every time Literature records are flushed,
+the recids they cite are compared to the ones of the version in the DB,
+and only the counts of the records that were added or removed are
+updated, in the same transaction. The cited records are reindexed once
+the transaction is committed, and get their citation count at index time.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from collections import Counter
+from itertools import chain, islice
+
+from six import iteritems
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier
+from invenio_records.models import RecordMetadata
+
+from inspire_dojson.utils import get_recid_from_ref
+from inspire_utils.helpers import force_list
+from inspire_utils.record import get_value
+
+from .models import CitationCount
+
+
+CITED_RECIDS_KEY = 'inspire_cited_recids'
+"""Key of the session info with the recids whose citation count changed."""
+
+
+def is_literature(json):
+    """Whether a record is a Literature record."""
+    return bool(json) and 'hep.json' in json.get('$schema', '')
+
+
+def get_references_recids(json):
+    """Get the set of recids cited by a Literature record.
+
+    Deleted records are considered as citing nothing.
+    """
+    if not json or json.get('deleted'):
+        return set()
+
+    refs = force_list(get_value(json, 'references.record'))
+    recids = (get_recid_from_ref(ref) for ref in refs)
+
+    return set(recid for recid in recids if recid)
+
+
+def get_citation_counts_deltas(old_recids, new_recids):
+    """Get how the citation counts change when references are changed."""
+    deltas = Counter()
+
+    for recid in new_recids - old_recids:
+        deltas[recid] += 1
+    for recid in old_recids - new_recids:
+        deltas[recid] -= 1
+
+    return deltas
+
+
+def get_flushed_references_deltas(session):
+    """Get how the citation counts change with the pending records of a session.
+
+    The references of the new, changed and deleted Literature records are
+    compared to the ones of their version in the DB, which is the one the
+    citation counts were last updated from, no matter how the records were
+    changed in memory.
+
+    Returns:
+        Counter: the quantity to add to the citation count of each recid.
+    """
+    deltas = Counter()
+
+    for model in session.new:
+        if isinstance(model, RecordMetadata) and is_literature(model.json):
+            deltas.update(get_citation_counts_deltas(
+                set(), get_references_recids(model.json)))
+
+    changed = {
+        model.id: model for model in chain(session.dirty, session.deleted)
+        if isinstance(model, RecordMetadata) and model.id is not None
+    }
+    if not changed:
+        return deltas
+
+    stored = session.query(RecordMetadata.id, RecordMetadata.json).filter(
+        RecordMetadata.id.in_(list(changed)))
+    for uuid, old_json in stored:
+        model = changed[uuid]
+        new_json = None if model in session.deleted else model.json
+        if not (is_literature(old_json) or is_literature(new_json)):
+            continue
+
+        deltas.update(get_citation_counts_deltas(
+            get_references_recids(old_json), get_references_recids(new_json)))
+
+    return deltas
+
+
+def get_citation_count(recid):
+    """Get the citation count of a record."""
+    citation_count = db.session.query(CitationCount.citation_count).filter(
+        CitationCount.recid == int(recid)).scalar()
+
+    return citation_count or 0
+
+
+def get_citation_counts(recids):
+    """Get the citation counts of some records with a single query.
+
+    Returns:
+        dict: the citation count of each recid, 0 if it was never cited.
+    """
+    recids = set(int(recid) for recid in recids)
+    if not recids:
+        return {}
+
+    citation_counts = dict.fromkeys(recids, 0)
+    citation_counts.update(db.session.query(
+        CitationCount.recid,
+        CitationCount.citation_count,
+    ).filter(CitationCount.recid.in_(recids)))
+
+    return citation_counts
+
+
+def increment_citation_counts(deltas, session=None):
+    """Increment atomically the citation counts of some records.
+
+    Args:
+        deltas(dict): a mapping from recids to the quantity to add to their
+            citation count, which might be negative.
+        session: the session in whose transaction the counts are updated,
+            by default ``db.session``.
+
+    Returns:
+        list: the recids whose citation count changed.
+    """
+    recids = sorted(recid for recid, delta in iteritems(deltas) if delta)
+    if not recids:
+        return []
+
+    statement = pg_insert(CitationCount.__table__).values([
+        {'recid': recid, 'citation_count': deltas[recid]} for recid in recids
+    ])
+    (session or db.session).execute(statement.on_conflict_do_update(
+        index_elements=['recid'],
+        set_={
+            'citation_count': (
+                CitationCount.__table__.c.citation_count +
+                statement.excluded.citation_count
+            ),
+        },
+    ))
+
+    return recids
+
+
+def get_all_citation_counts():
+    """Get the stored citation counts of all records.
+
+    Returns:
+        iterator: pairs of recids and their citation count.
+    """
+    return db.session.query(
+        CitationCount.recid,
+        CitationCount.citation_count,
+    ).yield_per(10000)
+
+
+def replace_citation_counts(citation_counts, chunk_size=10000):
+    """Replace all the citation counts in the current transaction.
+
+    Args:
+        citation_counts(iterable): pairs of recids and their citation count,
+            records not in it are considered to have no citations.
+    """
+    citation_counts = iter(citation_counts)
+
+    db.session.execute(CitationCount.__table__.delete())
+    while True:
+        chunk = list(islice(citation_counts, chunk_size))
+        if not chunk:
+            break
+        db.session.execute(CitationCount.__table__.insert(), [
+            {'recid': recid, 'citation_count': count} for recid, count in chunk
+        ])
+
+
+def get_uuids_of_recids(recids, chunk_size=1000):
+    """Get the UUIDs of the Literature records with the given recids.
+
+    Recids that do not belong to a record, for example because it was not
+    migrated yet, are skipped.
+    """
+    recids = iter(recids)
+    while True:
+        chunk = [str(recid) for recid in islice(recids, chunk_size)]
+        if not chunk:
+            return
+
+        pids = db.session.query(PersistentIdentifier.object_uuid).filter(
+            PersistentIdentifier.pid_type == 'lit',
+            PersistentIdentifier.pid_value.in_(chunk),
+            PersistentIdentifier.object_uuid.isnot(None),
+        )
+        for object_uuid, in pids:
+            yield str(object_uuid)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Manage the files and the links of records."""
+
+from __future__ import absolute_import, division, print_function
+
+import click
+
+from flask_cli import with_appcontext
+
+from .enhancers import measure_populate_recids
+from .files import get_deduplication_report, remove_unreferenced_files
+from .links import backfill_links
+
+
+@click.group()
+def files():
+    """Commands related to the stored files."""
+
+
+@files.command()
+@with_appcontext
+def report():
+    """Show how much storage is saved by sharing the stored files."""
+    result = get_deduplication_report()
+
+    click.echo('Objects:      {:>12} {:>16} bytes'.format(
+        result['objects'], result['objects_size']))
+    click.echo('Stored files: {:>12} {:>16} bytes'.format(
+        result['files'], result['files_size']))
+    click.echo('Unreferenced: {:>12} {:>16} bytes'.format(
+        result['unreferenced'], result['unreferenced_size']))
+    click.echo('Dedup ratio:  {:>12.2f}'.format(result['ratio']))
+
+
+@files.command()
+@click.confirmation_option(
+    prompt='Remove the stored files that no object points to?')
+@with_appcontext
+def clean():
+    """Remove the stored files that no object points to."""
+    count, size = remove_unreferenced_files()
+    click.echo('Removed {} files, {} bytes.'.format(count, size))
+
+
+@click.group()
+def links():
+    """Commands related to the links between records."""
+
+
+@links.command()
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Number of records committed at once.')
+@with_appcontext
+def backfill(batch_size):
+    """Store the links of all the existing records."""
+    total = 0
+    for count in backfill_links(batch_size=batch_size):
+        total += count
+        click.echo('Stored the links of {} records.'.format(total))
+
+
+@click.group()
+def enhancers():
+    """Commands related to the enhancement of records for Elasticsearch."""
+
+
+@enhancers.command()
+@click.option('--authors', type=int, default=3000, show_default=True,
+              help='Number of authors of the synthetic record.')
+@click.option('--references', type=int, default=1000, show_default=True,
+              help='Number of references of the synthetic record.')
+@click.option('--repeat', type=int, default=10, show_default=True,
+              help='Number of times the record is enhanced.')
+@with_appcontext
+def benchmark(authors, references, repeat):
+    """Compare the compiled pass over the references with a full walk."""
+    click.echo('{:<10} {:>14}'.format('pass', 'ms per record'))
+    for name, elapsed in measure_populate_recids(authors, references, repeat):
+        click.echo('{:<10} {:>14.1f}'.format(name, elapsed))
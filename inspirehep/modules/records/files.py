@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Content addressed storage of the files of records and workflows."""
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import shutil
+import tempfile
+
+from flask import current_app
+from sqlalchemy import func
+
+from invenio_db import db
+from invenio_files_rest.models import FileInstance, ObjectVersion
+
+
+CHUNK_SIZE = 64 * 1024
+"""Size of the chunks in which the files are read."""
+
+SPOOL_SIZE = 2 * 1024 * 1024
+"""Size up to which the files are kept in memory before being stored."""
+
+
+class ChecksumStream(object):
+
+    """File like object computing the checksum of what is read from it.
+
+    The checksum has the format of the ones computed by the storage of
+    ``invenio_files_rest``, so that it can be compared with the ones of the
+    stored files.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.md5()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    @property
+    def checksum(self):
+        return 'md5:{}'.format(self.hash.hexdigest())
+
+
+def find_file_instance(checksum, size):
+    """Return the oldest stored file with the given content, if any.
+
+    The file is locked until the end of the transaction, so that it cannot
+    be removed by ``remove_unreferenced_files`` before it is referenced.
+    """
+    return FileInstance.query.filter(
+        FileInstance.checksum == checksum,
+        FileInstance.size == size,
+        FileInstance.readable.is_(True),
+    ).order_by(FileInstance.created).with_for_update(read=True).first()
+
+
+def put_file(files, key, stream):
+    """Store the contents of a stream under a key of a files iterator.
+
+    It does the same as ``files[key] = stream``, but the contents are first
+    spooled while computing their checksum, and if a file with the same
+    contents is already stored, the new object points to it instead of
+    storing the contents again.
+
+    Args:
+        files(FilesIterator): the files of a record or a workflow object.
+        key(str): the key of the file.
+        stream(file): the contents of the file.
+    """
+    if not current_app.config.get('INSPIRE_FILES_DEDUPLICATION'):
+        files[key] = stream
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as temporary_file:
+        checksum_stream = ChecksumStream(stream)
+        shutil.copyfileobj(checksum_stream, temporary_file, CHUNK_SIZE)
+
+        file_instance = find_file_instance(
+            checksum_stream.checksum,
+            checksum_stream.size,
+        )
+        if file_instance is None:
+            temporary_file.seek(0)
+            files[key] = temporary_file
+            return
+
+    link_file(files, key, file_instance)
+
+
+def link_file(files, key, file_instance):
+    """Add a stored file under a key of a files iterator.
+
+    The new object points to the given file, so that its contents are
+    neither read nor copied, even when the file belongs to another bucket.
+
+    Args:
+        files(FilesIterator): the files of a record or a workflow object.
+        key(str): the key of the file.
+        file_instance(FileInstance): the stored file.
+    """
+    with db.session.begin_nested():
+        obj = ObjectVersion.create(files.bucket, key, _file_id=file_instance.id)
+        files.filesmap[key] = files.file_cls(obj, {}).dumps()
+        files.flush()
+
+
+def count_references(file_instance):
+    """Return the number of objects, in any bucket, pointing to a file."""
+    return ObjectVersion.query.filter(
+        ObjectVersion.file_id == file_instance.id,
+    ).count()
+
+
+def get_unreferenced_files():
+    """Return a query of the stored files that no object points to.
+
+    As stored files are shared between buckets, these are the only ones
+    whose contents can be removed.
+    """
+    references = ObjectVersion.query.filter(
+        ObjectVersion.file_id == FileInstance.id,
+    )
+    return FileInstance.query.filter(~references.exists())
+
+
+def remove_unreferenced_files():
+    """Remove the stored files that no object points to.
+
+    Each file is removed from the database before its contents, and only
+    if it is still unreferenced, so that a file reused in the meantime by
+    ``put_file`` is kept.
+
+    Returns:
+        tuple: the number and the total size of the removed files.
+    """
+    count, size = 0, 0
+    file_ids = get_unreferenced_files().with_entities(FileInstance.id).all()
+    for file_id, in file_ids:
+        file_instance = FileInstance.query.with_for_update().get(file_id)
+        if file_instance is None or count_references(file_instance):
+            db.session.rollback()
+            continue
+
+        storage = file_instance.storage()
+        file_size = file_instance.size or 0
+        db.session.delete(file_instance)
+        db.session.commit()
+
+        storage.delete()
+        count += 1
+        size += file_size
+
+    return count, size
+
+
+def get_deduplication_report():
+    """Return how much storage is saved by sharing the stored files.
+
+    Returns:
+        dict: the number of objects and of stored files, the size that the
+            objects would take without sharing, the size that the stored
+            files take, their ratio, and the number and size of the stored
+            files that no object points to.
+    """
+    objects, objects_size = db.session.query(
+        func.count(ObjectVersion.version_id),
+        func.coalesce(func.sum(FileInstance.size), 0),
+    ).join(FileInstance, ObjectVersion.file_id == FileInstance.id).one()
+
+    files, files_size = db.session.query(
+        func.count(FileInstance.id),
+        func.coalesce(func.sum(FileInstance.size), 0),
+    ).one()
+
+    unreferenced, unreferenced_size = get_unreferenced_files().with_entities(
+        func.count(FileInstance.id),
+        func.coalesce(func.sum(FileInstance.size), 0),
+    ).one()
+
+    objects_size, files_size = int(objects_size), int(files_size)
+
+    return {
+        'objects': objects,
+        'objects_size': objects_size,
+        'files': files,
+        'files_size': files_size,
+        'ratio': objects_size / files_size if files_size else 1.0,
+        'unreferenced': unreferenced,
+        'unreferenced_size': int(unreferenced_size),
+    }
@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Bulk indexing of records in ES."""
+
+from __future__ import absolute_import, division, print_function
+
+import copy
+import json
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+import pytz
+from elasticsearch.helpers import BulkIndexError, expand_action
+from flask import current_app
+from redis import StrictRedis
+from six import iteritems
+
+from invenio_indexer.api import current_record_to_index
+from invenio_indexer.signals import before_record_index
+from invenio_records.api import Record
+from invenio_records.models import RecordMetadata
+from invenio_search import current_search_client as es
+
+from .citations import get_citation_counts, is_literature
+
+
+INDEX_QUEUE_KEY = 'indexer:queue'
+"""List of the UUIDs of the records waiting to be indexed, oldest first."""
+
+INDEX_QUEUE_OPS_KEY = 'indexer:queue:ops'
+INDEX_QUEUE_TIMES_KEY = 'indexer:queue:times'
+INDEX_QUEUE_STATS_KEY = 'indexer:queue:stats'
+INDEX_QUEUE_SCHEDULED_KEY = 'indexer:queue:scheduled'
+INDEX_QUEUE_ATTEMPTS_KEY = 'indexer:queue:attempts'
+"""Number of times each record failed to be indexed in a row, by UUID."""
+
+INDEX_QUEUE_FAILED_KEY = 'indexer:queue:failed'
+"""Operations of the records given up after ``INDEXER_QUEUE_MAX_ATTEMPTS``
+failures, by UUID."""
+
+QUEUE_SCRIPT = """
+local set_op = ARGV[2] == '1' and 'HSET' or 'HSETNX'
+for i = 3, #ARGV, 2 do
+    redis.call(set_op, KEYS[2], ARGV[i], ARGV[i + 1])
+    if redis.call('HSETNX', KEYS[3], ARGV[i], ARGV[1]) == 1 then
+        redis.call('RPUSH', KEYS[1], ARGV[i])
+    end
+end
+return redis.call('LLEN', KEYS[1])
+"""
+"""Queue records whose UUIDs are not already in the queue, keeping the
+latest operation of each of them, or the first one if not replacing."""
+
+POP_SCRIPT = """
+local uuids = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('LTRIM', KEYS[1], #uuids, -1)
+local result = {}
+for _, uuid in ipairs(uuids) do
+    table.insert(result, uuid)
+    table.insert(result, redis.call('HGET', KEYS[2], uuid))
+    table.insert(result, redis.call('HGET', KEYS[3], uuid))
+    redis.call('HDEL', KEYS[2], uuid)
+    redis.call('HDEL', KEYS[3], uuid)
+end
+return result
+"""
+"""Pop the oldest records of the queue, with their operations and the time
+they were queued at."""
+
+
+def _get_redis():
+    return StrictRedis.from_url(current_app.config['CACHE_REDIS_URL'])
+
+
+class AdaptiveBulkIndexer(object):
+    """Send bulk requests to ES sized by their payload and their latency.
+
+    Requests are filled with actions up to a number of bytes, which grows
+    when ES answers faster than ``INDEXER_BULK_TARGET_LATENCY`` and shrinks
+    when it answers slower, between ``INDEXER_BULK_MIN_BYTES`` and
+    ``INDEXER_BULK_MAX_BYTES``. The number of documents, bytes, requests and
+    the time spent in them are accumulated in :attr:`stats`.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or es
+        self.chunk_bytes = current_app.config['INDEXER_BULK_MIN_BYTES']
+        self.stats = Counter(docs=0, errors=0, bytes=0, requests=0, time=0.0)
+
+    def bulk(self, actions, raise_on_error=True, request_timeout=None):
+        """Send actions to ES in bulk.
+
+        Args:
+            actions(iterable): the actions, as accepted by
+                :func:`elasticsearch.helpers.bulk`.
+            raise_on_error(bool): whether to raise a ``BulkIndexError`` at
+                the end if some actions failed.
+            request_timeout(float): the timeout of each request, by default
+                ``INDEXER_BULK_REQUEST_TIMEOUT``.
+
+        Returns:
+            tuple: the number of actions that succeeded and the failed ones.
+        """
+        if request_timeout is None:
+            request_timeout = current_app.config['INDEXER_BULK_REQUEST_TIMEOUT']
+        serializer = self.client.transport.serializer
+
+        success, errors = 0, []
+        lines, size = [], 0
+        for action in actions:
+            action, data = expand_action(action)
+            action_lines = [serializer.dumps(action)]
+            if data is not None:
+                action_lines.append(serializer.dumps(data))
+            action_size = sum(len(line) + 1 for line in action_lines)
+
+            if lines and size + action_size > self.chunk_bytes:
+                chunk_success, chunk_errors = self._send(lines, size, request_timeout)
+                success += chunk_success
+                errors.extend(chunk_errors)
+                lines, size = [], 0
+
+            lines.extend(action_lines)
+            size += action_size
+
+        if lines:
+            chunk_success, chunk_errors = self._send(lines, size, request_timeout)
+            success += chunk_success
+            errors.extend(chunk_errors)
+
+        if errors and raise_on_error:
+            raise BulkIndexError(
+                '{} document(s) failed to index.'.format(len(errors)), errors)
+
+        return success, errors
+
+    def format_throughput(self):
+        """Format the throughput of the requests sent so far."""
+        elapsed = self.stats['time'] or float('inf')
+        return (
+            '{docs} documents in {requests} requests, {errors} errors: '
+            '{rate:.1f} docs/s, {mbps:.2f} MB/s, {size:.0f} kB per request'
+        ).format(
+            rate=self.stats['docs'] / elapsed,
+            mbps=self.stats['bytes'] / elapsed / 2 ** 20,
+            size=self.chunk_bytes / 2 ** 10,
+            **self.stats
+        )
+
+    def _send(self, lines, size, request_timeout):
+        start = time.time()
+        response = self.client.bulk(
+            '\n'.join(lines) + '\n', request_timeout=request_timeout)
+        elapsed = time.time() - start
+
+        success, errors = 0, []
+        for item in response['items']:
+            op_type, info = item.popitem()
+            if 200 <= info.get('status', 500) < 300:
+                success += 1
+            else:
+                errors.append({op_type: info})
+
+        self.stats.update(
+            docs=success + len(errors),
+            errors=len(errors),
+            bytes=size,
+            requests=1,
+            time=elapsed,
+        )
+        if size >= self.chunk_bytes / 2:
+            # Only requests close to the current size tell whether it fits.
+            self._resize(elapsed)
+
+        return success, errors
+
+    def _resize(self, elapsed):
+        config = current_app.config
+        factor = config['INDEXER_BULK_TARGET_LATENCY'] / max(elapsed, 0.001)
+        factor = min(max(factor, 0.5), 2)
+        self.chunk_bytes = int(min(
+            max(self.chunk_bytes * factor, config['INDEXER_BULK_MIN_BYTES']),
+            config['INDEXER_BULK_MAX_BYTES'],
+        ))
+
+
+_bulk_indexer = None
+
+
+def get_bulk_indexer():
+    """Get the bulk indexer of this process, which keeps its request size."""
+    global _bulk_indexer
+    if _bulk_indexer is None:
+        _bulk_indexer = AdaptiveBulkIndexer()
+
+    return _bulk_indexer
+
+
+@contextmanager
+def bulk_load_mode(index=None):
+    """Tune indices for loading many documents, restoring them afterwards.
+
+    Refreshes are disabled and replicas are dropped on the matching
+    indices until the end of the block, even if it fails, after which the
+    previous settings are put back and the indices are refreshed. Replicas
+    are then rebuilt by copying the segments of the primary shards, which is
+    cheaper than indexing every document twice.
+
+    Args:
+        index(str): the indices to tune, by default ``INDEXER_BULK_LOAD_INDICES``.
+    """
+    if index is None:
+        index = current_app.config['INDEXER_BULK_LOAD_INDICES']
+
+    previous_settings = es.indices.get_settings(
+        index=index,
+        name='index.refresh_interval,index.number_of_replicas',
+        flat_settings=True,
+    )
+    es.indices.put_settings(index=index, body={
+        'index': {
+            'refresh_interval': '-1',
+            'number_of_replicas': 0,
+        },
+    })
+
+    try:
+        yield
+    finally:
+        for name, settings in iteritems(previous_settings):
+            settings = settings['settings']
+            es.indices.put_settings(index=name, body={
+                'index': {
+                    'refresh_interval': settings.get('index.refresh_interval', '1s'),
+                    'number_of_replicas': settings.get('index.number_of_replicas', 1),
+                },
+            })
+        es.indices.refresh(index=index)
+
+
+def prepare_record(record, index, doc_type, **kwargs):
+    """Prepare the document of a record, as ``RecordIndexer._prepare_record``.
+
+    The ``kwargs`` are passed to the receivers of ``before_record_index``,
+    e.g. the data prefetched for a whole batch of records.
+    """
+    if current_app.config['INDEXER_REPLACE_REFS']:
+        data = copy.deepcopy(record.replace_refs())
+    else:
+        data = record.dumps()
+
+    data['_created'] = pytz.utc.localize(record.created).isoformat() \
+        if record.created else None
+    data['_updated'] = pytz.utc.localize(record.updated).isoformat() \
+        if record.updated else None
+
+    before_record_index.send(
+        current_app._get_current_object(),
+        json=data,
+        record=record,
+        index=index,
+        doc_type=doc_type,
+        **kwargs
+    )
+
+    return data
+
+
+def create_index_op(record, **kwargs):
+    """Create a version-guarded bulk action indexing a record."""
+    index, doc_type = current_record_to_index(record)
+
+    return {
+        '_op_type': 'index',
+        '_index': index,
+        '_type': doc_type,
+        '_id': str(record.id),
+        '_version': record.revision_id,
+        '_version_type': 'external_gte',
+        '_source': prepare_record(record, index, doc_type, **kwargs),
+    }
+
+
+def create_index_ops(records):
+    """Create the bulk actions indexing a batch of records.
+
+    The citation counts of the Literature records of the batch are fetched
+    with a single query, instead of one per record.
+    """
+    citation_counts = get_citation_counts(
+        record['control_number'] for record in records
+        if is_literature(record) and 'control_number' in record
+    )
+
+    return [create_index_op(record, citation_counts=citation_counts) for record in records]
+
+
+def get_queue_op(model_instance, change):
+    """Get what is needed to index or delete a committed record later.
+
+    The record is indexed from the state it has in the DB at that point, so
+    only the index and the version are kept, in case it is deleted by then.
+    """
+    if model_instance.json is not None:
+        index, doc_type = current_record_to_index(Record(model_instance.json, model_instance))
+    else:
+        index, doc_type = None, None
+
+    return {
+        'delete': change == 'delete' or model_instance.json is None,
+        'index': index,
+        'doc_type': doc_type,
+        'version': model_instance.version_id - 1,
+    }
+
+
+def get_reindex_op():
+    """Get what is needed to index a record that was not committed.
+
+    The record is indexed from the state it has in the DB at that point, and
+    nothing is done if it does not exist anymore.
+    """
+    return {
+        'delete': False,
+        'index': None,
+        'doc_type': None,
+        'version': None,
+    }
+
+
+def queue_records(ops, replace=True):
+    """Queue records to be indexed in bulk by ``process_index_queue``.
+
+    A record that is already in the queue is not queued again, so that it
+    is indexed only once however many times it is committed meanwhile.
+
+    Args:
+        ops(dict): the operations returned by ``get_queue_op``, by UUID.
+        replace(bool): whether the operations replace the ones of the records
+            already in the queue, which should not happen for the ones of
+            ``get_reindex_op``, as they might hide a deletion.
+
+    Returns:
+        int: the number of records in the queue.
+    """
+    args = [time.time(), int(replace)]
+    for uuid, op in iteritems(ops):
+        args.extend([uuid, json.dumps(op)])
+
+    script = _get_redis().register_script(QUEUE_SCRIPT)
+    return script(keys=[INDEX_QUEUE_KEY, INDEX_QUEUE_OPS_KEY, INDEX_QUEUE_TIMES_KEY], args=args)
+
+
+def pop_queued_records(count):
+    """Pop the oldest records from the queue.
+
+    Returns:
+        tuple: the operations by UUID, and the time the oldest of them was
+        queued at, or ``None`` if the queue is empty.
+    """
+    script = _get_redis().register_script(POP_SCRIPT)
+    result = script(
+        keys=[INDEX_QUEUE_KEY, INDEX_QUEUE_OPS_KEY, INDEX_QUEUE_TIMES_KEY], args=[count])
+
+    ops, oldest = OrderedDict(), None
+    for i in range(0, len(result), 3):
+        uuid, op, queued_at = result[i:i + 3]
+        if op is None or queued_at is None:
+            continue
+        ops[uuid.decode('utf8')] = json.loads(op.decode('utf8'))
+        if oldest is None:
+            oldest = float(queued_at)
+
+    return ops, oldest
+
+
+def _get_index_actions(ops):
+    models = RecordMetadata.query.filter(RecordMetadata.id.in_(list(ops))).all()
+    models = {str(model.id): model for model in models}
+
+    records = [
+        Record(model.json, model=model) for model in models.values()
+        if model.json is not None
+    ]
+    for action in create_index_ops(records):
+        yield action
+
+    for uuid, op in iteritems(ops):
+        model = models.get(uuid)
+        if model is not None and model.json is not None:
+            continue
+        elif op['index'] is not None:
+            yield {
+                '_op_type': 'delete',
+                '_index': op['index'],
+                '_type': op['doc_type'],
+                '_id': uuid,
+                '_version': op['version'] if model is None else model.version_id - 1,
+                '_version_type': 'external_gte',
+            }
+
+
+def _get_outdated_conflicts(conflicts):
+    """Get the records whose version conflicts are not due to a newer version.
+
+    A conflict is expected when ES already holds the same or a newer version
+    of the record, or when it was already deleted. Any other conflict, e.g.
+    with a document whose version was bumped by a partial update, means that
+    the document in ES is outdated.
+
+    Args:
+        conflicts(dict): the index, the type, the version and the kind of
+            each action that conflicted, by UUID.
+
+    Returns:
+        list: the UUIDs of the records whose document in ES is outdated.
+    """
+    if not conflicts:
+        return []
+
+    uuids = list(conflicts)
+    docs = es.mget(body={'docs': [
+        {
+            '_index': conflicts[uuid]['index'],
+            '_type': conflicts[uuid]['doc_type'],
+            '_id': uuid,
+            '_source': False,
+        } for uuid in uuids
+    ]})['docs']
+
+    outdated = []
+    for uuid, doc in zip(uuids, docs):
+        conflict = conflicts[uuid]
+        if doc.get('found'):
+            if doc['_version'] >= conflict['version']:
+                continue
+        elif conflict['op_type'] == 'delete':
+            continue
+
+        current_app.logger.error(
+            'Cannot index record %s: version conflict with version %s in ES, '
+            'while the DB is at version %s.',
+            uuid, doc.get('_version'), conflict['version'])
+        outdated.append(uuid)
+
+    return outdated
+
+
+def index_records(ops):
+    """Index or delete records in ES in bulk, as they are in the DB.
+
+    Every action is guarded by the version of the record, so that an older
+    version never replaces a newer one. The deletions of missing documents
+    are not errors, and neither are the conflicts with documents at the same
+    or a newer version, which are checked in ES.
+
+    Args:
+        ops(dict): the operations returned by ``get_queue_op``, by UUID.
+
+    Returns:
+        list: the UUIDs of the records that could not be indexed.
+    """
+    versions = {}
+
+    def _keep_versions(actions):
+        for action in actions:
+            versions[action['_id']] = {
+                'index': action['_index'],
+                'doc_type': action['_type'],
+                'version': action['_version'],
+                'op_type': action['_op_type'],
+            }
+            yield action
+
+    _, errors = get_bulk_indexer().bulk(
+        _keep_versions(_get_index_actions(ops)), raise_on_error=False)
+
+    failed = []
+    conflicts = {}
+    for error in errors:
+        op_type, info = next(iteritems(error))
+        if op_type == 'delete' and info.get('status') == 404:
+            continue
+        if info.get('status') == 409 and info.get('_id') in versions:
+            conflicts[info['_id']] = versions[info['_id']]
+            continue
+        current_app.logger.error('Cannot index record %s: %s', info.get('_id'), info.get('error'))
+        failed.append(info.get('_id'))
+
+    failed.extend(_get_outdated_conflicts(conflicts))
+
+    return failed
+
+
+def _requeue_failed_records(ops):
+    """Queue again the failed records, giving up on the ones failing too often.
+
+    Returns:
+        list: the UUIDs of the records given up.
+    """
+    redis = _get_redis()
+
+    pipeline = redis.pipeline(transaction=False)
+    for uuid in ops:
+        pipeline.hincrby(INDEX_QUEUE_ATTEMPTS_KEY, uuid, 1)
+    attempts = pipeline.execute()
+
+    max_attempts = current_app.config['INDEXER_QUEUE_MAX_ATTEMPTS']
+    given_up = [uuid for uuid, count in zip(ops, attempts) if count >= max_attempts]
+    if given_up:
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.hmset(INDEX_QUEUE_FAILED_KEY, {uuid: json.dumps(ops[uuid]) for uuid in given_up})
+        pipeline.hdel(INDEX_QUEUE_ATTEMPTS_KEY, *given_up)
+        pipeline.execute()
+        current_app.logger.error(
+            'Giving up indexing records after %s attempts: %s', max_attempts, ', '.join(given_up))
+
+    queue_records({uuid: op for uuid, op in iteritems(ops) if uuid not in given_up}, replace=False)
+
+    return given_up
+
+
+def flush_index_queue(count=None):
+    """Index the oldest records of the queue, queueing again the failed ones.
+
+    A record failing ``INDEXER_QUEUE_MAX_ATTEMPTS`` times in a row is not
+    queued again, but kept with its operation in ``INDEX_QUEUE_FAILED_KEY``.
+
+    Returns:
+        int: the number of records popped from the queue.
+    """
+    if count is None:
+        count = current_app.config['INDEXER_QUEUE_BATCH_SIZE']
+
+    ops, oldest = pop_queued_records(count)
+    if not ops:
+        return 0
+
+    try:
+        failed = index_records(ops)
+    except Exception:
+        _requeue_failed_records(ops)
+        raise
+
+    failed = set(uuid for uuid in failed if uuid in ops)
+    given_up = []
+    if failed:
+        given_up = _requeue_failed_records({uuid: ops[uuid] for uuid in failed})
+
+    pipeline = _get_redis().pipeline(transaction=False)
+    indexed = [uuid for uuid in ops if uuid not in failed]
+    if indexed:
+        pipeline.hdel(INDEX_QUEUE_ATTEMPTS_KEY, *indexed)
+        pipeline.hdel(INDEX_QUEUE_FAILED_KEY, *indexed)
+    pipeline.hincrby(INDEX_QUEUE_STATS_KEY, 'indexed', len(indexed))
+    pipeline.hincrby(INDEX_QUEUE_STATS_KEY, 'failed', len(failed))
+    pipeline.hincrby(INDEX_QUEUE_STATS_KEY, 'given_up', len(given_up))
+    pipeline.hset(INDEX_QUEUE_STATS_KEY, 'last_lag', time.time() - oldest)
+    pipeline.execute()
+
+    return len(ops)
+
+
+def set_index_queue_scheduled(expire):
+    """Mark the queue as scheduled to be processed.
+
+    Returns:
+        bool: whether it was not already scheduled.
+    """
+    return bool(_get_redis().set(INDEX_QUEUE_SCHEDULED_KEY, 1, nx=True, ex=expire))
+
+
+def clear_index_queue_scheduled():
+    """Mark the queue as no longer scheduled to be processed."""
+    _get_redis().delete(INDEX_QUEUE_SCHEDULED_KEY)
+
+
+def get_index_queue_stats():
+    """Get the metrics of the queue of records to index.
+
+    Returns:
+        dict: the number of records in the queue, as ``size``, the seconds
+        the oldest of them has been waiting, as ``lag``, the seconds the
+        oldest record of the last flush had been waiting, as ``last_lag``,
+        the numbers of records ``indexed``, ``failed`` and ``given_up`` so
+        far, and the number of records currently given up, as ``dead``.
+    """
+    redis = _get_redis()
+
+    pipeline = redis.pipeline(transaction=False)
+    pipeline.llen(INDEX_QUEUE_KEY)
+    pipeline.lindex(INDEX_QUEUE_KEY, 0)
+    pipeline.hgetall(INDEX_QUEUE_STATS_KEY)
+    pipeline.hlen(INDEX_QUEUE_FAILED_KEY)
+    size, head, stats, dead = pipeline.execute()
+
+    queued_at = redis.hget(INDEX_QUEUE_TIMES_KEY, head) if head is not None else None
+
+    return {
+        'size': size,
+        'lag': time.time() - float(queued_at) if queued_at is not None else 0.0,
+        'last_lag': float(stats.get(b'last_lag', 0)),
+        'indexed': int(stats.get(b'indexed', 0)),
+        'failed': int(stats.get(b'failed', 0)),
+        'given_up': int(stats.get(b'given_up', 0)),
+        'dead': dead,
+    }
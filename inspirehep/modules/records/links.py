@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Links between records through their ``$ref``s.
+
+The ``$ref``s of every record are stored in the ``inspire_records_links``
+table in the same transaction in which the record is written, so that the
+records pointing to a given one can be found exactly, without searching.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from six import iteritems, string_types
+from six.moves.urllib.parse import urlsplit
+
+from invenio_db import db
+from invenio_records.models import RecordMetadata
+
+from inspirehep.modules.pidstore.utils import get_pid_type_from_endpoint
+
+from .models import RecordLink
+
+
+IGNORED_PATHS = ('self',)
+"""Paths of the ``$ref``s of a record that point to the record itself."""
+
+
+def get_ref_target(ref, pid_types=None):
+    """Return the ``pid_type`` and ``pid_value`` a ``$ref`` points to.
+
+    Args:
+        ref(str): an URL such as ``http://inspirehep.net/api/literature/1``.
+        pid_types(dict): cache of the ``pid_type`` of each endpoint.
+
+    Returns:
+        tuple: the ``pid_type`` and ``pid_value``, or ``None`` if the URL
+        does not point to a record.
+    """
+    if pid_types is None:
+        pid_types = {}
+
+    parts = urlsplit(ref).path.rstrip('/').split('/')
+    if len(parts) < 2 or not parts[-1]:
+        return None
+
+    endpoint, pid_value = parts[-2], parts[-1]
+    if endpoint not in pid_types:
+        try:
+            pid_types[endpoint] = get_pid_type_from_endpoint(endpoint)
+        except KeyError:
+            pid_types[endpoint] = None
+
+    if pid_types[endpoint] is None:
+        return None
+
+    return pid_types[endpoint], pid_value
+
+
+def get_links(json):
+    """Return the links of a record.
+
+    Returns:
+        set: the ``(path, pid_type, pid_value)`` of each ``$ref`` of the
+        record, where ``path`` is the dotted path of the ``$ref`` without
+        list indexes, such as ``authors.affiliations.record``.
+    """
+    links = set()
+    pid_types = {}
+
+    def _get_links(element, path):
+        if isinstance(element, dict):
+            ref = element.get('$ref')
+            if isinstance(ref, string_types) and path not in IGNORED_PATHS:
+                target = get_ref_target(ref, pid_types)
+                if target:
+                    links.add((path,) + target)
+
+            for key, value in iteritems(element):
+                if isinstance(value, (dict, list)):
+                    _get_links(value, '{}.{}'.format(path, key) if path else key)
+        elif isinstance(element, list):
+            for value in element:
+                _get_links(value, path)
+
+    if json:
+        _get_links(json, '')
+
+    return links
+
+
+def _get_rows(source_id, json):
+    return [
+        {
+            'source_id': source_id,
+            'path': path,
+            'target_pid_type': pid_type,
+            'target_pid_value': pid_value,
+        } for path, pid_type, pid_value in get_links(json)
+    ]
+
+
+def insert_links(records):
+    """Store the links of records that have none yet.
+
+    Args:
+        records(list): ``(uuid, json)`` of each record.
+    """
+    rows = [row for source_id, json in records for row in _get_rows(source_id, json)]
+    if rows:
+        db.session.execute(RecordLink.__table__.insert(), rows)
+
+
+def replace_links(records):
+    """Replace the stored links of records with their current ones.
+
+    Args:
+        records(list): ``(uuid, json)`` of each record, where ``json`` is
+            ``None`` for a deleted record.
+    """
+    source_ids = [source_id for source_id, _ in records]
+    if not source_ids:
+        return
+
+    db.session.execute(
+        RecordLink.__table__.delete().where(
+            RecordLink.source_id.in_(source_ids)
+        )
+    )
+    insert_links(records)
+
+
+def get_linking_uuids(pid_type, pid_value, paths=None):
+    """Return a query of the UUIDs of the records pointing to a record.
+
+    Args:
+        pid_type(str): the ``pid_type`` of the record.
+        pid_value(str): the ``pid_value`` of the record.
+        paths(list): if passed, only the ``$ref``s at these paths count.
+    """
+    query = db.session.query(RecordLink.source_id).filter(
+        RecordLink.target_pid_type == pid_type,
+        RecordLink.target_pid_value == str(pid_value),
+    )
+    if paths is not None:
+        query = query.filter(RecordLink.path.in_(paths))
+
+    return query.distinct()
+
+
+def iter_linking_uuids(pid_type, pid_value, paths=None, page_size=1000):
+    """Stream the UUIDs of the records pointing to a record, page by page.
+
+    Each page is a separate query, so that the transaction can be committed
+    while the UUIDs are being consumed.
+    """
+    last_id = None
+    while True:
+        query = get_linking_uuids(pid_type, pid_value, paths)
+        if last_id is not None:
+            query = query.filter(RecordLink.source_id > last_id)
+        uuids = [
+            source_id for source_id, in
+            query.order_by(RecordLink.source_id).limit(page_size)
+        ]
+        if not uuids:
+            return
+
+        for uuid in uuids:
+            yield str(uuid)
+        last_id = uuids[-1]
+
+
+def backfill_links(batch_size=1000):
+    """Replace the stored links of all records, in batches.
+
+    Each batch is committed on its own, so that it can be stopped and run
+    again at any time.
+
+    Yields:
+        int: the number of records of each batch.
+    """
+    last_id = None
+    while True:
+        query = db.session.query(RecordMetadata.id, RecordMetadata.json)
+        if last_id is not None:
+            query = query.filter(RecordMetadata.id > last_id)
+        records = query.order_by(RecordMetadata.id).limit(batch_size).all()
+        if not records:
+            return
+
+        replace_links(records)
+        db.session.commit()
+
+        last_id = records[-1][0]
+        yield len(records)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+"""Extra models for records."""
+
+from __future__ import absolute_import, division, print_function
+
+from sqlalchemy_utils.types import UUIDType
+
+from invenio_db import db
+from invenio_files_rest.models import FileInstance
+
+
+db.Index('ix_files_files_checksum', FileInstance.checksum)
+"""Index to find the stored files with the same contents, see ``put_file``."""
+
+
+class RecordLink(db.Model):
+
+    """A ``$ref`` from a record to another one.
+
+    The links of a record are replaced every time it is written, see
+    :mod:`inspirehep.modules.records.links`.
+    """
+
+    __tablename__ = 'inspire_records_links'
+    __table_args__ = (
+        db.Index(
+            'ix_inspire_records_links_target',
+            'target_pid_type',
+            'target_pid_value',
+        ),
+    )
+
+    source_id = db.Column(UUIDType, primary_key=True)
+    """UUID of the record containing the ``$ref``."""
+
+    path = db.Column(db.String(255), primary_key=True)
+    """Dotted path of the ``$ref`` in the record, without list indexes."""
+
+    target_pid_type = db.Column(db.String(6), primary_key=True)
+    """``pid_type`` of the record the ``$ref`` points to."""
+
+    target_pid_value = db.Column(db.String(255), primary_key=True)
+    """``pid_value`` of the record the ``$ref`` points to."""
+
+
+class CitationCount(db.Model):
+
+    """The number of Literature records citing a Literature record.
+
+    The counts are updated in the same transaction as the citing records,
+    see :mod:`inspirehep.modules.records.citations`.
+    """
+
+    __tablename__ = 'inspire_citation_counts'
+
+    recid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    """Recid of the cited record."""
+
+    citation_count = db.Column(db.Integer, nullable=False, default=0)
+    """Number of records citing it."""
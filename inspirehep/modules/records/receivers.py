@@ -25,27 +25,52 @@
 from __future__ import absolute_import, division, print_function
 
 import uuid
+from collections import OrderedDict
 from itertools import chain
 
 import six
+from elasticsearch.helpers import BulkIndexError
 from flask import current_app
-from flask_sqlalchemy import models_committed
+from flask_sqlalchemy import SignallingSession, models_committed
+from sqlalchemy import event
 
-from invenio_indexer.api import RecordIndexer
+from invenio_db import db
 from invenio_indexer.signals import before_record_index
-from invenio_records.api import Record
 from invenio_records.models import RecordMetadata
 from invenio_records.signals import (
+    after_record_delete,
+    after_record_insert,
+    after_record_update,
     before_record_insert,
     before_record_update,
 )
 
-from inspire_dojson.utils import get_recid_from_ref
 from inspire_utils.date import earliest_date
 from inspire_utils.helpers import force_list
-from inspire_utils.name import generate_name_variations
 from inspire_utils.record import get_value
-from inspirehep.modules.authors.utils import phonetic_blocks
+from inspirehep.modules.authors.cache import get_name_variations, get_phonetic_blocks
+from inspirehep.modules.records.citations import (
+    CITED_RECIDS_KEY,
+    get_citation_count,
+    get_flushed_references_deltas,
+    get_uuids_of_recids,
+    increment_citation_counts,
+)
+from inspirehep.modules.records.enhancers import (
+    IndexEnhancer,
+    for_schema,
+    populate_recids,
+)
+from inspirehep.modules.records.indexer import (
+    get_queue_op,
+    get_reindex_op,
+    index_records,
+    queue_records,
+    set_index_queue_scheduled,
+)
+from inspirehep.modules.records.links import replace_links
+from inspirehep.modules.records.tasks import process_index_queue
+from inspirehep.modules.records.utils import get_authors_preview
 
 
 #
@@ -59,7 +84,8 @@ def assign_phonetic_block(sender, record, *args, **kwargs):
 
     Uses the NYSIIS algorithm to compute a phonetic block from each
     signature's full name, skipping those that are not recognized
-    as real names, but logging an error when that happens.
+    as real names, but logging an error when that happens. Blocks
+    are cached by full name, as most authors sign many records.
     """
     if 'hep.json' not in record.get('$schema'):
         return
@@ -72,7 +98,7 @@ def assign_phonetic_block(sender, record, *args, **kwargs):
             authors_map[author['full_name']] = i
 
     try:
-        signatures_blocks = phonetic_blocks(authors_map.keys())
+        signatures_blocks = get_phonetic_blocks(authors_map.keys())
     except Exception as err:
         current_app.logger.error(
             'Cannot extract phonetic blocks for record %d: %s',
@@ -99,26 +125,113 @@ def assign_uuid(sender, record, *args, **kwargs):
             author['uuid'] = str(uuid.uuid4())
 
 
+#
+# after_record_insert & after_record_update & after_record_delete
+#
+
+@after_record_insert.connect
+@after_record_update.connect
+def store_links(sender, record, *args, **kwargs):
+    """Store the ``$ref``s of a record in the same transaction as the record."""
+    replace_links([(record.id, record.model.json)])
+
+
+@after_record_delete.connect
+def remove_links(sender, record, *args, **kwargs):
+    """Remove the ``$ref``s of a deleted record."""
+    replace_links([(record.id, None)])
+
+
+#
+# before_flush & after_rollback
+#
+
+@event.listens_for(SignallingSession, 'before_flush')
+def update_citation_counts_before_flush(session, flush_context, instances):
+    """Update the citation counts of the records cited by flushed records.
+
+    They are updated in the same transaction as the citing records, which
+    are compared to their version in the DB, so that the counts are right
+    however the records were changed. The recids whose count changed are
+    kept in the session until the transaction is committed, when the
+    records are reindexed by ``index_after_commit``.
+    """
+    with session.no_autoflush:
+        recids = increment_citation_counts(
+            get_flushed_references_deltas(session), session=session)
+
+    if recids:
+        session.info.setdefault(CITED_RECIDS_KEY, set()).update(recids)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def forget_cited_recids(session):
+    """Forget the records to reindex when the transaction is rolled back."""
+    session.info.pop(CITED_RECIDS_KEY, None)
+
+
 #
 # models_committed
 #
 
+def index_or_queue_records(ops, reindex=()):
+    """Index records right away, or queue them if ``INDEXER_ASYNC`` is set.
+
+    Args:
+        ops(dict): the operations returned by ``get_queue_op``, by UUID.
+        reindex(iterable): the UUIDs of other records to index again as
+            they are in the DB, unless they are already in ``ops`` or queued.
+
+    Returns:
+        list: the UUIDs of the records that could not be indexed.
+    """
+    reindex_ops = OrderedDict(
+        (uuid, get_reindex_op()) for uuid in reindex if uuid not in ops)
+    if not ops and not reindex_ops:
+        return []
+
+    if not current_app.config.get('INDEXER_ASYNC', False):
+        all_ops = OrderedDict(ops)
+        all_ops.update(reindex_ops)
+        return index_records(all_ops)
+
+    if ops:
+        queue_records(ops)
+    if reindex_ops:
+        queue_records(reindex_ops, replace=False)
+
+    delay = current_app.config['INDEXER_QUEUE_DELAY']
+    if set_index_queue_scheduled(expire=int(delay) + 60):
+        process_index_queue.apply_async(countdown=delay)
+
+    return []
+
+
 @models_committed.connect
 def index_after_commit(sender, changes):
-    """Index a record in ES after it was committed to the DB.
+    """Index records in ES after they were committed to the DB.
 
     This cannot happen in an ``after_record_commit`` receiver from Invenio-Records
     because, despite the name, at that point we are not yet sure whether the record
     has been really committed to the DB.
-    """
-    indexer = RecordIndexer()
 
+    When ``INDEXER_ASYNC`` is set, the records are queued to be indexed in bulk
+    by ``process_index_queue``, which is scheduled to run after ``INDEXER_QUEUE_DELAY``
+    seconds unless it already is, so that the records committed meanwhile are
+    indexed together, and only once. Otherwise, they are indexed right away.
+
+    The records whose citation count changed in the transaction are indexed
+    again as well, which adds the new count to them.
+    """
+    ops = OrderedDict()
     for model_instance, change in changes:
         if isinstance(model_instance, RecordMetadata):
-            if change in ('insert', 'update'):
-                indexer.index(Record(model_instance.json, model_instance))
-            else:
-                indexer.delete(Record(model_instance.json, model_instance))
+            ops[str(model_instance.id)] = get_queue_op(model_instance, change)
+
+    cited_recids = db.session.info.pop(CITED_RECIDS_KEY, ())
+    failed = index_or_queue_records(ops, get_uuids_of_recids(cited_recids))
+    if failed:
+        raise BulkIndexError('{} record(s) failed to index.'.format(len(failed)), failed)
 
 
 #
@@ -129,6 +242,12 @@ def index_after_commit(sender, changes):
 def enhance_after_index(sender, json, *args, **kwargs):
     """Run all the receivers that enhance the record for ES in the right order.
 
+    The chain is compiled once per schema by ``IndexEnhancer``, which only
+    walks the fields that can hold a JSON reference and only runs the
+    receivers that apply to the record, producing the same document as
+    running ``populate_recid_from_ref`` followed by every other receiver
+    in ``INDEX_ENHANCERS``.
+
     .. note::
 
        ``populate_recid_from_ref`` **MUST** come before ``add_book_autocomplete``
@@ -136,22 +255,12 @@ def enhance_after_index(sender, json, *args, **kwargs):
        would be expanded to an incorrect ``payload_recid`` by the former.
 
     """
-    populate_recid_from_ref(sender, json, *args, **kwargs)
-    add_book_autocomplete(sender, json, *args, **kwargs)
-    populate_abstract_source_suggest(sender, json, *args, **kwargs)
-    populate_affiliation_suggest(sender, json, *args, **kwargs)
-    populate_author_count(sender, json, *args, **kwargs)
-    populate_earliest_date(sender, json, *args, **kwargs)
-    populate_inspire_document_type(sender, json, *args, **kwargs)
-    populate_name_variations(sender, json, *args, **kwargs)
-    populate_title_suggest(sender, json, *args, **kwargs)
+    index_enhancer.enhance(sender, json, *args, **kwargs)
 
 
+@for_schema('hep.json')
 def add_book_autocomplete(sender, json, *args, **kwargs):
     """Populate the ```bookautocomplete`` field of Literature records."""
-    if 'hep.json' not in json.get('$schema'):
-        return
-
     if 'book' not in json.get('document_type', []):
         return
 
@@ -176,11 +285,9 @@ def add_book_autocomplete(sender, json, *args, **kwargs):
     })
 
 
+@for_schema('hep.json')
 def populate_inspire_document_type(sender, json, *args, **kwargs):
     """Populate the ``facet_inspire_doc_type`` field of Literature records."""
-    if 'hep.json' not in json.get('$schema'):
-        return
-
     result = []
 
     result.extend(json.get('document_type', []))
@@ -233,43 +340,12 @@ def populate_recid_from_ref(sender, json, *args, **kwargs):
         }
 
     """
-    list_ref_fields_translations = {
-        'deleted_records': 'deleted_recids'
-    }
-
-    def _recursive_find_refs(json_root):
-        if isinstance(json_root, list):
-            items = enumerate(json_root)
-        elif isinstance(json_root, dict):
-            # Note that items have to be generated before altering the dict.
-            # In this case, iteritems might break during iteration.
-            items = json_root.items()
-        else:
-            items = []
-
-        for key, value in items:
-            if (isinstance(json_root, dict) and isinstance(value, dict) and
-                    '$ref' in value):
-                # Append '_recid' and remove 'record' from the key name.
-                key_basename = key.replace('record', '').rstrip('_')
-                new_key = '{}_recid'.format(key_basename).lstrip('_')
-                json_root[new_key] = get_recid_from_ref(value)
-            elif (isinstance(json_root, dict) and isinstance(value, list) and
-                    key in list_ref_fields_translations):
-                new_list = [get_recid_from_ref(v) for v in value]
-                new_key = list_ref_fields_translations[key]
-                json_root[new_key] = new_list
-            else:
-                _recursive_find_refs(value)
-
-    _recursive_find_refs(json)
+    populate_recids(json)
 
 
+@for_schema('hep.json')
 def populate_abstract_source_suggest(sender, json, *args, **kwargs):
     """Populate the ``abstract_source_suggest`` field in Literature records."""
-    if 'hep.json' not in json.get('$schema'):
-        return
-
     abstracts = json.get('abstracts', [])
 
     for abstract in abstracts:
@@ -283,11 +359,9 @@ def populate_abstract_source_suggest(sender, json, *args, **kwargs):
             })
 
 
+@for_schema('journals.json')
 def populate_title_suggest(sender, json, *args, **kwargs):
     """Populate the ``title_suggest`` field of Journals records."""
-    if 'journals.json' not in json.get('$schema'):
-        return
-
     journal_title = get_value(json, 'journal_title.title', default='')
     short_title = json.get('short_title', '')
     title_variants = json.get('title_variants', [])
@@ -309,11 +383,9 @@ def populate_title_suggest(sender, json, *args, **kwargs):
     })
 
 
+@for_schema('institutions.json')
 def populate_affiliation_suggest(sender, json, *args, **kwargs):
     """Populate the ``affiliation_suggest`` field of Institution records."""
-    if 'institutions.json' not in json.get('$schema'):
-        return
-
     ICN = json.get('ICN', [])
     institution_acronyms = get_value(json, 'institution_hierarchy.acronym', default=[])
     institution_names = get_value(json, 'institution_hierarchy.name', default=[])
@@ -345,11 +417,9 @@ def populate_affiliation_suggest(sender, json, *args, **kwargs):
     })
 
 
+@for_schema('hep.json')
 def populate_earliest_date(sender, json, *args, **kwargs):
     """Populate the ``earliest_date`` field of Literature records."""
-    if 'hep.json' not in json.get('$schema'):
-        return
-
     date_paths = [
         'preprint_date',
         'thesis_info.date',
@@ -368,11 +438,9 @@ def populate_earliest_date(sender, json, *args, **kwargs):
             json['earliest_date'] = result
 
 
+@for_schema('hep.json')
 def populate_name_variations(sender, json, *args, **kwargs):
     """Generate name variations for each signature of a Literature record."""
-    if 'hep.json' not in json.get('$schema'):
-        return
-
     authors = json.get('authors', [])
 
     for author in authors:
@@ -382,7 +450,7 @@ def populate_name_variations(sender, json, *args, **kwargs):
                 el['value'] for el in author.get('ids', [])
                 if el['schema'] == 'INSPIRE BAI'
             ]
-            name_variations = generate_name_variations(full_name)
+            name_variations = get_name_variations(full_name)
 
             author.update({'name_variations': name_variations})
             author.update({'name_suggest': {
@@ -392,11 +460,27 @@ def populate_name_variations(sender, json, *args, **kwargs):
             }})
 
 
-def populate_author_count(sender, json, *args, **kwargs):
-    """Populate the ``author_count`` field of Literature records."""
-    if 'hep.json' not in json.get('$schema'):
+@for_schema('hep.json')
+def populate_citation_count(sender, json, *args, **kwargs):
+    """Populate the ``citation_count`` field of Literature records.
+
+    The count is taken from ``citation_counts`` when the record is indexed
+    in a batch whose counts were prefetched, otherwise it is queried.
+    """
+    if 'control_number' not in json:
         return
 
+    recid = int(json['control_number'])
+    citation_counts = kwargs.get('citation_counts')
+    if citation_counts is not None and recid in citation_counts:
+        json['citation_count'] = citation_counts[recid]
+    else:
+        json['citation_count'] = get_citation_count(recid)
+
+
+@for_schema('hep.json')
+def populate_author_count(sender, json, *args, **kwargs):
+    """Populate the ``author_count`` field of Literature records."""
     authors = json.get('authors', [])
 
     authors_excluding_supervisors = [
@@ -404,3 +488,37 @@ def populate_author_count(sender, json, *args, **kwargs):
         if 'supervisor' not in author.get('inspire_roles', [])
     ]
     json['author_count'] = len(authors_excluding_supervisors)
+
+
+@for_schema('hep.json')
+def populate_authors_preview(sender, json, *args, **kwargs):
+    """Populate the ``authors_preview`` and ``number_of_authors`` fields of Literature records.
+
+    They are what search results get instead of the ``authors``, which are
+    thousands in large collaboration papers.
+    """
+    if 'authors' not in json:
+        return
+
+    authors = json['authors']
+    size = current_app.config['INSPIRE_AUTHORS_PREVIEW_SIZE']
+
+    json['authors_preview'] = get_authors_preview(authors, size)
+    json['number_of_authors'] = len(authors)
+
+
+INDEX_ENHANCERS = [
+    add_book_autocomplete,
+    populate_abstract_source_suggest,
+    populate_affiliation_suggest,
+    populate_author_count,
+    populate_earliest_date,
+    populate_inspire_document_type,
+    populate_name_variations,
+    populate_title_suggest,
+    populate_citation_count,
+    populate_authors_preview,
+]
+"""Receivers run by ``enhance_after_index`` after ``populate_recid_from_ref``."""
+
+index_enhancer = IndexEnhancer(INDEX_ENHANCERS)
@@ -24,10 +24,14 @@
 
 from __future__ import absolute_import, division, print_function
 
+from invenio_records_rest.serializers import json_v1
 from invenio_records_rest.serializers.response import search_responsify
 
 from .impactgraph_serializer import ImpactGraphSerializer
-from .json_literature import LiteratureJSONBriefSerializer
+from .json_literature import (
+    LiteratureJSONBriefSerializer,
+    LiteratureJSONFullSerializer,
+)
 from .bibtex_serializer import BIBTEXSerializer
 from .latexeu_serializer import LATEXEUSerializer
 from .latexus_serializer import LATEXUSSerializer
@@ -46,6 +50,12 @@ json_literature_brief_v1_search = search_responsify(
     'application/vnd+inspire.brief+json'
 )
 
+json_literature_full_v1 = LiteratureJSONFullSerializer(json_v1.schema_class)
+json_literature_full_v1_search = search_responsify(
+    json_literature_full_v1,
+    'application/vnd+inspire.full+json'
+)
+
 
 bibtex_v1 = BIBTEXSerializer()
 latexeu_v1 = LATEXEUSerializer()
@@ -24,6 +24,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+from inspirehep.modules.records.utils import restore_authors
 from inspirehep.utils.bibtex import Bibtex
 
 
@@ -47,7 +48,7 @@ class BIBTEXSerializer(object):
         :param links: Dictionary of links to add to response.
         """
         records = []
-        for hit in search_result['hits']['hits']:
+        for hit in restore_authors(search_result['hits']['hits']):
             records.append(Bibtex(record=hit['_source']).format())
 
         return "\n".join(records)
@@ -24,6 +24,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+from inspirehep.modules.records.utils import restore_authors
 from inspirehep.utils.cv_latex_html_text import Cv_latex_html_text
 
 
@@ -47,7 +48,7 @@ class CVFORMATHTMLSerializer(object):
         :param links: Dictionary of links to add to response.
         """
         records = []
-        for hit in search_result['hits']['hits']:
+        for hit in restore_authors(search_result['hits']['hits']):
             records.append(Cv_latex_html_text(hit['_source'],
                                               'cv_latex_html',
                                               '<br/>').format())
@@ -27,6 +27,7 @@ from __future__ import absolute_import, division, print_function
 from invenio_records_rest.serializers.json import JSONSerializer
 
 from inspire_utils.date import format_date
+from inspirehep.modules.records.utils import restore_authors
 from inspirehep.modules.records.wrappers import LiteratureRecord
 
 
@@ -35,8 +36,12 @@ def process_es_hit(record):
     Process record coming from Elasticsearch.
 
     Allows to remove unnecessary fields to reduce bandwidth and speed
-    up the client application.
+    up the client application. Only the ``authors_preview`` is shown
+    when the full list of authors was left out of the search results.
     """
+    if 'authors_preview' in record:
+        authors_preview = record.pop('authors_preview')
+        record.setdefault('authors', authors_preview)
     if 'authors' in record:
         record['authors'] = record['authors'][:10]
     if 'references' in record:
@@ -60,7 +65,9 @@ def get_display_fields(record):
     if 'publication_info' in record:
         display['publication_info'] = record.publication_information
         display['conference_info'] = record.conference_information
-    if 'authors' in record:
+    if 'number_of_authors' in record:
+        display['number_of_authors'] = record['number_of_authors']
+    elif 'authors' in record:
         display['number_of_authors'] = len(record['authors'])
     display['admin_tools'] = record.admin_tools
 
@@ -91,3 +98,13 @@ class LiteratureJSONBriefSerializer(JSONSerializer):
                 record[key[1:]] = record['metadata'][key]
                 del record['metadata'][key]
         return record
+
+
+class LiteratureJSONFullSerializer(JSONSerializer):
+    """JSON serializer of Literature search results with all their authors."""
+
+    def serialize_search(self, pid_fetcher, search_result, **kwargs):
+        """Serialize a search result with the full lists of authors."""
+        restore_authors(search_result['hits']['hits'])
+        return super(LiteratureJSONFullSerializer, self).serialize_search(
+            pid_fetcher, search_result, **kwargs)
@@ -24,10 +24,14 @@
 
 from __future__ import absolute_import, division, print_function
 
+import hashlib
+from itertools import chain
+
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from elasticsearch.helpers import scan
 from flask import current_app
+from redis import StrictRedis
 from six import iteritems
 
 from invenio_db import db
@@ -36,97 +40,220 @@ from invenio_search import current_search_client as es
 
 from inspire_dojson.utils import get_recid_from_ref
 from inspirehep.modules.records.api import InspireRecord
+from inspirehep.modules.records.indexer import (
+    clear_index_queue_scheduled,
+    flush_index_queue,
+)
+from inspirehep.modules.records.links import get_ref_target, iter_linking_uuids
 from inspirehep.modules.records.utils import get_endpoint_from_record
+from inspirehep.utils.helpers import chunker
 from inspirehep.utils.record_getter import get_db_record
 
 
 logger = get_task_logger(__name__)
 
 
+UPDATE_REFS_KEY = 'records:update_refs:{}'
+"""Redis key of the progress of an update of references."""
+
+UPDATE_REFS_DONE_KEY = 'records:update_refs:{}:done'
+"""Redis key of the UUIDs already processed by an update of references."""
+
+UPDATE_REFS_EXPIRE = 7 * 24 * 60 * 60
+"""Seconds after which the progress of an update of references is forgotten."""
+
+
+def _get_redis():
+    return StrictRedis.from_url(current_app.config['CACHE_REDIS_URL'])
+
+
+def _get_update_refs_id(old_ref, new_ref):
+    return hashlib.sha1('{} {}'.format(old_ref, new_ref).encode('utf-8')).hexdigest()
+
+
 @shared_task(ignore_result=True)
-def update_refs(old_ref, new_ref):
+def update_refs(old_ref, new_ref, resume=False):
     """Update references in the entire database.
 
     Replaces all occurrences of ``old_ref`` with ``new_ref``,
     provided that they happen at one of the paths listed in
     ``INSPIRE_REF_UPDATER_WHITELISTS``.
+
+    The UUIDs of the records to update are streamed from the search
+    engine and dispatched in batches of ``INSPIRE_REF_UPDATER_BATCH_SIZE``
+    to ``update_refs_batch``, so that no more than a batch of records is
+    loaded at the same time. The progress is kept in Redis, see
+    ``get_update_refs_progress``.
+
+    Args:
+        old_ref(str): the reference to replace.
+        new_ref(str): the reference to replace it with.
+        resume(bool): if ``True``, the records already processed by a
+            previous run with the same references, e.g. one interrupted by a
+            restart of the workers, are skipped. Otherwise the progress is
+            reset.
     """
-    records = get_records_to_update(old_ref)
+    update_id = _get_update_refs_id(old_ref, new_ref)
+    key = UPDATE_REFS_KEY.format(update_id)
+    done_key = UPDATE_REFS_DONE_KEY.format(update_id)
+    redis = _get_redis()
+
+    if not resume:
+        redis.delete(key, done_key)
+
+    redis.hmset(key, {'old_ref': old_ref, 'new_ref': new_ref, 'dispatched': 0})
+    redis.expire(key, UPDATE_REFS_EXPIRE)
+
+    batch_size = current_app.config['INSPIRE_REF_UPDATER_BATCH_SIZE']
+    for uuids in chunker(get_uuids_to_update(old_ref), batch_size):
+        pipeline = redis.pipeline(transaction=False)
+        for uuid in uuids:
+            pipeline.sismember(done_key, uuid)
+        uuids = [uuid for uuid, done in zip(uuids, pipeline.execute()) if not done]
+        if not uuids:
+            continue
 
+        redis.hincrby(key, 'queued', len(uuids))
+        update_refs_batch.delay(uuids, old_ref, new_ref)
+
+    redis.hset(key, 'dispatched', 1)
+    logger.info('Dispatched the update of references: %s -> %s', old_ref, new_ref)
+
+
+@shared_task(ignore_result=True)
+def update_refs_batch(uuids, old_ref, new_ref):
+    """Update the references of a batch of records in one transaction."""
+    records = InspireRecord.get_records(uuids)
+
+    updated = 0
     with db.session.begin_nested():
         for record in records:
-            logger.info('Updated reference: %s -> %s, Record: %s', old_ref, new_ref, record.id)
-            update_links(record, old_ref, new_ref)
-            record.commit()
+            if update_links(record, old_ref, new_ref):
+                logger.info('Updated reference: %s -> %s, Record: %s', old_ref, new_ref, record.id)
+                record.commit()
+                updated += 1
     db.session.commit()
 
+    update_id = _get_update_refs_id(old_ref, new_ref)
+    key = UPDATE_REFS_KEY.format(update_id)
+    done_key = UPDATE_REFS_DONE_KEY.format(update_id)
+
+    pipeline = _get_redis().pipeline()
+    pipeline.sadd(done_key, *uuids)
+    pipeline.expire(done_key, UPDATE_REFS_EXPIRE)
+    pipeline.hincrby(key, 'processed', len(uuids))
+    pipeline.hincrby(key, 'updated', updated)
+    pipeline.execute()
+
+
+def get_update_refs_progress(old_ref, new_ref):
+    """Get the progress of an update of references.
+
+    Returns:
+        dict: the numbers of records ``queued`` for the update, already
+        ``processed`` and actually ``updated``, and whether all of them
+        were ``dispatched``, in which case the update is over when all the
+        queued records are processed.
+    """
+    key = UPDATE_REFS_KEY.format(_get_update_refs_id(old_ref, new_ref))
+    stats = _get_redis().hgetall(key)
+
+    return {
+        'queued': int(stats.get(b'queued', 0)),
+        'processed': int(stats.get(b'processed', 0)),
+        'updated': int(stats.get(b'updated', 0)),
+        'dispatched': stats.get(b'dispatched') == b'1',
+    }
+
 
 def update_links(record, old_ref, new_ref):
+    """Replace ``old_ref`` with ``new_ref`` at the whitelisted paths.
+
+    Returns:
+        bool: whether any reference was replaced.
+    """
     def _update_links(record, parts, old_ref, new_ref):
         for i, part in enumerate(parts):
             if isinstance(record, dict):
                 try:
                     record = record[part]
                 except KeyError:
-                    return
+                    return False
             elif isinstance(record, list):
-                for el in record:
-                    _update_links(el, parts[i:], old_ref, new_ref)
-                return
+                return any([
+                    _update_links(el, parts[i:], old_ref, new_ref) for el in record
+                ])
 
         if record['$ref'] == old_ref:
             record['$ref'] = new_ref
+            return True
+
+        return False
 
     endpoint = get_endpoint_from_record(record)
     whitelist = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS'][endpoint]
 
-    for path in whitelist:
-        _update_links(record, path.split('.'), old_ref, new_ref)
+    return any([
+        _update_links(record, path.split('.'), old_ref, new_ref) for path in whitelist
+    ])
 
 
-def get_records_to_update(old_ref):
-    def _get_uuids_to_update(old_ref):
-        def _replace_record_with_recid(path):
-            return path.replace('record', 'recid')
+def get_uuids_to_update(old_ref):
+    """Stream the UUIDs of the records that may contain ``old_ref``.
 
-        def _ref_to_recid(ref):
-            return int(ref.split('/')[-1])
+    They are found in the links table if ``INSPIRE_REF_UPDATER_USE_LINKS``
+    is set, otherwise in the search engine.
+    """
+    if current_app.config.get('INSPIRE_REF_UPDATER_USE_LINKS'):
+        return _get_uuids_to_update_from_links(old_ref)
 
-        result = []
+    return _get_uuids_to_update_from_es(old_ref)
 
-        whitelists = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS']
-        for endpoint, whitelist in iteritems(whitelists):
-            fields = [_replace_record_with_recid(path) for path in whitelist]
-            body = {
-                'query': {
-                    'bool': {
-                        'should': [
-                            {
-                                'term': {
-                                    field: {
-                                        'value': _ref_to_recid(old_ref),
-                                    },
-                                },
-                            } for field in fields
-                        ],
-                    },
-                },
-            }
 
-            index = current_app.config['INSPIRE_ENDPOINT_TO_INDEX'][endpoint]
-            query = scan(es, query=body, index=index)
+def _get_uuids_to_update_from_links(old_ref):
+    target = get_ref_target(old_ref)
+    if target is None:
+        return iter([])
 
-            result.extend(el['_id'] for el in list(query))
+    whitelists = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS']
+    paths = set(chain.from_iterable(whitelists.values()))
+    pid_type, pid_value = target
 
-        return result
+    return iter_linking_uuids(pid_type, pid_value, paths=paths)
 
-    def _get_records_to_update(uuids):
-        return InspireRecord.get_records(uuids)
 
-    uuids = _get_uuids_to_update(old_ref)
-    records = _get_records_to_update(uuids)
+def _get_uuids_to_update_from_es(old_ref):
+    def _replace_record_with_recid(path):
+        return path.replace('record', 'recid')
 
-    return records
+    def _ref_to_recid(ref):
+        return int(ref.split('/')[-1])
+
+    whitelists = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS']
+    for endpoint, whitelist in iteritems(whitelists):
+        if not whitelist:
+            continue
+
+        fields = [_replace_record_with_recid(path) for path in whitelist]
+        body = {
+            'query': {
+                'bool': {
+                    'should': [
+                        {
+                            'term': {
+                                field: {
+                                    'value': _ref_to_recid(old_ref),
+                                },
+                            },
+                        } for field in fields
+                    ],
+                },
+            },
+        }
+
+        index = current_app.config['INSPIRE_ENDPOINT_TO_INDEX'][endpoint]
+        for hit in scan(es, query=body, index=index, _source=False):
+            yield hit['_id']
 
 
 @shared_task
@@ -173,3 +300,17 @@ def get_records_to_merge():
     records = _get_records_to_merge(uuids)
 
     return records
+
+
+@shared_task(ignore_result=True)
+def process_index_queue():
+    """Index in bulk all the records queued by ``index_after_commit``.
+
+    The flag that prevents scheduling this task again is removed first, so
+    that the records committed while the queue is being drained schedule
+    another run.
+    """
+    clear_index_queue_scheduled()
+
+    while flush_index_queue():
+        pass
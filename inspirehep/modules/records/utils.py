@@ -25,17 +25,40 @@
 from __future__ import absolute_import, division, print_function
 
 import requests
+import shutil
 import sys
+import tempfile
 import traceback
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore
+
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from six import iteritems
 from six.moves.urllib.parse import urlparse
 
+from invenio_search import current_search_client as es
+
 from inspirehep.modules.pidstore.utils import (
     get_endpoint_from_pid_type,
     get_pid_type_from_schema
 )
 
 
+AUTHOR_SEARCH_FIELDS = ('name_suggest', 'name_variations', 'signature_block', 'uuid')
+"""Fields of the authors that are only used to search them."""
+
+KNOWN_SCHEMES = ('http', 'https')
+"""Schemes of the files that are downloaded instead of opened locally."""
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+"""Size of the chunks in which the downloaded files are written."""
+
+DOWNLOAD_SPOOL_SIZE = 2 * 1024 * 1024
+"""Size up to which the downloaded files are kept in memory."""
+
+
 class FailedToOpenUrlPath(Exception):
 
     def __init__(self, path, exception=None, msg=None):
@@ -60,11 +83,15 @@ def get_detailed_template_from_record(record):
     return current_app.config['RECORDS_UI_ENDPOINTS'][endpoint]['template']
 
 
-def open_url_or_path(file_path):
-    known_schemes = ['http', 'https']
+def is_url(file_path):
+    """Return whether the given file has to be downloaded."""
+    return urlparse(file_path).scheme in KNOWN_SCHEMES
+
+
+def open_url_or_path(file_path, session=None, timeout=None):
     try:
-        if urlparse(file_path).scheme in known_schemes:
-            resp = requests.get(url=file_path, stream=True)
+        if is_url(file_path):
+            resp = (session or requests).get(url=file_path, stream=True, timeout=timeout)
             if resp.status_code == 200:
                 resp.raw.decode_content = True
                 return resp.raw
@@ -78,3 +105,134 @@ def open_url_or_path(file_path):
         raise
     except Exception as error:
         raise FailedToOpenUrlPath(path=file_path, exception=error)
+
+
+def download_urls(urls):
+    """Download the given urls concurrently.
+
+    The transfers run on a pool of ``INSPIRE_FILES_DOWNLOAD_WORKERS``
+    threads sharing the connections of a single session, with at most
+    ``INSPIRE_FILES_DOWNLOAD_MAX_PER_HOST`` of them talking to the same
+    host. Each file is streamed in chunks into a temporary file, which is
+    kept in memory only while it is small.
+
+    Args:
+        urls(list): the urls to download.
+
+    Returns:
+        list: temporary files with the contents of the urls, in the same
+            order, that the caller has to close.
+
+    Raises:
+        FailedToOpenUrlPath: for the first url that could not be downloaded,
+            once all the transfers finished.
+    """
+    if not urls:
+        return []
+
+    config = current_app.config
+    workers = min(len(urls), config['INSPIRE_FILES_DOWNLOAD_WORKERS'])
+    max_per_host = config['INSPIRE_FILES_DOWNLOAD_MAX_PER_HOST']
+    timeout = config['INSPIRE_FILES_DOWNLOAD_TIMEOUT']
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=workers,
+        pool_maxsize=max_per_host,
+        max_retries=Retry(
+            total=config['INSPIRE_FILES_DOWNLOAD_RETRIES'],
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+        ),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    host_limits = {
+        urlparse(url).netloc: BoundedSemaphore(max_per_host) for url in urls
+    }
+
+    def _download(url):
+        with host_limits[urlparse(url).netloc]:
+            try:
+                stream = open_url_or_path(url, session=session, timeout=timeout)
+            except FailedToOpenUrlPath as error:
+                return None, error
+
+            temporary_file = tempfile.SpooledTemporaryFile(
+                max_size=DOWNLOAD_SPOOL_SIZE,
+            )
+            try:
+                shutil.copyfileobj(stream, temporary_file, DOWNLOAD_CHUNK_SIZE)
+            except Exception as error:
+                temporary_file.close()
+                return None, FailedToOpenUrlPath(path=url, exception=error)
+            finally:
+                stream.close()
+
+        temporary_file.seek(0)
+        return temporary_file, None
+
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(_download, urls)
+    finally:
+        pool.terminate()
+        session.close()
+
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        for temporary_file, _ in results:
+            if temporary_file is not None:
+                temporary_file.close()
+        raise errors[0]
+
+    return [temporary_file for temporary_file, _ in results]
+
+
+def get_authors_preview(authors, size):
+    """Return the first authors of a record, without their search fields."""
+    return [
+        {key: value for key, value in iteritems(author) if key not in AUTHOR_SEARCH_FIELDS}
+        for author in authors[:size]
+    ]
+
+
+def restore_authors(hits):
+    """Put back the authors in search hits of Literature records.
+
+    Search results leave the ``authors`` out because of
+    ``INSPIRE_SEARCH_SOURCE_EXCLUDES``, so they are replaced by the
+    ``authors_preview`` of each hit, and the full list of the hits that
+    have more authors than that is fetched in a single request.
+
+    Args:
+        hits(list): the hits of a search result, modified in place.
+
+    Returns:
+        list: the same hits.
+    """
+    truncated = {}
+    for hit in hits:
+        source = hit['_source']
+        if 'authors' in source or 'authors_preview' not in source:
+            continue
+
+        source['authors'] = source.pop('authors_preview')
+        if source.get('number_of_authors', 0) > len(source['authors']):
+            truncated[hit['_id']] = hit
+
+    if truncated:
+        documents = es.mget(
+            body={'docs': [
+                {'_index': hit['_index'], '_type': hit['_type'], '_id': hit['_id']}
+                for hit in truncated.values()
+            ]},
+            _source_include='authors',
+            _source_exclude=','.join('authors.' + field for field in AUTHOR_SEARCH_FIELDS),
+        )
+        for document in documents['docs']:
+            if document.get('found'):
+                truncated[document['_id']]['_source']['authors'] = document['_source'].get('authors', [])
+
+    return hits
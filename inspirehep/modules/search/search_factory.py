@@ -59,6 +59,10 @@ def inspire_search_factory(self, search):
                 )
 
     search_index = search._index[0]
+    source_excludes = current_app.config['INSPIRE_SEARCH_SOURCE_EXCLUDES'].get(search_index)
+    if source_excludes:
+        search = search.extra(_source={'exclude': source_excludes})
+
     search, urlkwargs = default_facets_factory(search, search_index)
     search, sortkwargs = default_sorter_factory(search, search_index)
     for key, value in sortkwargs.items():
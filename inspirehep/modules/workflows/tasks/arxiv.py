@@ -41,6 +41,7 @@ from dojson.contrib.marc21.utils import create_record
 from inspire_dojson.hep import hep
 from inspire_schemas.builders import LiteratureBuilder
 from inspire_schemas.utils import classify_field
+from inspirehep.modules.records.files import put_file
 from inspirehep.modules.workflows.utils import convert
 from inspirehep.utils.record import get_arxiv_categories, get_arxiv_id
 from inspirehep.utils.url import is_pdf_link
@@ -155,7 +156,7 @@ def arxiv_plot_extract(obj, eng):
                     key = '{number}_{name}'.format(number=index, name=plot_name)
 
                 with open(plot.get('url')) as plot_file:
-                    obj.files[key] = plot_file
+                    put_file(obj.files, key, plot_file)
 
                 lb.add_figure(
                     key=key,
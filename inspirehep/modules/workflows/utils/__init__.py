@@ -36,6 +36,8 @@ import lxml.etree as ET
 import requests
 from flask import current_app
 
+from inspirehep.modules.records.files import put_file
+
 from ..models import WorkflowsAudit
 
 
@@ -176,7 +178,7 @@ def download_file_to_workflow(workflow, name, url):
     with closing(requests.get(url=url, stream=True)) as req:
         if req.status_code == 200:
             req.raw.decode_content = True
-            workflow.files[name] = req.raw
+            put_file(workflow.files, name, req.raw)
             return workflow.files[name]
 
 
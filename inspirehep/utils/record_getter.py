@@ -31,6 +31,7 @@ from werkzeug.utils import import_string
 
 from invenio_pidstore.models import PersistentIdentifier
 
+from inspirehep.modules.pidstore.index import get_record_uuid, get_record_uuids
 from inspirehep.modules.pidstore.utils import get_endpoint_from_pid_type
 
 
@@ -64,23 +65,18 @@ def raise_record_getter_error_and_log(f):
 
 @raise_record_getter_error_and_log
 def get_es_record(pid_type, recid, **kwargs):
-    pid = PersistentIdentifier.get(pid_type, recid)
+    uuid = get_record_uuid(pid_type, recid)
 
     endpoint = get_endpoint_from_pid_type(pid_type)
     search_conf = current_app.config['RECORDS_REST_ENDPOINTS'][endpoint]
     search_class = import_string(search_conf['search_class'])()
 
-    return search_class.get_source(pid.object_uuid, **kwargs)
+    return search_class.get_source(uuid, **kwargs)
 
 
 def get_es_records(pid_type, recids, **kwargs):
     """Get a list of recids from ElasticSearch."""
-    recids = [str(recid) for recid in recids]
-    uuids = PersistentIdentifier.query.filter(
-        PersistentIdentifier.pid_value.in_(recids),
-        PersistentIdentifier.pid_type == pid_type
-    ).all()
-    uuids = [str(uuid.object_uuid) for uuid in uuids]
+    uuids = [str(uuid) for uuid in get_record_uuids(pid_type, recids)]
 
     endpoint = get_endpoint_from_pid_type(pid_type)
     search_conf = current_app.config['RECORDS_REST_ENDPOINTS'][endpoint]
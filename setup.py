@@ -93,6 +93,7 @@ install_requires = [
     'langdetect~=1.0,>=1.0.7',
     'librabbitmq~=1.0,>=1.6.1',
     'nameparser~=0.0,>=0.5.3',
+    'numpy~=1.0,>=1.11.0',
     'orcid~=0.0,>=0.7.0',
     'plotextractor~=0.0,>=0.1.6',
     'python-redis-lock~=3.0,>=3.2.0',
@@ -138,6 +139,9 @@ extras_require = {
         'invenio-xrootd>=1.0.0a5',
         'xrootdpyfs~=0.0,>=0.1.5',
     ],
+    'zstd': [
+        'zstandard~=0.0,>=0.8.1',
+    ],
 }
 
 extras_require['all'] = []
@@ -211,6 +215,7 @@ setup(
             'inspire_hal = inspirehep.modules.hal:InspireHAL',
             'inspire_literaturesuggest = inspirehep.modules.literaturesuggest:InspireLiteratureSuggest',
             'inspire_migrator = inspirehep.modules.migrator:InspireMigrator',
+            'inspire_records = inspirehep.modules.records:InspireRecords',
             'inspire_search = inspirehep.modules.search:InspireSearch',
             'inspire_theme = inspirehep.modules.theme:INSPIRETheme',
             'inspire_tools = inspirehep.modules.tools:InspireTools',
@@ -226,6 +231,7 @@ setup(
             'inspirehep = inspirehep:alembic',
         ],
         'invenio_db.models': [
+            'inspire_records = inspirehep.modules.records.models',
             'inspire_workflows_audit = inspirehep.modules.workflows.models',
         ],
         'invenio_jsonschemas.schemas': [
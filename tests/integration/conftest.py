@@ -60,6 +60,7 @@ def app():
         CELERY_RESULT_BACKEND='cache',
         CELERY_CACHE_BACKEND='memory',
         CELERY_EAGER_PROPAGATES_EXCEPTIONS=True,
+        INDEXER_ASYNC=False,
         SECRET_KEY='secret!',
         TESTING=True,
     )
@@ -97,7 +98,7 @@ def small_app():
        Use ``app`` instead.
     """
     app = create_app()
-    app.config.update({'DEBUG': True})
+    app.config.update({'DEBUG': True, 'INDEXER_ASYNC': False})
 
     with app.app_context():
         # Celery task imports must be local, otherwise their
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+from copy import deepcopy
+
+from inspire_schemas.api import validate
+from inspirehep.modules.records.receivers import (
+    INDEX_ENHANCERS,
+    enhance_after_index,
+    populate_recid_from_ref,
+)
+
+
+def _get_large_collaboration_record():
+    return {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        '_collections': ['Literature'],
+        'abstracts': [
+            {
+                'source': 'arXiv',
+                'value': 'A search for new phenomena is presented.',
+            },
+        ],
+        'authors': [
+            {
+                'affiliations': [
+                    {
+                        'record': {'$ref': 'http://localhost:5000/api/institutions/902725'},
+                        'value': 'CERN',
+                    },
+                ],
+                'full_name': 'Author, Number {}'.format(i),
+                'ids': [
+                    {
+                        'schema': 'INSPIRE BAI',
+                        'value': 'N.Author.{}'.format(i + 1),
+                    },
+                ],
+                'record': {'$ref': 'http://localhost:5000/api/authors/{}'.format(i + 1)},
+            } for i in range(3000)
+        ],
+        'collaborations': [
+            {
+                'record': {'$ref': 'http://localhost:5000/api/experiments/1108541'},
+                'value': 'ATLAS',
+            },
+        ],
+        'deleted_records': [
+            {'$ref': 'http://localhost:5000/api/literature/1'},
+        ],
+        'document_type': ['article'],
+        'preprint_date': '2017-06-01',
+        'references': [
+            {
+                'record': {'$ref': 'http://localhost:5000/api/literature/{}'.format(i + 1)},
+                'reference': {
+                    'arxiv_eprint': '1706.{:05d}'.format(i + 1),
+                    'authors': [
+                        {'full_name': 'Author, Reference {}'.format(j)} for j in range(10)
+                    ],
+                    'title': {'title': 'Reference {}'.format(i)},
+                },
+            } for i in range(1000)
+        ],
+        'titles': [
+            {'title': 'Search for new phenomena with the ATLAS detector'},
+        ],
+    }
+
+
+def test_enhance_after_index_is_the_same_as_running_all_the_receivers(app):
+    record = _get_large_collaboration_record()
+    validate(record, 'hep')
+
+    expected = deepcopy(record)
+    populate_recid_from_ref(None, expected)
+    for enhancer in INDEX_ENHANCERS:
+        enhancer(None, expected)
+
+    result = deepcopy(record)
+    enhance_after_index(None, result)
+
+    assert expected == result
+    assert result['authors'][2999]['recid'] == 3000
+    assert result['authors'][0]['affiliations'][0]['recid'] == 902725
+    assert result['references'][999]['recid'] == 1000
+    assert result['deleted_recids'] == [1]
+
+
+def test_enhance_after_index_is_the_same_as_running_all_the_receivers_on_institutions(app):
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/institutions.json',
+        '_collections': ['Institutions'],
+        'legacy_ICN': 'CERN',
+        'related_records': [
+            {
+                'record': {'$ref': 'http://localhost:5000/api/institutions/1'},
+                'relation': 'predecessor',
+            },
+        ],
+        'self': {'$ref': 'http://localhost:5000/api/institutions/902725'},
+    }
+
+    expected = deepcopy(record)
+    populate_recid_from_ref(None, expected)
+    for enhancer in INDEX_ENHANCERS:
+        enhancer(None, expected)
+
+    result = deepcopy(record)
+    enhance_after_index(None, result)
+
+    assert expected == result
+    assert 'payload_recid' not in result['affiliation_suggest']
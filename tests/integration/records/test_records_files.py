@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from __future__ import absolute_import, division, print_function
+
+import StringIO
+
+from inspirehep.modules.records.api import InspireRecord
+from inspirehep.modules.records.files import (
+    count_references,
+    get_deduplication_report,
+    put_file,
+)
+
+
+def test_put_file_reuses_stored_files_with_the_same_contents(app):
+    record_json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 111,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+    }
+    record = InspireRecord.create(record_json)
+
+    before = get_deduplication_report()
+
+    put_file(record.files, 'a.pdf', StringIO.StringIO('shared dedup body'))
+    put_file(record.files, 'b.pdf', StringIO.StringIO('shared dedup body'))
+    put_file(record.files, 'c.pdf', StringIO.StringIO('other dedup body'))
+
+    after = get_deduplication_report()
+
+    a_file = record.files['a.pdf'].obj.file
+    b_file = record.files['b.pdf'].obj.file
+    c_file = record.files['c.pdf'].obj.file
+
+    assert a_file.id == b_file.id
+    assert a_file.id != c_file.id
+    assert count_references(a_file) == 2
+    assert count_references(c_file) == 1
+    assert open(b_file.uri).read() == 'shared dedup body'
+
+    assert after['objects'] - before['objects'] == 3
+    assert after['objects_size'] - before['objects_size'] == 50
+    assert after['files'] - before['files'] == 2
+    assert after['files_size'] - before['files_size'] == 33
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+from flask import current_app
+from mock import patch
+
+from invenio_db import db
+
+from inspirehep.modules.records.api import InspireRecord
+from inspirehep.modules.records.indexer import (
+    INDEX_QUEUE_ATTEMPTS_KEY,
+    INDEX_QUEUE_FAILED_KEY,
+    INDEX_QUEUE_KEY,
+    INDEX_QUEUE_OPS_KEY,
+    INDEX_QUEUE_SCHEDULED_KEY,
+    INDEX_QUEUE_STATS_KEY,
+    INDEX_QUEUE_TIMES_KEY,
+    _get_redis,
+    flush_index_queue,
+    get_index_queue_stats,
+    pop_queued_records,
+    queue_records,
+)
+from inspirehep.modules.records.tasks import process_index_queue
+from inspirehep.modules.search import LiteratureSearch
+from inspirehep.utils.record import get_title
+
+
+def _clear_index_queue():
+    _get_redis().delete(
+        INDEX_QUEUE_ATTEMPTS_KEY,
+        INDEX_QUEUE_FAILED_KEY,
+        INDEX_QUEUE_KEY,
+        INDEX_QUEUE_OPS_KEY,
+        INDEX_QUEUE_SCHEDULED_KEY,
+        INDEX_QUEUE_STATS_KEY,
+        INDEX_QUEUE_TIMES_KEY,
+    )
+
+
+def test_queue_records_queues_each_record_once(app):
+    _clear_index_queue()
+
+    op = {'delete': False, 'index': 'records-hep', 'doc_type': 'hep', 'version': 1}
+    queue_records({'a': op, 'b': op})
+    queue_records({'a': dict(op, version=2)})
+
+    assert get_index_queue_stats()['size'] == 2
+
+    ops, oldest = pop_queued_records(10)
+
+    assert list(ops) == ['a', 'b']
+    assert ops['a']['version'] == 2
+    assert oldest is not None
+    assert get_index_queue_stats()['size'] == 0
+
+
+
+@patch('inspirehep.modules.records.indexer.index_records')
+def test_flush_index_queue_gives_up_on_records_failing_too_often(mock_index_records, app):
+    _clear_index_queue()
+    mock_index_records.side_effect = lambda ops: ['a']
+
+    op = {'delete': False, 'index': 'records-hep', 'doc_type': 'hep', 'version': 1}
+    queue_records({'a': op, 'b': op})
+
+    with patch.dict(current_app.config, {'INDEXER_QUEUE_MAX_ATTEMPTS': 2}):
+        assert flush_index_queue() == 2
+        assert get_index_queue_stats()['size'] == 1
+
+        assert flush_index_queue() == 1
+
+    stats = get_index_queue_stats()
+
+    assert stats['size'] == 0
+    assert stats['given_up'] == 1
+    assert stats['dead'] == 1
+    assert _get_redis().hexists(INDEX_QUEUE_FAILED_KEY, 'a')
+    assert not _get_redis().hexists(INDEX_QUEUE_ATTEMPTS_KEY, 'a')
+
+    mock_index_records.side_effect = lambda ops: []
+    queue_records({'a': op})
+
+    assert flush_index_queue() == 1
+    assert get_index_queue_stats()['dead'] == 0
+
+@patch('inspirehep.modules.records.receivers.process_index_queue')
+def test_index_after_commit_queues_records_if_async(mock_process_index_queue, app):
+    _clear_index_queue()
+    search = LiteratureSearch()
+    json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': ['Literature']
+    }
+
+    with patch.dict(current_app.config, {'INDEXER_ASYNC': True}):
+        record = InspireRecord.create(json)
+        db.session.commit()
+
+        record['titles'][0]['title'] = 'bar'
+        record.commit()
+        db.session.commit()
+
+    assert get_index_queue_stats()['size'] == 1
+    mock_process_index_queue.apply_async.assert_called_once_with(
+        countdown=current_app.config['INDEXER_QUEUE_DELAY'])
+
+    process_index_queue()
+
+    assert get_title(search.get_source(record.id)) == 'bar'
+    assert get_index_queue_stats()['size'] == 0
+
+    record._delete(force=True)
+    db.session.commit()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+from invenio_db import db
+
+from inspirehep.modules.records.api import InspireRecord
+from inspirehep.modules.records.links import get_linking_uuids
+
+
+def _get_linking_uuids(pid_type, pid_value, paths=None):
+    return {str(uuid) for uuid, in get_linking_uuids(pid_type, pid_value, paths)}
+
+
+def test_links_are_stored_with_the_record(app):
+    record_json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 222,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/1'}},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+    }
+    record = InspireRecord.create(record_json)
+
+    assert _get_linking_uuids('lit', 1) == {str(record.id)}
+    assert _get_linking_uuids('lit', 1, ['references.record']) == {str(record.id)}
+    assert _get_linking_uuids('lit', 1, ['authors.record']) == set()
+    assert _get_linking_uuids('lit', 222) == set()
+
+    record['references'] = [
+        {'record': {'$ref': 'http://localhost:5000/api/literature/2'}},
+    ]
+    record.commit()
+
+    assert _get_linking_uuids('lit', 1) == set()
+    assert _get_linking_uuids('lit', 2) == {str(record.id)}
+
+    record._delete()
+
+    assert _get_linking_uuids('lit', 2) == set()
+
+    db.session.rollback()
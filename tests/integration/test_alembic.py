@@ -27,6 +27,7 @@ from sqlalchemy import inspect
 
 from invenio_db.utils import drop_alembic_version_table
 from invenio_db import db
+from invenio_files_rest.models import FileInstance
 
 
 def test_alembic_revision_fddb3cfe7a9c(alembic_app):
@@ -56,3 +57,173 @@ def test_alembic_revision_fddb3cfe7a9c(alembic_app):
     assert 'workflows_pending_record' not in inspector.get_table_names()
 
     drop_alembic_version_table()
+
+
+def test_alembic_revision_76c1559b272b(alembic_app):
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    def _get_columns():
+        inspector = inspect(db.engine)
+        return [column['name'] for column in inspector.get_columns('inspire_prod_records')]
+
+    db.drop_all()
+    drop_alembic_version_table()
+
+    ext.alembic.upgrade(target='fddb3cfe7a9c')
+    assert 'marcxml_hash' not in _get_columns()
+
+    ext.alembic.upgrade(target='76c1559b272b')
+    assert 'marcxml_hash' in _get_columns()
+
+    ext.alembic.downgrade(target='fddb3cfe7a9c')
+    assert 'marcxml_hash' not in _get_columns()
+
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_e93847f60700(alembic_app):
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    def _get_columns():
+        inspector = inspect(db.engine)
+        return [column['name'] for column in inspector.get_columns('inspire_prod_records')]
+
+    db.drop_all()
+    drop_alembic_version_table()
+
+    ext.alembic.upgrade(target='76c1559b272b')
+    assert 'error_fingerprint' not in _get_columns()
+
+    ext.alembic.upgrade(target='e93847f60700')
+    assert 'error_fingerprint' in _get_columns()
+
+    ext.alembic.downgrade(target='76c1559b272b')
+    assert 'error_fingerprint' not in _get_columns()
+
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_5a0e2405b624(alembic_app):
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    def _get_columns():
+        inspector = inspect(db.engine)
+        return [column['name'] for column in inspector.get_columns('inspire_prod_records')]
+
+    def _get_tables():
+        return inspect(db.engine).get_table_names()
+
+    db.drop_all()
+    drop_alembic_version_table()
+
+    ext.alembic.upgrade(target='e93847f60700')
+    assert 'marcxml_codec' not in _get_columns()
+    assert 'inspire_prod_records_dictionaries' not in _get_tables()
+
+    ext.alembic.upgrade(target='5a0e2405b624')
+    assert 'marcxml_codec' in _get_columns()
+    assert 'inspire_prod_records_dictionaries' in _get_tables()
+
+    ext.alembic.downgrade(target='e93847f60700')
+    assert 'marcxml_codec' not in _get_columns()
+    assert 'inspire_prod_records_dictionaries' not in _get_tables()
+
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_b646d3592dd5(alembic_app):
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    def _get_indexes():
+        inspector = inspect(db.engine)
+        return [index['name'] for index in inspector.get_indexes('files_files')]
+
+    db.drop_all()
+    drop_alembic_version_table()
+
+    ext.alembic.upgrade(target='5a0e2405b624')
+    FileInstance.__table__.create(db.engine)
+    for index in FileInstance.__table__.indexes:
+        if index.name == 'ix_files_files_checksum':
+            index.drop(db.engine)
+    assert 'ix_files_files_checksum' not in _get_indexes()
+
+    ext.alembic.upgrade(target='b646d3592dd5')
+    assert 'ix_files_files_checksum' in _get_indexes()
+
+    ext.alembic.downgrade(target='5a0e2405b624')
+    assert 'ix_files_files_checksum' not in _get_indexes()
+
+    FileInstance.__table__.drop(db.engine)
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_3ba57d8a2ac7(alembic_app):
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    def _get_tables():
+        return inspect(db.engine).get_table_names()
+
+    db.drop_all()
+    drop_alembic_version_table()
+
+    ext.alembic.upgrade(target='5a0e2405b624')
+    FileInstance.__table__.create(db.engine)
+    ext.alembic.upgrade(target='b646d3592dd5')
+    assert 'inspire_records_links' not in _get_tables()
+
+    ext.alembic.upgrade(target='3ba57d8a2ac7')
+    assert 'inspire_records_links' in _get_tables()
+
+    indexes = inspect(db.engine).get_indexes('inspire_records_links')
+    assert 'ix_inspire_records_links_target' in [index['name'] for index in indexes]
+
+    ext.alembic.downgrade(target='b646d3592dd5')
+    assert 'inspire_records_links' not in _get_tables()
+
+    ext.alembic.downgrade(target='5a0e2405b624')
+    FileInstance.__table__.drop(db.engine)
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_d9ec1a5b0e2f(alembic_app):
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    def _get_tables():
+        return inspect(db.engine).get_table_names()
+
+    db.drop_all()
+    drop_alembic_version_table()
+
+    ext.alembic.upgrade(target='5a0e2405b624')
+    FileInstance.__table__.create(db.engine)
+    ext.alembic.upgrade(target='3ba57d8a2ac7')
+    assert 'inspire_citation_counts' not in _get_tables()
+
+    ext.alembic.upgrade(target='d9ec1a5b0e2f')
+    assert 'inspire_citation_counts' in _get_tables()
+
+    ext.alembic.downgrade(target='3ba57d8a2ac7')
+    assert 'inspire_citation_counts' not in _get_tables()
+
+    ext.alembic.downgrade(target='5a0e2405b624')
+    FileInstance.__table__.drop(db.engine)
+    drop_alembic_version_table()
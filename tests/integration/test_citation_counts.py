@@ -22,7 +22,44 @@
 
 from __future__ import absolute_import, division, print_function
 
-from inspirehep.utils.record_getter import get_es_record
+from mock import patch
+from sqlalchemy.orm.attributes import flag_modified
+
+from invenio_db import db
+from invenio_search import current_search_client as es
+
+from inspirehep.modules.records.api import InspireRecord
+from inspirehep.modules.records.citations import get_citation_count
+from inspirehep.modules.records.indexer import create_index_ops
+from inspirehep.utils.record_getter import get_db_record, get_es_record
+
+from utils import _delete_record
+
+
+def _create_record(recid, cited_recids=()):
+    json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': recid,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+    }
+    if cited_recids:
+        json['references'] = [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/{}'.format(cited_recid)}}
+            for cited_recid in cited_recids
+        ]
+
+    record = InspireRecord.create(json)
+    db.session.commit()
+
+    return record
 
 
 def test_citation_counts_are_correct(app):
@@ -37,3 +74,86 @@ def test_citation_counts_are_correct(app):
     assert get_citation_count(1430091) == 1
     assert get_citation_count(452060) == 1
     assert get_citation_count(1496635) == 1
+
+
+def test_citation_counts_are_updated_when_citing_records_are_committed(app):
+    _create_record(9000001)
+    citing = _create_record(9000002, [9000001])
+    es.indices.refresh('records-hep')
+
+    assert get_citation_count(9000001) == 1
+    assert get_es_record('lit', 9000001)['citation_count'] == 1
+
+    citing['references'] = []
+    citing.commit()
+    db.session.commit()
+    es.indices.refresh('records-hep')
+
+    assert get_citation_count(9000001) == 0
+    assert get_es_record('lit', 9000001)['citation_count'] == 0
+
+    _delete_record('lit', 9000002)
+    _delete_record('lit', 9000001)
+
+
+def test_reindexing_cited_records_does_not_prevent_newer_versions(app):
+    cited = _create_record(9000003)
+    _create_record(9000004, [9000003])
+
+    cited['titles'] = [{'title': 'bar'}]
+    cited.commit()
+    db.session.commit()
+    es.indices.refresh('records-hep')
+
+    es_record = get_es_record('lit', 9000003)
+
+    assert es_record['titles'] == [{'title': 'bar'}]
+    assert es_record['citation_count'] == 1
+
+    _delete_record('lit', 9000004)
+    _delete_record('lit', 9000003)
+
+
+def test_citation_counts_are_updated_without_record_signals(app):
+    _create_record(9000005)
+    _create_record(9000006, [9000005])
+
+    model = get_db_record('lit', 9000006).model
+    model.json = dict(model.json, references=[])
+    flag_modified(model, 'json')
+    db.session.commit()
+
+    assert get_citation_count(9000005) == 0
+
+    _delete_record('lit', 9000006)
+    _delete_record('lit', 9000005)
+
+
+def test_citation_counts_are_updated_when_citing_records_are_deleted(app):
+    _create_record(9000007)
+    _create_record(9000008, [9000007])
+
+    assert get_citation_count(9000007) == 1
+
+    _delete_record('lit', 9000008)
+
+    assert get_citation_count(9000007) == 0
+
+    _delete_record('lit', 9000007)
+
+
+def test_create_index_ops_prefetches_the_citation_counts(app):
+    cited = _create_record(9000009)
+    citing = _create_record(9000010, [9000009])
+
+    with patch('inspirehep.modules.records.receivers.get_citation_count') as mock_get_citation_count:
+        ops = create_index_ops([cited, citing])
+
+    expected = [1, 0]
+    result = [op['_source']['citation_count'] for op in ops]
+
+    assert expected == result
+    mock_get_citation_count.assert_not_called()
+
+    _delete_record('lit', 9000010)
+    _delete_record('lit', 9000009)
@@ -25,13 +25,26 @@ from __future__ import absolute_import, division, print_function
 import os
 import pkg_resources
 import zlib
+from collections import Counter
 
 import pytest
+import requests_mock
 from flask import current_app
+from mock import patch
 from redis import StrictRedis
 
+from invenio_db import db
+
+from inspirehep.modules.migrator.checkpoints import MigrationCheckpoint
 from inspirehep.modules.migrator.models import InspireProdRecords
-from inspirehep.modules.migrator.tasks import continuous_migration
+from inspirehep.modules.migrator.tasks import (
+    continuous_migration,
+    fetch_records,
+    filter_unchanged_records,
+    migrate,
+    migrate_chunk,
+    remigrate_records,
+)
 from inspirehep.utils.record_getter import get_db_record
 
 from utils import _delete_record
@@ -52,6 +65,13 @@ def flush_redis():
     redis_url = current_app.config.get('CACHE_REDIS_URL')
     r = StrictRedis.from_url(redis_url)
     r.delete('legacy_records')
+    for key in r.keys('legacy_records:*'):
+        r.delete(key)
+
+
+def read_fixture(record_file):
+    return pkg_resources.resource_string(
+        __name__, os.path.join('fixtures', record_file))
 
 
 @pytest.fixture(scope='function')
@@ -128,6 +148,19 @@ def test_continuous_migration_handles_multiple_records(app, record_1502655_and_1
     assert expected == result
 
 
+def test_continuous_migration_handles_records_in_several_batches(app, record_1502655_and_1502656):
+    r = StrictRedis.from_url(current_app.config.get('CACHE_REDIS_URL'))
+
+    assert r.llen('legacy_records') == 2
+
+    continuous_migration(batch_size=1)
+
+    assert r.llen('legacy_records') == 0
+
+    get_db_record('aut', 1502655)  # Does not raise.
+    get_db_record('lit', 1502656)  # Does not raise.
+
+
 def test_continuous_migration_handles_record_updates(app, record_1502656_and_update):
     r = StrictRedis.from_url(current_app.config.get('CACHE_REDIS_URL'))
 
@@ -148,3 +181,130 @@ def test_continuous_migration_handles_record_updates(app, record_1502656_and_upd
     result = InspireProdRecords.query.get(1502656).marcxml
 
     assert expected == result
+
+
+def test_migrate_chunk_in_bulk_inserts_new_records_and_updates_existing_ones(app):
+    record = read_fixture('1502656.xml')
+    update = read_fixture('1502656_update.xml')
+
+    try:
+        migrate_chunk([record, update], bulk=True)
+
+        result = get_db_record('lit', 1502656)
+
+        assert len(result['authors']) == 1
+        assert InspireProdRecords.query.get(1502656).valid
+        assert InspireProdRecords.query.get(1502656).marcxml == update
+    finally:
+        _delete_record('lit', 1502656)
+
+
+def test_filter_unchanged_records_skips_records_already_migrated(app):
+    record = read_fixture('1502656.xml')
+    update = read_fixture('1502656_update.xml')
+    new = read_fixture('1502655.xml')
+
+    try:
+        migrate_chunk([record])
+
+        stats = Counter()
+        result = list(filter_unchanged_records([record, update, new], stats))
+
+        assert result == [update, new]
+        assert stats == Counter(unchanged=1, changed=1, new=1)
+    finally:
+        _delete_record('lit', 1502656)
+
+
+def test_remigrate_records_reads_the_broken_records_from_the_db(app):
+    record = read_fixture('1502656.xml')
+
+    try:
+        migrate_chunk([record])
+
+        prod_record = InspireProdRecords.query.get(1502656)
+        prod_record.valid = False
+        db.session.commit()
+
+        remigrate_records(only_broken=True)
+
+        assert InspireProdRecords.query.get(1502656).valid
+    finally:
+        _delete_record('lit', 1502656)
+
+
+def test_migrate_resumes_from_the_first_chunk_that_did_not_complete(app, tmpdir):
+    author = read_fixture('1502655.xml')
+    literature = read_fixture('1502656.xml')
+    dump = tmpdir.join('dump.xml')
+    dump.write(b'<collection>\n' + author + b'\n' + literature + b'\n</collection>\n', 'wb')
+    after_author = len(b'<collection>\n' + author)
+    after_literature = after_author + len(b'\n' + literature)
+
+    checkpoint = MigrationCheckpoint(str(dump))
+    try:
+        checkpoint.start()
+        checkpoint.save((0, 0), (1, after_author))
+        literature_chunk = checkpoint.save((1, after_author), (2, after_literature))
+        migrate_chunk([literature], checkpoint=(str(dump), literature_chunk))
+        last_updated = InspireProdRecords.query.get(1502656).last_updated
+
+        migrate(str(dump), resume=True)
+
+        get_db_record('aut', 1502655)  # Does not raise.
+        assert InspireProdRecords.query.get(1502656).last_updated == last_updated
+    finally:
+        checkpoint.clear()
+        _delete_record('aut', 1502655)
+        _delete_record('lit', 1502656)
+
+
+def test_migrate_resumes_with_the_later_versions_of_migrated_records(app, tmpdir):
+    first_version = read_fixture('1502656.xml')
+    second_version = first_version.replace(
+        b'</record>',
+        b'<datafield tag="500" ind1=" " ind2=" ">'
+        b'<subfield code="a">Second version</subfield>'
+        b'</datafield></record>',
+    )
+    dump = tmpdir.join('dump.xml')
+    dump.write(b'<collection>\n' + first_version + b'\n' + second_version + b'\n</collection>\n', 'wb')
+    after_first = len(b'<collection>\n' + first_version)
+    after_second = after_first + len(b'\n' + second_version)
+
+    checkpoint = MigrationCheckpoint(str(dump))
+    try:
+        checkpoint.start()
+        first_chunk = checkpoint.save((0, 0), (1, after_first))
+        checkpoint.save((1, after_first), (2, after_second))
+        migrate_chunk([first_version], checkpoint=(str(dump), first_chunk))
+
+        migrate(str(dump), resume=True)
+
+        assert InspireProdRecords.query.get(1502656).marcxml == second_version
+    finally:
+        checkpoint.clear()
+        _delete_record('lit', 1502656)
+
+
+def test_fetch_records_migrates_the_records_that_could_be_downloaded(app):
+    record = read_fixture('1502656.xml')
+
+    try:
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.register_uri(
+                'GET', 'http://inspirehep.net/record/1502656/export/xme',
+                content=record,
+            )
+            requests_mocker.register_uri(
+                'GET', 'http://inspirehep.net/record/42/export/xme',
+                status_code=404,
+            )
+
+            with patch.dict(current_app.config, {'LEGACY_BASE_URL': 'http://inspirehep.net'}):
+                failed = fetch_records([1502656, 42], workers=2)
+
+        assert failed == [42]
+        assert InspireProdRecords.query.get(1502656).valid
+    finally:
+        _delete_record('lit', 1502656)
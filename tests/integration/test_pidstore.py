@@ -26,6 +26,9 @@ import mock
 import requests_mock
 from flask import current_app
 
+from invenio_pidstore.models import PersistentIdentifier
+
+from inspirehep.modules.pidstore.index import get_recid_index
 from inspirehep.modules.pidstore.providers import InspireRecordIdProvider
 
 
@@ -51,3 +54,16 @@ def test_getting_next_recid_from_legacy(app):
             provider = InspireRecordIdProvider.create(**args)
 
             assert str(provider.pid.pid_value) == '3141592'
+
+
+def test_recid_index_agrees_with_the_pidstore(app):
+    index = get_recid_index('lit')
+    index.build()
+
+    expected = {
+        111: PersistentIdentifier.get('lit', 111).object_uuid,
+        1373790: PersistentIdentifier.get('lit', 1373790).object_uuid,
+    }
+    result = index.get_many([111, 1373790, 999999999])
+
+    assert expected == result
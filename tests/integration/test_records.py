@@ -26,6 +26,7 @@ import copy
 import pytest
 import StringIO
 import requests_mock
+from flask import current_app
 from mock import patch, mock_open
 
 from dojson.contrib.marc21.utils import create_record
@@ -40,7 +41,11 @@ from invenio_search import current_search_client as es
 from inspire_dojson.hep import hep
 from inspire_utils.record import get_value
 from inspirehep.modules.records.api import InspireRecord
-from inspirehep.modules.records.tasks import merge_merged_records, update_refs
+from inspirehep.modules.records.tasks import (
+    get_update_refs_progress,
+    merge_merged_records,
+    update_refs,
+)
 from inspirehep.modules.migrator.tasks import record_insert_or_replace
 from inspirehep.utils.record_getter import get_db_record, get_es_records
 
@@ -340,6 +345,44 @@ def test_references_can_be_updated(app, records_to_be_merged):
     assert expected == result
 
 
+def test_references_are_updated_in_batches(app, records_to_be_merged):
+    old_ref = 'http://localhost:5000/api/literature/222'
+    new_ref = 'http://localhost:5000/api/literature/111'
+
+    with patch.dict(current_app.config, {'INSPIRE_REF_UPDATER_BATCH_SIZE': 1}):
+        update_refs.delay(old_ref, new_ref)
+
+    pointing_record = get_db_record('lit', 333)
+
+    assert get_value(pointing_record, 'accelerator_experiments[0].record.$ref') == new_ref
+
+    expected = {
+        'queued': 1,
+        'processed': 1,
+        'updated': 1,
+        'dispatched': True,
+    }
+    result = get_update_refs_progress(old_ref, new_ref)
+
+    assert expected == result
+
+
+def test_update_refs_resumes_skipping_the_processed_records(app, records_to_be_merged):
+    old_ref = 'http://localhost:5000/api/literature/222'
+    new_ref = 'http://localhost:5000/api/literature/111'
+    uuids = [str(get_db_record('lit', 333).id)]
+
+    with patch('inspirehep.modules.records.tasks.get_uuids_to_update', return_value=uuids):
+        update_refs.delay(old_ref, new_ref)
+
+        with patch('inspirehep.modules.records.tasks.update_refs_batch') as mock_update_refs_batch:
+            update_refs.delay(old_ref, new_ref, resume=True)
+            mock_update_refs_batch.delay.assert_not_called()
+
+            update_refs.delay(old_ref, new_ref)
+            mock_update_refs_batch.delay.assert_called_once_with(uuids, old_ref, new_ref)
+
+
 def test_get_es_records_handles_empty_lists(app):
     get_es_records('lit', [])  # Does not raise.
 
@@ -537,6 +580,44 @@ def test_update_handles_figures(app):
     assert file_content == expected_file_content
 
 
+def test_create_attaches_downloaded_figures_in_order(app):
+    record_json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+        'figures': [
+            {
+                'key': 'graph.png',
+                'url': 'http://www.mdpi.com/2218-1997/3/1/24/png{}'.format(i),
+            } for i in range(10)
+        ],
+    }
+
+    with requests_mock.Mocker() as requests_mocker:
+        for i in range(10):
+            requests_mocker.register_uri(
+                'GET', 'http://www.mdpi.com/2218-1997/3/1/24/png{}'.format(i),
+                body=StringIO.StringIO('figure {}'.format(i)),
+            )
+
+        record = InspireRecord.create(record_json)
+
+    expected_keys = ['1_graph.png'] + ['1_graph.png_{}'.format(i) for i in range(1, 10)]
+
+    assert [figure['key'] for figure in record['figures']] == expected_keys
+    for i, key in enumerate(expected_keys):
+        file_content = open(record.files[key].obj.file.uri).read()
+        assert file_content == 'figure {}'.format(i)
+
+
 @patch(
     'inspirehep.modules.records.utils.open',
     mock_open(read_data='doc1 body'),
@@ -670,6 +751,60 @@ def test_create_with_source_record_with_same_control_number(app):
     assert rec2_file_content == expected_file_content
 
 
+@patch(
+    'inspirehep.modules.records.utils.open',
+    mock_open(read_data='dummy body'),
+)
+def test_create_with_source_record_links_its_files(app):
+    expected_key = '1_Fulltext.pdf'
+
+    record1_json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+        'documents': [{
+            'key': 'Fulltext.pdf',
+            'url': '/some/non/existing/path.pdf',
+        }],
+    }
+
+    record2_json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+    }
+
+    record1 = InspireRecord.create(record1_json)
+    record2_json['documents'] = copy.deepcopy(record1['documents'])
+
+    with patch('inspirehep.modules.records.api.open_url_or_path') as mock_open_url_or_path:
+        record2 = InspireRecord.create(record2_json, files_src_record=record1)
+
+        mock_open_url_or_path.assert_not_called()
+
+    rec1_file = record1.files[expected_key].obj.file
+    rec2_file = record2.files[expected_key].obj.file
+
+    assert record2.files[expected_key].bucket_id != record1.files[expected_key].bucket_id
+    assert rec2_file.id == rec1_file.id
+
+
 @patch(
     'inspirehep.modules.records.utils.open',
     mock_open(read_data='dummy body'),
@@ -22,12 +22,19 @@
 
 from __future__ import absolute_import, division, print_function
 
+import json
 import sys
 
+from invenio_db import db
+from invenio_search import current_search_client as es
+
+from inspirehep.modules.records.api import InspireRecord
 from inspirehep.modules.records.serializers.impactgraph_serializer import (
     ImpactGraphSerializer,
 )
 
+from utils import _delete_record
+
 
 def test_impact_graph_serializer_does_not_raise_maximum_recursion_error(app):
     serializer = ImpactGraphSerializer()
@@ -40,3 +47,70 @@ def test_impact_graph_serializer_does_not_raise_maximum_recursion_error(app):
     }
 
     serializer.serialize(111, record)
+
+
+def test_json_search_serializer_returns_the_authors_preview(api_client):
+    record = InspireRecord.create({
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 9000101,
+        'authors': [
+            {'full_name': 'Smith, John {}'.format(i)} for i in range(12)
+        ],
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+    })
+    db.session.commit()
+    es.indices.refresh('records-hep')
+
+    response = api_client.get(
+        '/literature/?q=control_number:9000101',
+        headers={'Accept': 'application/json'},
+    )
+    metadata = json.loads(response.data)['hits']['hits'][0]['metadata']
+
+    assert 'authors' not in metadata
+    assert len(metadata['authors_preview']) == 10
+    assert metadata['number_of_authors'] == 12
+
+    _delete_record('lit', record['control_number'])
+
+
+def test_full_json_search_serializer_returns_all_the_authors(api_client):
+    record = InspireRecord.create({
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 9000102,
+        'authors': [
+            {'full_name': 'Smith, John {}'.format(i)} for i in range(12)
+        ],
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+    })
+    db.session.commit()
+    es.indices.refresh('records-hep')
+
+    response = api_client.get(
+        '/literature/?q=control_number:9000102',
+        headers={'Accept': 'application/vnd+inspire.full+json'},
+    )
+    hits = json.loads(response.data)['hits']['hits']
+
+    expected = ['Smith, John {}'.format(i) for i in range(12)]
+    result = [author['full_name'] for author in hits[0]['metadata']['authors']]
+
+    assert expected == result
+
+    _delete_record('lit', record['control_number'])
@@ -80,6 +80,7 @@ def workflow_app():
         CELERY_RESULT_BACKEND='cache',
         CELERY_CACHE_BACKEND='memory',
         CELERY_EAGER_PROPAGATES_EXCEPTIONS=True,
+        INDEXER_ASYNC=False,
         PRODUCTION_MODE=True,
         LEGACY_ROBOTUPLOAD_URL=(
             'http://localhost:1234'
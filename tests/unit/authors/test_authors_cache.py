@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+from flask import current_app
+from mock import patch
+
+from inspirehep.modules.authors.cache import (
+    NameCache,
+    get_name_caches_stats,
+    get_name_variations,
+    measure_name_caches,
+    name_variations_cache,
+)
+
+
+def _get_lengths(full_names):
+    _get_lengths.calls.append(list(full_names))
+    return {full_name: len(full_name) for full_name in full_names}
+
+
+def test_name_cache_computes_only_missing_names():
+    _get_lengths.calls = []
+    cache = NameCache('lengths', _get_lengths)
+
+    expected = {'Smith, J.': 9, 'Doe, John': 9}
+    result = cache.get_many(['Smith, J.', 'Doe, John', 'Smith, J.'])
+
+    assert expected == result
+
+    expected = {'Smith, J.': 9, 'Higgs, P.': 9}
+    result = cache.get_many(['Smith, J.', 'Higgs, P.'])
+
+    assert expected == result
+
+    expected = [['Smith, J.', 'Doe, John'], ['Higgs, P.']]
+    result = _get_lengths.calls
+
+    assert expected == result
+
+    expected = {'hits': 1, 'misses': 3}
+    result = cache.stats
+
+    assert expected == result
+
+
+def test_name_cache_evicts_the_least_recently_used_names():
+    _get_lengths.calls = []
+    cache = NameCache('lengths', _get_lengths)
+
+    with patch.dict(current_app.config, {'INSPIRE_NAME_CACHE_SIZE': 2}):
+        cache.get('Smith, J.')
+        cache.get('Doe, John')
+        cache.get('Smith, J.')
+        cache.get('Higgs, P.')
+        cache.get('Smith, J.')
+        cache.get('Doe, John')
+
+    expected = [['Smith, J.'], ['Doe, John'], ['Higgs, P.'], ['Doe, John']]
+    result = _get_lengths.calls
+
+    assert expected == result
+
+
+def test_name_cache_does_not_cache_errors():
+    def compute(full_names):
+        raise ValueError(full_names)
+
+    cache = NameCache('errors', compute)
+
+    try:
+        cache.get('Smith, J.')
+    except ValueError:
+        pass
+
+    expected = {}
+    result = cache._cache
+
+    assert expected == result
+
+
+@patch('inspirehep.modules.authors.cache.generate_name_variations')
+def test_get_name_variations_is_cached(mock_generate_name_variations):
+    mock_generate_name_variations.return_value = ['smith', 'smith, j', 'smith, john']
+    name_variations_cache.clear()
+
+    get_name_variations('Smith, John')
+    result = get_name_variations('Smith, John')
+
+    assert ['smith', 'smith, j', 'smith, john'] == result
+    mock_generate_name_variations.assert_called_once_with('Smith, John')
+
+    expected = {
+        'hits': 1,
+        'redis_hits': 0,
+        'misses': 1,
+        'hit_rate': 0.5,
+    }
+    result = get_name_caches_stats()['name_variations']
+
+    assert expected == result
+
+
+@patch('inspirehep.modules.authors.cache.phonetic_blocks')
+@patch('inspirehep.modules.authors.cache.generate_name_variations')
+def test_measure_name_caches_computes_each_name_once_with_the_caches(
+        mock_generate_name_variations, mock_phonetic_blocks):
+    mock_generate_name_variations.return_value = ['smith']
+    mock_phonetic_blocks.side_effect = lambda full_names: {
+        full_name: 'SNATH' for full_name in full_names
+    }
+
+    with patch.dict(current_app.config, {'INSPIRE_NAME_CACHE_REDIS': False}):
+        result = measure_name_caches(records=5, authors=20, names=30)
+
+    assert ['uncached', 'cached'] == [name for name, _ in result]
+
+    uncached_calls = 5 * 20
+    distinct_names = len(set(
+        call[0][0] for call in mock_generate_name_variations.call_args_list))
+
+    assert uncached_calls + distinct_names == mock_generate_name_variations.call_count
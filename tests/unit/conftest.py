@@ -52,6 +52,7 @@ def app():
         CELERY_RESULT_BACKEND='cache',
         CELERY_CACHE_BACKEND='memory',
         CELERY_EAGER_PROPAGATES_EXCEPTIONS=True,
+        INSPIRE_FILES_DEDUPLICATION=False,
         TESTING=True,
         PRODUCTION_MODE=True,
     )
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+import zlib
+
+import pytest
+
+from inspirehep.modules.migrator.codecs import ZlibCodec, get_codec
+
+
+MARCXML = b'<record><controlfield tag="001">1</controlfield></record>'
+
+
+def test_get_codec_of_legacy_rows_decompresses_zlib():
+    expected = MARCXML
+    result = get_codec(None).decompress(zlib.compress(MARCXML))
+
+    assert expected == result
+
+
+def test_get_codec_of_legacy_rows_returns_uncompressed_data():
+    expected = MARCXML
+    result = get_codec(None).decompress(MARCXML)
+
+    assert expected == result
+
+
+def test_zlib_codec_roundtrip():
+    codec = ZlibCodec()
+
+    expected = MARCXML
+    result = codec.decompress(codec.compress(MARCXML))
+
+    assert expected == result
+
+
+def test_zstd_codec_roundtrip_with_trained_dictionary():
+    zstandard = pytest.importorskip('zstandard')
+    from inspirehep.modules.migrator.codecs import ZstdCodec
+
+    samples = [
+        MARCXML.replace(b'>1<', '>{}<'.format(i).encode('ascii')) * 10
+        for i in range(1000)
+    ]
+    dictionary = zstandard.train_dictionary(2 ** 12, samples)
+    codec = ZstdCodec(1, dictionary.as_bytes())
+
+    expected = samples[42]
+    result = codec.decompress(codec.compress(samples[42]))
+
+    assert expected == result
+    assert 'zstd:1' == codec.name
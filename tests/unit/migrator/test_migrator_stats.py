@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from inspirehep.modules.migrator.stats import (
+    MigrationStats,
+    _get_bucket,
+    _get_bucket_upper_bound,
+    _get_percentile,
+)
+
+
+def test_get_bucket_upper_bound_is_not_smaller_than_duration():
+    for elapsed in (1e-6, 3e-5, 0.001, 0.25, 1, 42):
+        bucket = _get_bucket(elapsed)
+
+        assert elapsed <= _get_bucket_upper_bound(bucket) * (1 + 1e-9)
+        assert elapsed > _get_bucket_upper_bound(bucket - 1)
+
+
+def test_get_percentile():
+    histogram = {_get_bucket(0.001): 98, _get_bucket(1): 2}
+
+    assert _get_percentile(histogram, 0.5) == _get_bucket_upper_bound(_get_bucket(0.001))
+    assert _get_percentile(histogram, 0.99) == _get_bucket_upper_bound(_get_bucket(1))
+
+
+def test_migration_stats_timer_counts_records():
+    stats = MigrationStats()
+
+    with stats.timer('commit', 10):
+        pass
+
+    expected = 10
+    result = stats.counts['commit']
+
+    assert expected == result
+    assert stats.errors['commit'] == 0
+    assert sum(stats.histograms['commit'].values()) == 1
+
+
+def test_migration_stats_timer_counts_errors():
+    stats = MigrationStats()
+
+    with pytest.raises(ValueError):
+        with stats.timer('index', 3):
+            raise ValueError()
+
+    expected = 3
+    result = stats.errors['index']
+
+    assert expected == result
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from jsonschema import ValidationError
+
+from inspirehep.modules.migrator.models import InspireProdRecords
+from inspirehep.modules.migrator.tasks import (
+    _pop_position,
+    _track_positions,
+    count_citations,
+    get_collection,
+    get_counts_at,
+    get_error_details,
+    get_partition,
+    imap_bounded,
+    iter_records,
+    measure_citations_counting,
+    split_stream,
+    split_stream_with_offsets,
+)
+
+
+def test_imap_bounded_does_not_run_ahead_of_the_consumer():
+    lock = threading.Lock()
+    counts = {'dispatched': 0, 'consumed': 0, 'ahead': 0}
+
+    def _double(item):
+        with lock:
+            counts['dispatched'] += 1
+            ahead = counts['dispatched'] - counts['consumed']
+            counts['ahead'] = max(counts['ahead'], ahead)
+        return 2 * item
+
+    pool = ThreadPool(4)
+    try:
+        result = []
+        for doubled in imap_bounded(pool, _double, range(50), 3):
+            with lock:
+                counts['consumed'] += 1
+            result.append(doubled)
+            time.sleep(0.001)
+    finally:
+        pool.terminate()
+
+    expected = [2 * item for item in range(50)]
+
+    assert expected == sorted(result)
+    assert counts['ahead'] <= 3
+
+
+def test_iter_records():
+    stream = BytesIO(
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<collection>\n'
+        b'<record><controlfield tag="001">1</controlfield></record>\n'
+        b'<record><controlfield tag="001">2</controlfield></record>\n'
+        b'</collection>\n'
+    )
+
+    expected = [
+        b'<record><controlfield tag="001">1</controlfield></record>',
+        b'<record><controlfield tag="001">2</controlfield></record>',
+    ]
+    result = list(iter_records(stream))
+
+    assert expected == result
+
+
+def test_iter_records_yields_the_same_records_as_split_stream():
+    dump = (
+        b'<collection>\n'
+        b'<record>\n'
+        b'  <controlfield tag="001">1</controlfield>\n'
+        b'</record>\n'
+        b'<record>\n'
+        b'  <controlfield tag="001">2</controlfield>\n'
+        b'</record>\n'
+        b'</collection>\n'
+    )
+
+    expected = list(split_stream(BytesIO(dump)))
+    result = list(iter_records(BytesIO(dump)))
+
+    assert expected == result
+
+
+def test_iter_records_keeps_the_records_of_a_namespaced_dump_unchanged():
+    dump = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<collection xmlns="http://www.loc.gov/MARC21/slim">\n'
+        b'<record>\n'
+        b'  <controlfield tag="001">1</controlfield>\n'
+        b'  <datafield tag="100" ind1=" " ind2=" ">\n'
+        b'    <subfield code="a">J\xc3\xbcrgen &amp; &quot;Foo&quot;</subfield>\n'
+        b'  </datafield>\n'
+        b'</record>\n'
+        b'<record><controlfield tag="001">2</controlfield><datafield tag="999"/></record>\n'
+        b'</collection>\n'
+    )
+
+    expected = list(split_stream(BytesIO(dump)))
+    result = list(iter_records(BytesIO(dump)))
+
+    assert expected == result
+    assert [InspireProdRecords.hash_marcxml(record) for record in expected] == \
+        [InspireProdRecords.hash_marcxml(record) for record in result]
+
+
+def test_iter_records_with_records_spanning_several_blocks():
+    dump = (
+        b'<collection xmlns="http://www.loc.gov/MARC21/slim">\n'
+        b'<record>\n'
+        b'  <controlfield tag="001">1</controlfield>\n'
+        b'</record>\n'
+        b'<record>\n'
+        b'  <controlfield tag="001">2</controlfield>\n'
+        b'</record>\n'
+        b'</collection>\n'
+    )
+
+    expected = list(split_stream(BytesIO(dump)))
+    for block_size in (1, 2, 3, 7, 16):
+        result = list(iter_records(BytesIO(dump), block_size=block_size))
+
+        assert expected == result
+
+
+def test_split_stream_with_offsets_points_right_after_each_record():
+    dump = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<collection>\n'
+        b'<record><controlfield tag="001">1</controlfield></record>\n'
+        b'<record><subfield code="a">J\xc3\xbcrgen</subfield></record>'
+        b'<record><controlfield tag="001">3</controlfield></record>\n'
+        b'</collection>\n'
+    )
+
+    for offset, record in split_stream_with_offsets(BytesIO(dump)):
+        assert dump[:offset].endswith(record)
+
+
+def test_split_stream_with_offsets_resumes_from_an_offset():
+    dump = (
+        b'<collection>\n'
+        b'<record><controlfield tag="001">1</controlfield></record>\n'
+        b'<record><controlfield tag="001">2</controlfield></record>\n'
+        b'</collection>\n'
+    )
+    offsets = [offset for offset, _ in split_stream_with_offsets(BytesIO(dump))]
+
+    stream = BytesIO(dump)
+    stream.seek(offsets[0])
+
+    expected = [(offsets[1], b'<record><controlfield tag="001">2</controlfield></record>')]
+    result = list(split_stream_with_offsets(stream, offsets[0]))
+
+    assert expected == result
+
+
+def test_track_positions_skips_the_records_of_completed_chunks():
+    records = [
+        (10, b'<record><controlfield tag="001">1</controlfield></record>'),
+        (20, b'<record><controlfield tag="001">2</controlfield></record>'),
+        (30, b'<record><controlfield tag="001">1</controlfield></record>'),
+        (40, b'<record><controlfield tag="001">3</controlfield></record>'),
+    ]
+    positions = deque()
+
+    expected = [records[1][1], records[2][1]]
+    result = list(_track_positions(records, 5, [(1, 6), (9, 12)], positions))
+
+    assert expected == result
+    assert [(records[1][1], (7, 20)), (records[2][1], (8, 30))] == list(positions)
+
+
+def test_pop_position():
+    first = b'<record><controlfield tag="001">1</controlfield></record>'
+    second = b'<record><controlfield tag="001">2</controlfield></record>'
+    third = b'<record><controlfield tag="001">3</controlfield></record>'
+    positions = deque([(first, (1, 10)), (second, (2, 20)), (third, (3, 30))])
+
+    expected = (2, 20)
+    result = _pop_position(positions, second, (0, 0))
+
+    assert expected == result
+    assert [(third, (3, 30))] == list(positions)
+
+
+def test_pop_position_matches_the_same_record_read_twice_by_identity():
+    first = b'<record><controlfield tag="001">1</controlfield></record>'
+    again = b''.join([b'<record><controlfield tag="001">1', b'</controlfield></record>'])
+    positions = deque([(first, (1, 10)), (again, (2, 20))])
+
+    expected = (2, 20)
+    result = _pop_position(positions, again, (0, 0))
+
+    assert expected == result
+
+
+def test_get_partition():
+    raw_record = zlib.compress(
+        b'<record><controlfield tag="001">1502656</controlfield></record>')
+
+    expected = 1502656 % 4
+    result = get_partition(raw_record, 4)
+
+    assert expected == result
+
+
+def test_get_partition_falls_back_to_the_first_partition_without_recid():
+    raw_record = zlib.compress(b'<record></record>')
+
+    expected = 0
+    result = get_partition(raw_record, 4)
+
+    assert expected == result
+
+
+def test_count_citations():
+    references = [[1, 2, 2], [2, 5], [], [7, 1]]
+
+    expected = [0, 2, 2, 0, 0, 1, 0, 1]
+    result = count_citations(references).tolist()
+
+    assert expected == result
+
+
+def test_count_citations_agrees_with_counter_when_flushing_the_buffer():
+    references = [range(i, 3 * i) for i in range(1, 20)]
+
+    counter = Counter()
+    for recids in references:
+        counter.update(set(recids))
+
+    result = count_citations(references, buffer_size=8)
+
+    assert all(result[recid] == count for recid, count in counter.items())
+    assert result.sum() == sum(counter.values())
+
+
+def test_get_counts_at():
+    counts = np.array([0, 2, 2, 0, 0, 1], dtype=np.int32)
+
+    expected = [2, 1, 0]
+    result = get_counts_at(counts, np.array([2, 5, 7])).tolist()
+
+    assert expected == result
+
+
+def test_measure_citations_counting_compares_counter_and_numpy():
+    result = measure_citations_counting(records=100, references=5)
+
+    assert [name for name, _, _, _ in result] == ['Counter', 'numpy']
+
+
+def test_get_collection():
+    marc_record = {'980__': [{'a': 'CONFERENCES'}, {'a': 'Citeable'}]}
+
+    expected = 'CONFERENCES'
+    result = get_collection(marc_record)
+
+    assert expected == result
+
+
+def test_get_collection_of_deleted_record():
+    marc_record = {'980__': [{'a': 'HEP'}, {'c': 'DELETED'}]}
+
+    expected = 'DELETED'
+    result = get_collection(marc_record)
+
+    assert expected == result
+
+
+def test_get_error_details_of_validation_error():
+    try:
+        raise ValidationError(
+            "u'foo' is not of type 'integer'",
+            validator='type',
+            schema_path=['properties', 'control_number', 'type'],
+        )
+    except ValidationError:
+        result = get_error_details('validation', 1)
+
+    assert result['error_stage'] == 'validation'
+    assert result['error_validator'] == 'type'
+    assert result['error_schema_path'] == 'properties.control_number.type'
+    assert len(result['error_fingerprint']) == 40
+
+
+def test_get_error_details_groups_errors_with_the_same_traceback():
+    def _fail(message):
+        raise KeyError(message)
+
+    details = []
+    for message in ('foo', 'bar'):
+        try:
+            _fail(message)
+        except KeyError:
+            details.append(get_error_details('dojson', 1))
+
+    assert details[0]['error_fingerprint'] == details[1]['error_fingerprint']
+    assert 'KeyError' in details[0]['errors']
+    assert details[0]['error_validator'] is None
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+import time
+from uuid import UUID
+
+import numpy as np
+from flask import current_app
+from mock import patch
+
+from inspirehep.modules.pidstore.index import RecidIndex
+
+
+def _get_index(uuids):
+    index = RecidIndex('lit')
+    index.built = time.time()
+    index.recids = np.array(sorted(uuids), dtype=np.int64)
+    index.uuids = np.array([
+        np.frombuffer(uuids[recid].bytes, dtype=np.uint8)
+        for recid in sorted(uuids)
+    ], dtype=np.uint8).reshape(-1, 16)
+
+    return index
+
+
+@patch('inspirehep.modules.pidstore.index.get_changes_since', return_value=(0, []))
+def test_recid_index_get_many(get_changes_since):
+    uuids = {
+        1: UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab'),
+        5: UUID('d1b3a5f2-2b4b-4b4a-9b3e-4c5d6e7f8091'),
+    }
+    index = _get_index(uuids)
+
+    expected = uuids
+    result = index.get_many([5, 1, 3, 42], fallback=False)
+
+    assert expected == result
+
+
+@patch('inspirehep.modules.pidstore.index.get_changes_since', return_value=(0, []))
+def test_recid_index_changes_take_precedence(get_changes_since):
+    index = _get_index({
+        1: UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab'),
+        5: UUID('d1b3a5f2-2b4b-4b4a-9b3e-4c5d6e7f8091'),
+    })
+    index.update(3, UUID('0f6c7b1e-8d9a-4b2c-a3d4-e5f60718293a'))
+    index.update(5, None)
+
+    expected = {
+        1: UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab'),
+        3: UUID('0f6c7b1e-8d9a-4b2c-a3d4-e5f60718293a'),
+    }
+    result = index.get_many([1, 3, 5], fallback=False)
+
+    assert expected == result
+
+
+@patch('inspirehep.modules.pidstore.index.get_changes_since', return_value=(0, []))
+def test_recid_index_get_arrays_merges_the_changes(get_changes_since):
+    index = _get_index({
+        1: UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab'),
+        5: UUID('d1b3a5f2-2b4b-4b4a-9b3e-4c5d6e7f8091'),
+    })
+    index.update(3, UUID('0f6c7b1e-8d9a-4b2c-a3d4-e5f60718293a'))
+    index.update(5, None)
+
+    recids, uuids = index.get_arrays()
+
+    assert [1, 3] == recids.tolist()
+    assert UUID('0f6c7b1e-8d9a-4b2c-a3d4-e5f60718293a').bytes == uuids[1].tobytes()
+    assert {} == index.changes
+
+
+@patch('inspirehep.modules.pidstore.index.get_changes_since', return_value=(2, [1, 3]))
+def test_recid_index_checks_the_recids_changed_by_other_processes(get_changes_since):
+    index = _get_index({
+        1: UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab'),
+        5: UUID('d1b3a5f2-2b4b-4b4a-9b3e-4c5d6e7f8091'),
+    })
+    index.update(3, UUID('0f6c7b1e-8d9a-4b2c-a3d4-e5f60718293a'))
+
+    with patch.object(index, '_query', return_value={}) as query:
+        result = index.get_many([1, 3, 5], fallback=False)
+
+    query.assert_called_once_with([1, 3])
+
+    expected = {5: UUID('d1b3a5f2-2b4b-4b4a-9b3e-4c5d6e7f8091')}
+
+    assert expected == result
+    assert 2 == index.generation
+
+
+@patch('inspirehep.modules.pidstore.index.get_changes_since', return_value=(7, None))
+def test_recid_index_queries_the_db_while_it_missed_too_many_changes(get_changes_since):
+    uuid = UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab')
+    index = _get_index({1: uuid})
+
+    with patch.object(index, '_start_build') as start_build, \
+            patch.object(index, '_query', return_value={1: uuid}) as query:
+        result = index.get_many([1])
+
+    assert {1: uuid} == result
+    assert index.built is None
+    query.assert_called_once_with([1], keep=False)
+    start_build.assert_called_once_with()
+
+
+def test_recid_index_queries_the_db_until_it_is_built():
+    uuid = UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab')
+    index = RecidIndex('lit')
+
+    with patch.object(index, '_start_build') as start_build, \
+            patch.object(index, '_query', return_value={1: uuid}) as query:
+        result = index.get_many([1])
+
+    assert {1: uuid} == result
+    query.assert_called_once_with([1], keep=False)
+    start_build.assert_called_once_with()
+
+
+@patch('inspirehep.modules.pidstore.index.get_changes_since', return_value=(0, []))
+def test_recid_index_checks_the_changes_at_most_once_per_interval(get_changes_since):
+    index = _get_index({1: UUID('7753a30b-4c4b-469c-8d8d-d5020069b3ab')})
+
+    with patch.dict(current_app.config, {'INSPIRE_PID_INDEX_CHECK_INTERVAL': 60}):
+        index.get_many([1], fallback=False)
+        index.get_many([1], fallback=False)
+
+    get_changes_since.assert_called_once_with('lit', 0)
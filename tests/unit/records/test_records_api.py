@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import pytest
+
+from inspirehep.modules.records.api import (
+    MAX_UNIQUE_KEY_COUNT,
+    FilesKeyAllocator,
+)
+
+
+def _allocate_by_probing(keys, key):
+    new_key = key
+    count = 1
+    while new_key in keys:
+        new_key = '%s_%s' % (key, count)
+        count += 1
+
+    keys.add(new_key)
+    return new_key
+
+
+def test_files_key_allocator_returns_the_key_when_free():
+    files_keys = FilesKeyAllocator(['1_graph.png_1'])
+
+    expected = '1_graph.png'
+    result = files_keys.allocate('1_graph.png')
+
+    assert expected == result
+    assert '1_graph.png' in files_keys
+
+
+def test_files_key_allocator_skips_taken_suffixes():
+    files_keys = FilesKeyAllocator(['1_graph.png', '1_graph.png_1', '1_graph.png_3'])
+
+    expected = ['1_graph.png_2', '1_graph.png_4', '1_graph.png_5']
+    result = [files_keys.allocate('1_graph.png') for _ in range(3)]
+
+    assert expected == result
+
+
+def test_files_key_allocator_sees_added_keys():
+    files_keys = FilesKeyAllocator(['1_graph.png'])
+    files_keys.add('1_graph.png_1')
+
+    expected = '1_graph.png_2'
+    result = files_keys.allocate('1_graph.png')
+
+    assert expected == result
+
+
+def test_files_key_allocator_gives_the_same_keys_as_probing():
+    names = ['1_a.png', '1_b.png', '1_a.png_1', '1_a.png_3', '1_c.pdf']
+    existing_keys = ['1_a.png_2', '1_b.png', '1_b.png_5']
+
+    keys = set(existing_keys)
+    files_keys = FilesKeyAllocator(existing_keys)
+
+    for i in range(5000):
+        name = names[i * 7 % len(names)]
+        assert _allocate_by_probing(keys, name) == files_keys.allocate(name)
+
+
+def test_files_key_allocator_attaches_5000_files_in_linear_time():
+    files_keys = FilesKeyAllocator()
+
+    start = time.time()
+    keys = [files_keys.allocate('1_graph.png') for _ in range(5000)]
+    elapsed = time.time() - start
+
+    assert keys[-1] == '1_graph.png_4999'
+    assert len(set(keys)) == 5000
+    assert elapsed < 1
+
+
+def test_files_key_allocator_aborts_after_max_unique_key_count():
+    files_keys = FilesKeyAllocator(
+        ['1_graph.png'] +
+        ['1_graph.png_%s' % count for count in range(1, MAX_UNIQUE_KEY_COUNT)]
+    )
+
+    with pytest.raises(Exception) as excinfo:
+        files_keys.allocate('1_graph.png')
+
+    assert 'Unable to find a unique key' in str(excinfo.value)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+from mock import Mock
+
+from invenio_records.models import RecordMetadata
+
+from inspirehep.modules.records.citations import (
+    get_citation_counts_deltas,
+    get_flushed_references_deltas,
+    get_references_recids,
+)
+
+
+def test_get_references_recids():
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/1'}},
+            {'record': {'$ref': 'http://localhost:5000/api/literature/2'}},
+            {'record': {'$ref': 'http://localhost:5000/api/literature/1'}},
+            {'reference': {'title': {'title': 'Not linked'}}},
+        ],
+    }
+
+    expected = {1, 2}
+    result = get_references_recids(record)
+
+    assert expected == result
+
+
+def test_get_references_recids_of_deleted_record():
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'deleted': True,
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/1'}},
+        ],
+    }
+
+    expected = set()
+    result = get_references_recids(record)
+
+    assert expected == result
+
+
+def test_get_citation_counts_deltas():
+    expected = {1: -1, 3: 1}
+    result = get_citation_counts_deltas({1, 2}, {2, 3})
+
+    assert expected == result
+
+
+def test_get_flushed_references_deltas_of_new_records():
+    citing = RecordMetadata(json={
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/1'}},
+            {'record': {'$ref': 'http://localhost:5000/api/literature/2'}},
+        ],
+    })
+    author = RecordMetadata(json={
+        '$schema': 'http://localhost:5000/schemas/records/authors.json',
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/1'}},
+        ],
+    })
+    session = Mock(new=[citing, author], dirty=[], deleted=[])
+
+    expected = {1: 1, 2: 1}
+    result = get_flushed_references_deltas(session)
+
+    assert expected == result
+    session.query.assert_not_called()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+from inspirehep.modules.records.enhancers import (
+    DYNAMIC,
+    SKIP,
+    ArrayNode,
+    IndexEnhancer,
+    ObjectNode,
+    compile_ref_tree,
+    for_schema,
+    get_recid_key,
+    measure_populate_recids,
+    populate_recids,
+)
+
+
+JSON_REFERENCE = {
+    'type': 'object',
+    'properties': {
+        '$ref': {'type': 'string'},
+    },
+    'additionalProperties': False,
+}
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        '$schema': {'type': 'string'},
+        'self': JSON_REFERENCE,
+        'deleted_records': {
+            'type': 'array',
+            'items': JSON_REFERENCE,
+        },
+        'authors': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'full_name': {'type': 'string'},
+                    'record': JSON_REFERENCE,
+                    'affiliations': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'record': JSON_REFERENCE,
+                                'value': {'type': 'string'},
+                            },
+                            'additionalProperties': False,
+                        },
+                    },
+                },
+                'additionalProperties': False,
+            },
+        },
+        'titles': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'title': {'type': 'string'},
+                },
+                'additionalProperties': False,
+            },
+        },
+        'legacy': {},
+    },
+    'additionalProperties': False,
+}
+
+
+def _get_record(authors=1):
+    return {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'self': {'$ref': 'http://localhost:5000/api/literature/1'},
+        'deleted_records': [
+            {'$ref': 'http://localhost:5000/api/literature/2'},
+        ],
+        'authors': [
+            {
+                'full_name': 'Smith, J.',
+                'record': {'$ref': 'http://localhost:5000/api/authors/3'},
+                'affiliations': [
+                    {
+                        'record': {'$ref': 'http://localhost:5000/api/institutions/4'},
+                        'value': 'CERN',
+                    },
+                ],
+            } for _ in range(authors)
+        ],
+        'titles': [
+            {'title': 'Partial Symmetries of Weak Interactions'},
+        ],
+        'legacy': {
+            'record': {'$ref': 'http://localhost:5000/api/literature/5'},
+        },
+    }
+
+
+def test_get_recid_key():
+    assert get_recid_key('record') == 'recid'
+    assert get_recid_key('parent_record') == 'parent_recid'
+    assert get_recid_key('simple_key') == 'simple_key_recid'
+
+
+def test_compile_ref_tree():
+    result = compile_ref_tree(SCHEMA)
+
+    assert isinstance(result, ObjectNode)
+    assert result.properties['$schema'] is SKIP
+    assert result.properties['titles'] is SKIP
+    assert result.properties['legacy'] is DYNAMIC
+
+    authors = result.properties['authors']
+
+    assert isinstance(authors, ArrayNode)
+    assert authors.items.properties['full_name'] is SKIP
+    assert isinstance(authors.items.properties['affiliations'], ArrayNode)
+
+
+def test_compile_ref_tree_walks_open_objects():
+    schema = {
+        'type': 'object',
+        'properties': {
+            'title': {'type': 'string'},
+        },
+    }
+
+    result = compile_ref_tree(schema)
+
+    assert isinstance(result, ObjectNode)
+
+
+def test_compile_ref_tree_walks_unresolved_references():
+    schema = {'$ref': 'elements/json_reference.json'}
+
+    assert compile_ref_tree(schema) is DYNAMIC
+
+
+def test_compile_ref_tree_skips_combinations_of_scalars():
+    schema = {
+        'anyOf': [
+            {'type': 'string'},
+            {'type': 'integer'},
+        ],
+    }
+
+    assert compile_ref_tree(schema) is SKIP
+
+
+def test_populate_recids_with_a_compiled_tree_is_the_same_as_walking_the_record():
+    expected = _get_record()
+    populate_recids(expected)
+
+    result = _get_record()
+    populate_recids(result, compile_ref_tree(SCHEMA))
+
+    assert expected == result
+    assert result['self_recid'] == 1
+    assert result['deleted_recids'] == [2]
+    assert result['authors'][0]['recid'] == 3
+    assert result['authors'][0]['affiliations'][0]['recid'] == 4
+    assert result['legacy']['recid'] == 5
+
+
+def test_populate_recids_walks_fields_not_in_the_schema():
+    record = _get_record()
+    record['unknown'] = [{'record': {'$ref': 'http://localhost:5000/api/literature/6'}}]
+
+    populate_recids(record, compile_ref_tree(SCHEMA))
+
+    assert record['unknown'][0]['recid'] == 6
+
+
+def test_for_schema():
+    @for_schema('hep.json')
+    def add_foo(sender, json, *args, **kwargs):
+        json['foo'] = 'bar'
+
+    record = {'$schema': 'http://localhost:5000/schemas/records/hep.json'}
+    add_foo(None, record)
+
+    assert record['foo'] == 'bar'
+
+    record = {'$schema': 'http://localhost:5000/schemas/records/authors.json'}
+    add_foo(None, record)
+
+    assert 'foo' not in record
+
+
+def test_index_enhancer_runs_the_enhancers_of_the_schema_in_order():
+    calls = []
+
+    @for_schema('hep.json')
+    def first(sender, json, *args, **kwargs):
+        calls.append('first')
+
+    @for_schema('authors.json')
+    def second(sender, json, *args, **kwargs):
+        calls.append('second')
+
+    @for_schema('hep.json')
+    def third(sender, json, *args, **kwargs):
+        calls.append('third')
+
+    index_enhancer = IndexEnhancer([first, second, third], schema_loader=lambda name: SCHEMA)
+
+    expected = _get_record(authors=100)
+    populate_recids(expected)
+
+    result = _get_record(authors=100)
+    index_enhancer.enhance(None, result)
+
+    assert expected == result
+    assert calls == ['first', 'third']
+
+
+def test_index_enhancer_walks_the_record_if_the_schema_cannot_be_compiled():
+    def schema_loader(name):
+        raise IOError(name)
+
+    index_enhancer = IndexEnhancer([], schema_loader=schema_loader)
+
+    expected = _get_record()
+    populate_recids(expected)
+
+    result = _get_record()
+    index_enhancer.enhance(None, result)
+
+    assert expected == result
+
+
+def test_measure_populate_recids_compares_the_walk_and_the_compiled_pass():
+    result = measure_populate_recids(authors=20, references=10, repeat=2, schema=SCHEMA)
+
+    assert ['walk', 'compiled'] == [name for name, _ in result]
+    assert all(elapsed >= 0 for _, elapsed in result)
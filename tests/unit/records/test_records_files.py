@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+
+from six import StringIO
+
+from inspirehep.modules.records.files import ChecksumStream
+
+
+def test_checksum_stream_computes_the_checksum_of_what_is_read():
+    stream = ChecksumStream(StringIO('dummy body'))
+
+    assert stream.read(5) == 'dummy'
+    assert stream.read() == ' body'
+
+    expected = 'md5:{}'.format(hashlib.md5('dummy body').hexdigest())
+    result = stream.checksum
+
+    assert expected == result
+    assert stream.size == len('dummy body')
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+from elasticsearch.helpers import BulkIndexError
+from elasticsearch.serializer import JSONSerializer
+from flask import current_app
+from mock import MagicMock, patch
+
+from inspirehep.modules.records.indexer import AdaptiveBulkIndexer, index_records
+
+
+def _get_client(statuses):
+    client = MagicMock()
+    client.transport.serializer = JSONSerializer()
+    client.bulk.side_effect = lambda body, **kwargs: {
+        'items': [
+            {'index': {'_id': str(i), 'status': statuses.pop(0)}}
+            for i in range(body.count('\n') // 2)
+        ],
+    }
+
+    return client
+
+
+def _get_actions(count):
+    return [
+        {'_op_type': 'index', '_index': 'records-hep', '_type': 'hep',
+         '_id': str(i), '_source': {'title': 'x' * 100}}
+        for i in range(count)
+    ]
+
+
+def test_adaptive_bulk_indexer_splits_requests_by_size():
+    config = {
+        'INDEXER_BULK_MIN_BYTES': 1000,
+        'INDEXER_BULK_MAX_BYTES': 1000,
+        'INDEXER_BULK_TARGET_LATENCY': 1.0,
+    }
+
+    with patch.dict(current_app.config, config):
+        client = _get_client([201] * 20)
+        indexer = AdaptiveBulkIndexer(client)
+
+        expected = (20, [])
+        result = indexer.bulk(_get_actions(20))
+
+        assert expected == result
+        assert client.bulk.call_count > 1
+        for call in client.bulk.call_args_list:
+            assert len(call[0][0]) <= 1000
+
+
+def test_adaptive_bulk_indexer_grows_requests_when_fast():
+    config = {
+        'INDEXER_BULK_MIN_BYTES': 1000,
+        'INDEXER_BULK_MAX_BYTES': 10000,
+        'INDEXER_BULK_TARGET_LATENCY': 1.0,
+    }
+
+    with patch.dict(current_app.config, config):
+        indexer = AdaptiveBulkIndexer(_get_client([201] * 20))
+        indexer.bulk(_get_actions(20))
+
+        assert indexer.chunk_bytes > 1000
+
+
+def test_adaptive_bulk_indexer_raises_on_error():
+    with patch.dict(current_app.config, {'INDEXER_BULK_MIN_BYTES': 1000}):
+        indexer = AdaptiveBulkIndexer(_get_client([201, 409]))
+
+        with pytest.raises(BulkIndexError):
+            indexer.bulk(_get_actions(2))
+
+        assert indexer.stats['errors'] == 1
+
+
+def _get_conflicting_bulk_indexer(statuses):
+    def bulk(actions, raise_on_error):
+        errors = [
+            {action['_op_type']: {'_id': action['_id'], 'status': status}}
+            for action, status in zip(actions, statuses)
+        ]
+        return len(statuses) - len(errors), errors
+
+    bulk_indexer = MagicMock()
+    bulk_indexer.bulk.side_effect = bulk
+
+    return bulk_indexer
+
+
+@patch('inspirehep.modules.records.indexer.es')
+@patch('inspirehep.modules.records.indexer._get_index_actions')
+@patch('inspirehep.modules.records.indexer.get_bulk_indexer')
+def test_index_records_skips_only_conflicts_with_newer_versions(
+        mock_get_bulk_indexer, mock_get_index_actions, mock_es):
+    mock_get_bulk_indexer.return_value = _get_conflicting_bulk_indexer([409, 409, 409, 409])
+    mock_get_index_actions.return_value = [
+        {'_op_type': 'index', '_index': 'records-hep', '_type': 'hep', '_id': 'newer', '_version': 3},
+        {'_op_type': 'index', '_index': 'records-hep', '_type': 'hep', '_id': 'older', '_version': 3},
+        {'_op_type': 'index', '_index': 'records-hep', '_type': 'hep', '_id': 'missing', '_version': 3},
+        {'_op_type': 'delete', '_index': 'records-hep', '_type': 'hep', '_id': 'deleted', '_version': 3},
+    ]
+    docs = {
+        'newer': {'_id': 'newer', 'found': True, '_version': 4},
+        'older': {'_id': 'older', 'found': True, '_version': 2},
+        'missing': {'_id': 'missing', 'found': False},
+        'deleted': {'_id': 'deleted', 'found': False},
+    }
+    mock_es.mget.side_effect = lambda body: {
+        'docs': [docs[doc['_id']] for doc in body['docs']],
+    }
+
+    expected = ['missing', 'older']
+    result = sorted(index_records({}))
+
+    assert expected == result
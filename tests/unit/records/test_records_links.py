@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+from inspirehep.modules.records.links import get_links, get_ref_target
+
+
+def test_get_ref_target():
+    expected = ('lit', '1')
+    result = get_ref_target('http://localhost:5000/api/literature/1')
+
+    assert expected == result
+
+
+def test_get_ref_target_returns_none_for_unknown_endpoints():
+    assert get_ref_target('http://localhost:5000/api/foo/1') is None
+
+
+def test_get_ref_target_returns_none_without_pid_value():
+    assert get_ref_target('http://localhost:5000/') is None
+
+
+def test_get_links():
+    record = {
+        'self': {'$ref': 'http://localhost:5000/api/literature/1'},
+        'authors': [
+            {
+                'affiliations': [
+                    {'record': {'$ref': 'http://localhost:5000/api/institutions/2'}},
+                    {'record': {'$ref': 'http://localhost:5000/api/institutions/3'}},
+                ],
+                'record': {'$ref': 'http://localhost:5000/api/authors/4'},
+            },
+        ],
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/5'}},
+            {'record': {'$ref': 'http://localhost:5000/api/literature/5'}},
+        ],
+    }
+
+    expected = {
+        ('authors.affiliations.record', 'ins', '2'),
+        ('authors.affiliations.record', 'ins', '3'),
+        ('authors.record', 'aut', '4'),
+        ('references.record', 'lit', '5'),
+    }
+    result = get_links(record)
+
+    assert expected == result
+
+
+def test_get_links_of_a_deleted_record():
+    expected = set()
+    result = get_links(None)
+
+    assert expected == result
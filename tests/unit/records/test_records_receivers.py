@@ -25,6 +25,7 @@ from __future__ import absolute_import, division, print_function
 from uuid import UUID
 
 import mock
+from flask import current_app
 
 from inspire_schemas.api import load_schema, validate
 from inspirehep.modules.records.receivers import (
@@ -33,11 +34,13 @@ from inspirehep.modules.records.receivers import (
     assign_uuid,
     populate_abstract_source_suggest,
     populate_affiliation_suggest,
+    populate_citation_count,
     populate_earliest_date,
     populate_inspire_document_type,
     populate_recid_from_ref,
     populate_title_suggest,
     populate_author_count,
+    populate_authors_preview,
 )
 
 
@@ -1049,6 +1052,33 @@ def test_populate_affiliation_suggest_does_nothing_if_record_is_not_institution(
     assert 'affiliation_suggest' not in record
 
 
+@mock.patch('inspirehep.modules.records.receivers.get_citation_count')
+def test_populate_citation_count_uses_the_prefetched_counts(mock_get_citation_count):
+    record = {
+        '$schema': 'http://localhost:5000/records/schemas/hep.json',
+        'control_number': 1,
+    }
+
+    populate_citation_count(None, record, citation_counts={1: 42})
+
+    assert record['citation_count'] == 42
+    mock_get_citation_count.assert_not_called()
+
+
+@mock.patch('inspirehep.modules.records.receivers.get_citation_count')
+def test_populate_citation_count_queries_the_counts_that_were_not_prefetched(mock_get_citation_count):
+    mock_get_citation_count.return_value = 3
+    record = {
+        '$schema': 'http://localhost:5000/records/schemas/hep.json',
+        'control_number': 1,
+    }
+
+    populate_citation_count(None, record, citation_counts={2: 42})
+
+    assert record['citation_count'] == 3
+    mock_get_citation_count.assert_called_once_with(1)
+
+
 def test_populate_author_count():
     record = {
         '$schema': 'http://localhost:5000/records/schemas/hep.json',
@@ -1079,3 +1109,41 @@ def test_populate_author_count_does_nothing_if_record_is_not_literature():
     populate_author_count(None, record)
 
     assert 'author_count' not in record
+
+
+def test_populate_authors_preview():
+    config = {'INSPIRE_AUTHORS_PREVIEW_SIZE': 2}
+    record = {
+        '$schema': 'http://localhost:5000/records/schemas/hep.json',
+        'authors': [
+            {
+                'full_name': 'Smith, John',
+                'name_variations': ['smith', 'smith, j', 'smith, john'],
+                'signature_block': 'SNATHj',
+                'uuid': '2f6b2f7c-1b8e-4ef1-a3e2-2f0d5e1b0cf8',
+            },
+            {'full_name': 'Rafelski, Johann'},
+            {'full_name': 'Rohan, George'},
+        ],
+    }
+
+    with mock.patch.dict(current_app.config, config):
+        populate_authors_preview(None, record)
+
+    expected = [
+        {'full_name': 'Smith, John'},
+        {'full_name': 'Rafelski, Johann'},
+    ]
+    result = record['authors_preview']
+
+    assert expected == result
+    assert record['number_of_authors'] == 3
+    assert 'name_variations' in record['authors'][0]
+
+
+def test_populate_authors_preview_does_nothing_if_record_is_not_literature():
+    record = {'$schema': 'http://localhost:5000/schemas/records/other.json'}
+
+    populate_authors_preview(None, record)
+
+    assert 'authors_preview' not in record
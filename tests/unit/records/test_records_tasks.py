@@ -146,3 +146,24 @@ def test_update_links_ignores_non_whitelisted_paths():
                 'record': {'$ref': 'http://localhost:5000/record/1'},
             }
         }
+
+
+def test_update_links_returns_whether_it_replaced_a_reference():
+    config = {
+        'INSPIRE_REF_UPDATER_WHITELISTS': {
+            'literature': [
+                'foos.record',
+            ],
+        },
+    }
+
+    with patch.dict(current_app.config, config):
+        record = {
+            '$schema': 'http://localhost:5000/schemas/record/hep.json',
+            'foos': [
+                {'record': {'$ref': 'http://localhost:5000/record/1'}},
+            ],
+        }
+
+        assert update_links(record, 'http://localhost:5000/record/1', 'http://localhost:5000/record/2')
+        assert not update_links(record, 'http://localhost:5000/record/1', 'http://localhost:5000/record/2')
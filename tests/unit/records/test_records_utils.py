@@ -22,7 +22,17 @@
 
 from __future__ import absolute_import, division, print_function
 
-from inspirehep.modules.records.utils import get_endpoint_from_record
+import pytest
+import requests_mock
+from mock import patch
+
+from inspirehep.modules.records.utils import (
+    FailedToOpenUrlPath,
+    download_urls,
+    get_authors_preview,
+    get_endpoint_from_record,
+    restore_authors,
+)
 
 
 def test_get_endpoint_from_record():
@@ -43,3 +53,93 @@ def test_get_endpoint_from_record_supports_relative_urls():
     result = get_endpoint_from_record(record)
 
     assert expected == result
+
+
+def test_get_authors_preview():
+    expected = [{'full_name': 'Smith, John', 'recid': 1}]
+    authors = [
+        {'full_name': 'Smith, John', 'name_suggest': {'input': ['smith']}, 'recid': 1},
+        {'full_name': 'Rafelski, Johann', 'recid': 2},
+    ]
+    result = get_authors_preview(authors, 1)
+
+    assert expected == result
+
+
+@patch('inspirehep.modules.records.utils.es')
+def test_restore_authors_fetches_only_truncated_lists(mock_es):
+    mock_es.mget.return_value = {
+        'docs': [
+            {
+                '_id': 'b',
+                'found': True,
+                '_source': {'authors': [{'full_name': 'Smith, John'}, {'full_name': 'Rafelski, Johann'}]},
+            },
+        ],
+    }
+    hits = [
+        {
+            '_id': 'a',
+            '_index': 'records-hep',
+            '_type': 'hep',
+            '_source': {
+                'authors_preview': [{'full_name': 'Smith, John'}],
+                'number_of_authors': 1,
+            },
+        },
+        {
+            '_id': 'b',
+            '_index': 'records-hep',
+            '_type': 'hep',
+            '_source': {
+                'authors_preview': [{'full_name': 'Smith, John'}],
+                'number_of_authors': 2,
+            },
+        },
+    ]
+
+    restore_authors(hits)
+
+    assert hits[0]['_source'] == {
+        'authors': [{'full_name': 'Smith, John'}],
+        'number_of_authors': 1,
+    }
+    assert hits[1]['_source']['authors'] == [{'full_name': 'Smith, John'}, {'full_name': 'Rafelski, Johann'}]
+
+    _, kwargs = mock_es.mget.call_args
+    assert kwargs['body'] == {'docs': [{'_index': 'records-hep', '_type': 'hep', '_id': 'b'}]}
+
+
+def test_download_urls_keeps_the_order_of_the_urls():
+    urls = ['http://example.org/{}.png'.format(i) for i in range(20)]
+
+    with requests_mock.Mocker() as requests_mocker:
+        for i, url in enumerate(urls):
+            requests_mocker.register_uri('GET', url, content='figure {}'.format(i))
+
+        downloaded = download_urls(urls)
+
+    expected = ['figure {}'.format(i) for i in range(20)]
+    result = [temporary_file.read() for temporary_file in downloaded]
+
+    assert expected == result
+
+
+def test_download_urls_raises_after_all_transfers_finished():
+    urls = [
+        'http://example.org/a.png',
+        'http://example.org/b.png',
+        'http://example.org/c.png',
+    ]
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.register_uri('GET', urls[0], content='a')
+        requests_mocker.register_uri('GET', urls[1], status_code=404)
+        requests_mocker.register_uri('GET', urls[2], content='c')
+
+        with pytest.raises(FailedToOpenUrlPath) as excinfo:
+            download_urls(urls)
+
+        assert requests_mocker.call_count == 3
+
+    assert 'http://example.org/b.png' in str(excinfo.value)
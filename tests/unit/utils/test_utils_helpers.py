@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Unit tests for the helpers."""
+
+from __future__ import absolute_import, division, print_function
+
+from inspirehep.utils.helpers import chunker
+
+
+def test_chunker():
+    expected = [[1, 2], [3, 4], [5]]
+    result = list(chunker([1, 2, 3, 4, 5], 2))
+
+    assert expected == result
+
+
+def test_chunker_consumes_the_iterable_lazily():
+    consumed = []
+
+    def _generate():
+        for i in range(5):
+            consumed.append(i)
+            yield i
+
+    chunks = chunker(_generate(), 2)
+
+    assert [0, 1] == next(chunks)
+    assert [0, 1] == consumed